@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Post, Comment, SubComment
+from .models import User, Post, Comment, SubComment, Job
 
 
 
@@ -10,3 +10,4 @@ admin.site.register(Post)
 
 admin.site.register(Comment)
 admin.site.register(SubComment)
+admin.site.register(Job)
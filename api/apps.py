@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api import signals  # noqa: F401  Connect the model signal handlers
+        from api import tasks  # noqa: F401  Register the job tasks
+        from api import metrics, reaction_buffer
+        metrics.install()
+        reaction_buffer.install()
@@ -0,0 +1,223 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ValidationError
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from api.authentication import AsyncJWTAuthentication, StreamJWTAuthentication
+from api.models import User, Post, Comment
+from api.pagination import CreatedAtCursorPagination
+from api.querysets import comments_for_serialization
+from api.serializers import CommentSerializer
+from api import reactions, realtime
+
+
+# Native async versions of the hottest endpoints, mounted under /api/async/ for
+# ASGI deployments. They answer exactly like their DRF counterparts in
+# api.views. Reads and lookups use the async ORM; the reaction and follow
+# writes go through api.reactions via sync_to_async because they need a
+# transaction, which the async ORM cannot open.
+
+
+_slots = weakref.WeakKeyDictionary()
+
+
+def database_slots():
+    # Caps requests doing database work per event loop, as a WSGI server's thread
+    # pool does; unbounded, hundreds of writers just queue on SQLite's write lock
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(getattr(settings, 'ASYNC_DB_CONCURRENCY', 32))
+    return _slots[loop]
+
+
+def respond(data=None, status_code=status.HTTP_200_OK):
+    # Same bytes DRF's JSONRenderer would produce
+    if data is None:
+        return HttpResponse(status=status_code)
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of DRF's APIView for plain Django views: JWT
+    authentication without blocking a thread, JSON request bodies in
+    ``request.data`` and DRF-shaped error responses. Every handler
+    requires an authenticated user, like ``IsAuthenticated``.
+    """
+    authentication_class = AsyncJWTAuthentication
+    parser_classes = [JSONParser, FormParser, MultiPartParser]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token auth only, so no CSRF check (DRF's APIView does the same)
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        authenticator = self.authentication_class()
+        try:
+            async with database_slots():
+                result = await authenticator.aauthenticate(request)
+                if result is None:
+                    raise NotAuthenticated()
+                request.user, request.auth = result
+                request.data = self.parse_body(request)
+                return await super().dispatch(request, *args, **kwargs)
+        except Http404:
+            return respond({'detail': 'No matching object found.'}, status.HTTP_404_NOT_FOUND)
+        except APIException as exc:
+            detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+            response = respond(detail, exc.status_code)
+            if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return response
+
+    def parse_body(self, request):
+        # DRF's parsers raise ParseError/UnsupportedMediaType, answered like any APIException
+        if not request.body:
+            return {}
+        return Request(request, parsers=[parser() for parser in self.parser_classes]).data
+
+    def drf_request(self, request):
+        # Serializers read query_params and build absolute URIs from a DRF request
+        wrapped = Request(request)
+        wrapped.user = request.user
+        return wrapped
+
+
+class AsyncReactionView(AsyncAPIView):
+    """
+    POST toggles, PUT/DELETE set the state idempotently. Configured per URL
+    with ``target`` and ``reaction``, e.g. ('post', 'like').
+    """
+    target = None
+    reaction = None
+
+    # (target, reaction) -> (message when set, message when withdrawn); same text as api.views
+    messages = {
+        ('post', 'like'): ('You have liked the post.', 'You have unliked the post.'),
+        ('post', 'dislike'): ('You have disliked the post.', 'You have undiliked the post.'),
+        ('comment', 'like'): ('You have liked the comment.', 'You have unliked the comment.'),
+        ('subcomment', 'like'): ('You have liked the sub-comment.', 'You have unliked the sub-comment.'),
+    }
+
+    async def post(self, request, target_id):
+        active = await sync_to_async(reactions.toggle)(self.target, self.reaction, target_id, request.user.id)
+        added, removed = self.messages[(self.target, self.reaction)]
+        return respond({'message': added if active else removed})
+
+    async def put(self, request, target_id):
+        await sync_to_async(reactions.add)(self.target, self.reaction, target_id, request.user.id)
+        return respond({f'{self.reaction}d': True})
+
+    async def delete(self, request, target_id):
+        await sync_to_async(reactions.remove)(self.target, self.reaction, target_id, request.user.id)
+        return respond(status_code=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncFollowUnfollowUserView(AsyncAPIView):
+    # Async twin of api.views.FollowUnfollowUserView
+
+    async def get_target(self, request, username):
+        try:
+            user_to_follow = await User.objects.aget(username=username)
+        except User.DoesNotExist:
+            raise Http404
+        if user_to_follow.pk == request.user.pk:
+            raise ValidationError({"error": "You cannot follow yourself."})
+        return user_to_follow
+
+    async def follow_response(self, user_to_follow, is_following, message):
+        followers_count = await User.objects.values_list('followers_count', flat=True).aget(pk=user_to_follow.pk)
+        return respond({"message": message, "is_following": is_following, "followers_count": followers_count})
+
+    async def post(self, request, username):
+        user_to_follow = await self.get_target(request, username)
+        if await sync_to_async(reactions.unfollow)(request.user, user_to_follow):
+            return await self.follow_response(user_to_follow, False, "You have unfollowed the user.")
+        await sync_to_async(reactions.follow)(request.user, user_to_follow)
+        return await self.follow_response(user_to_follow, True, "You are now following the user.")
+
+    async def put(self, request, username):
+        user_to_follow = await self.get_target(request, username)
+        await sync_to_async(reactions.follow)(request.user, user_to_follow)
+        return await self.follow_response(user_to_follow, True, "You are now following the user.")
+
+    async def delete(self, request, username):
+        user_to_follow = await self.get_target(request, username)
+        await sync_to_async(reactions.unfollow)(request.user, user_to_follow)
+        return respond(status_code=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncCommentListView(AsyncAPIView):
+    # Async twin of api.views.CommentListView, same opt-in cursor pagination
+
+    async def get(self, request, post_id):
+        if not await Post.objects.filter(id=post_id).aexists():
+            raise Http404
+        return respond(await sync_to_async(self.render_page)(self.drf_request(request), post_id))
+
+    def render_page(self, request, post_id):
+        # Paging and serialization stay sync: the relation resolver queries lazily
+        queryset = comments_for_serialization(Comment.objects.filter(post_id=post_id), request)
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        if page is None:
+            return CommentSerializer(queryset, many=True, context={'request': request}).data
+        serializer = CommentSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data).data
+
+
+class AsyncCommentCreateView(AsyncAPIView):
+    # Async twin of api.views.CommentCreateView
+
+    async def post(self, request):
+        drf_request = self.drf_request(request)
+        serializer = CommentSerializer(data=request.data, context={'request': drf_request})
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        # Likes are only ever written through the reaction endpoints, which keep like_count in step
+        comment = await Comment.objects.acreate(
+            author=request.user,
+            post=serializer.validated_data['post'],
+            content=serializer.validated_data['content'],
+        )
+        data = await sync_to_async(lambda: CommentSerializer(comment, context={'request': drf_request}).data)()
+        return respond(data, status.HTTP_201_CREATED)
+
+
+class PostEventStreamView(AsyncAPIView):
+    """
+    Server-Sent Events for ``?posts=1,2,3``: new comments and sub-comments
+    and reaction count changes, for every listed post the user may see, on
+    one connection. To change the set, reconnect with a new list.
+    """
+    authentication_class = StreamJWTAuthentication
+    max_posts = 100
+
+    async def get(self, request):
+        try:
+            requested = {int(value) for value in request.GET.get('posts', '').split(',') if value.strip()}
+        except ValueError:
+            raise ValidationError({'posts': 'Expected a comma separated list of post IDs.'})
+        if not requested:
+            raise ValidationError({'posts': 'This query parameter is required.'})
+        if len(requested) > self.max_posts:
+            raise ValidationError({'posts': f'At most {self.max_posts} posts per stream.'})
+
+        # Same visibility rule as PostsListView; unknown or private posts are left out
+        visible = Post.objects.filter(Q(is_public=True) | Q(author=request.user), id__in=requested)
+        post_ids = [post_id async for post_id in visible.values_list('id', flat=True)]
+
+        response = StreamingHttpResponse(realtime.stream(post_ids), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+        return response
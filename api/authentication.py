@@ -0,0 +1,239 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import HTTP_HEADER_ENCODING
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import AUTH_HEADER_TYPES, JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+# Identity claims every token carries (see MyTokenObtainPairSerializer); enough
+# to stand in for the user row on read-only requests. is_active is there for
+# check_user; login and refresh both refuse inactive users, so it is True in
+# any token this project mints
+CLAIM_FIELDS = ('username', 'email', 'first_name', 'last_name', 'is_active')
+
+
+class UserCache:
+    """
+    Small thread-safe TTL + LRU map of user id -> User for authentication.
+    Entries are dropped by api.signals whenever the user is saved or
+    deleted (profile edits, password changes); the TTL bounds staleness
+    for writes that bypass signals (``update()``) and for other processes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user id -> (expires at, user)
+        self.changed = OrderedDict()  # user id -> time.time() of the last invalidate(), for claims_are_fresh
+        self.hits = self.misses = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                self.entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+        # Each request gets its own copy, so views that modify request.user never touch the shared one
+        return copy.copy(entry[1])
+
+    def set(self, user):
+        ttl = getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[user.pk] = (time.monotonic() + ttl, copy.copy(user))
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > getattr(settings, 'AUTH_USER_CACHE_SIZE', 1024):
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id, changed=True):
+        now = time.time()
+        with self.lock:
+            self.entries.pop(user_id, None)
+            if not changed:
+                return
+            self.changed.pop(user_id, None)
+            self.changed[user_id] = now
+            # Only changes newer than AUTH_CLAIMS_MAX_AGE matter, older tokens are not trusted anyway
+            while self.changed and next(iter(self.changed.values())) < now - claims_max_age():
+                self.changed.popitem(last=False)
+
+    def changed_at(self, user_id):
+        with self.lock:
+            return self.changed.get(user_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.changed.clear()
+            self.hits = self.misses = 0
+
+
+user_cache = UserCache()
+
+
+def trusts_claims(request):
+    # Read-only requests may run as the user described by the signed token
+    return request.method in SAFE_METHODS and getattr(settings, 'AUTH_TRUST_TOKEN_CLAIMS', True)
+
+
+def claims_max_age():
+    return getattr(settings, 'AUTH_CLAIMS_MAX_AGE', 60)
+
+
+def claims_are_fresh(validated_token, user_id):
+    """
+    Whether the token was issued recently enough to stand in for the user:
+    within AUTH_CLAIMS_MAX_AGE seconds, and after the last change this
+    process saw to the user (deactivation, deletion, any edit).
+    """
+    issued_at = validated_token.get('iat')
+    if issued_at is None or time.time() - issued_at > claims_max_age():
+        return False
+    changed_at = user_cache.changed_at(user_id)
+    return changed_at is None or issued_at > changed_at
+
+
+def not_found_on_load(user):
+    # Deferred fields of a claims user load on access; a user deleted since the token was issued fails authentication
+    refresh_from_db = user.refresh_from_db
+
+    def load(*args, **kwargs):
+        try:
+            return refresh_from_db(*args, **kwargs)
+        except type(user).DoesNotExist as e:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+    return load
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without a query per request. Writes resolve the user
+    through ``user_cache``; read-only requests trust the token's signed
+    identity claims and get a User built from them, whose other fields are
+    deferred and load on first access. Claims are only trusted for
+    AUTH_CLAIMS_MAX_AGE seconds after the token was issued (login and
+    refresh check the account then), and not at all once this process saw
+    the user change; older tokens go through the cache, so a deactivated
+    account is locked out within AUTH_CLAIMS_MAX_AGE or AUTH_USER_CACHE_TTL,
+    whichever is longer. Set AUTH_TRUST_TOKEN_CLAIMS = False to always use
+    the cache.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if trusts_claims(request):
+            user = self.get_claims_user(validated_token)
+            if user is not None:
+                return user, validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_user_id(self, validated_token):
+        # Tokens carry the id as a string; the cache is keyed by the field's own type
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+        return self.user_model._meta.get_field(api_settings.USER_ID_FIELD).to_python(user_id)
+
+    def get_claims_user(self, validated_token):
+        # A cached user is the fresher of the two; tokens minted without the claims fall through to a lookup
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is not None:
+            return self.check_user(user, validated_token)
+        if not all(claim in validated_token for claim in CLAIM_FIELDS) or not claims_are_fresh(validated_token, user_id):
+            return None
+        claims = {api_settings.USER_ID_FIELD: user_id, **{claim: validated_token[claim] for claim in CLAIM_FIELDS}}
+        fields = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in claims]
+        user = self.user_model.from_db(DEFAULT_DB_ALIAS, fields, [claims[field] for field in fields])
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        user.refresh_from_db = not_found_on_load(user)
+        return user
+
+    def get_user(self, validated_token):
+        user = user_cache.get(self.get_user_id(validated_token))
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user)
+        return self.check_user(user, validated_token)
+
+    def check_user(self, user, validated_token):
+        # The checks JWTAuthentication.get_user runs on the row, repeated for cached users
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+class AsyncJWTAuthentication(CachedJWTAuthentication):
+    """
+    CachedJWTAuthentication for the async views in ``api.async_views``.
+    Header parsing and the signature check are CPU-only and run inline; a
+    cache miss goes through the async ORM instead of blocking a thread.
+    """
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if trusts_claims(request):
+            user = self.get_claims_user(validated_token)
+            if user is not None:
+                return user, validated_token
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        # Mirrors get_user
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+            user_cache.set(user)
+        return self.check_user(user, validated_token)
+
+
+class StreamJWTAuthentication(AsyncJWTAuthentication):
+    # EventSource cannot send headers, so event streams also accept ?token=<access token>
+
+    def get_header(self, request):
+        header = super().get_header(request)
+        token = request.GET.get('token')
+        if header is None and token:
+            return f'{AUTH_HEADER_TYPES[0]} {token}'.encode(HTTP_HEADER_ENCODING)
+        return header
@@ -0,0 +1,150 @@
+import os
+import time
+from collections import Counter
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+
+from api.images import IMAGE_FIELDS
+from api.models import MediaBlob
+from api.storage import BLOB_PREFIX, blob_storage, is_blob
+
+
+# Reference counts for the content-addressed image blobs (api/storage.py). The
+# image fields acquire and release blobs from api.signals; dedupe() moves
+# legacy uploads into blobs and collect() deletes files nothing points at.
+
+
+def acquire(name):
+    if not is_blob(name):
+        return
+    if not MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+        blob, created = MediaBlob.objects.get_or_create(name=name, defaults={'ref_count': 1})
+        if not created:  # Lost a race with another first reference
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release(name):
+    if is_blob(name):
+        MediaBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+
+
+def stored_name(instance):
+    field_name = IMAGE_FIELDS[instance._meta.label][0]
+    return getattr(instance, field_name).name or ''
+
+
+def previous_name(instance, update_fields=None):
+    # The name currently in the database, read only for updates that may change it
+    field_name = IMAGE_FIELDS[instance._meta.label][0]
+    if instance._state.adding or (update_fields is not None and field_name not in update_fields):
+        return None
+    row = type(instance)._base_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    return row or ''
+
+
+def referenced_names():
+    # Every file some row uses: the images themselves and their recorded derivatives
+    names = Counter()
+    for label, (field_name, _, _, variants_field, _) in IMAGE_FIELDS.items():
+        rows = apps.get_model(label).objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        for name, variants in rows.values_list(field_name, variants_field).iterator():
+            names[name] += 1
+            for files in (variants or {}).get('files', {}).values():
+                names.update(entry['name'] for entry in files)
+    return names
+
+
+def reconcile():
+    """
+    Rewrite every MediaBlob.ref_count from the image columns, like
+    reconcile_counters does for reaction counts. Returns the number of
+    blobs whose count changed.
+    """
+    counts = Counter()
+    for label, (field_name, *_rest) in IMAGE_FIELDS.items():
+        for name in apps.get_model(label).objects.values_list(field_name, flat=True).iterator():
+            if is_blob(name):
+                counts[name] += 1
+    changed = 0
+    with transaction.atomic():
+        for blob in MediaBlob.objects.select_for_update():
+            if blob.ref_count != counts.get(blob.name, 0):
+                blob.ref_count = counts.get(blob.name, 0)
+                blob.save(update_fields=['ref_count'])
+                changed += 1
+        existing = set(MediaBlob.objects.values_list('name', flat=True))
+        missing = [MediaBlob(name=name, ref_count=count) for name, count in counts.items() if name not in existing]
+        MediaBlob.objects.bulk_create(missing)
+    return changed + len(missing)
+
+
+def dedupe(dry_run=False):
+    """
+    Move every image still stored under its upload name into the blob
+    store and repoint the rows. Identical files collapse into one blob;
+    the old files stay until collect() finds them unreferenced. Returns
+    (files moved, distinct blobs, missing files).
+    """
+    moved, blobs, missing = 0, set(), []
+    for label, (field_name, *_rest) in IMAGE_FIELDS.items():
+        model = apps.get_model(label)
+        legacy = (
+            model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+            .exclude(**{f'{field_name}__startswith': BLOB_PREFIX})
+            .values_list(field_name, flat=True).distinct()
+        )
+        for name in list(legacy):
+            if not default_storage.exists(name):
+                missing.append(name)
+                continue
+            if dry_run:
+                blobs.add(name)
+                moved += 1
+                continue
+            with default_storage.open(name, 'rb') as handle:
+                new_name = blob_storage.save(name, handle)
+            # Queryset update: no signals, reconcile() sets the counts afterwards
+            model.objects.filter(**{field_name: name}).update(**{field_name: new_name})
+            blobs.add(new_name)
+            moved += 1
+    return moved, len(blobs), missing
+
+
+def collect(grace=3600, dry_run=False):
+    """
+    Delete files under the image directories and the blob store that no
+    row references, blobs only once their ref_count is zero too. Files
+    modified within ``grace`` seconds are kept: an upload is stored before
+    the row that will reference it is committed. Returns (files, bytes).
+    """
+    referenced = referenced_names()
+    live_blobs = set(MediaBlob.objects.filter(ref_count__gt=0).values_list('name', flat=True))
+    directories = {BLOB_PREFIX.rstrip('/')}
+    for label, (field_name, *_rest) in IMAGE_FIELDS.items():
+        directories.add(apps.get_model(label)._meta.get_field(field_name).upload_to.strip('/'))
+
+    cutoff = time.time() - grace
+    deleted, freed = 0, 0
+    for directory in sorted(directories):
+        root = os.path.join(settings.MEDIA_ROOT, directory)
+        for current, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(current, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                if name in referenced or name in live_blobs:
+                    continue
+                stats = os.stat(path)
+                if stats.st_mtime > cutoff:
+                    continue
+                if not dry_run:
+                    os.remove(path)
+                deleted += 1
+                freed += stats.st_size
+    if not dry_run:
+        stale = [pk for pk, name in MediaBlob.objects.filter(ref_count=0).values_list('pk', 'name') if name not in referenced]
+        MediaBlob.objects.filter(pk__in=stale).delete()
+    return deleted, freed
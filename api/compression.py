@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # Optional; without it responses are only ever gzipped
+    brotli = None
+
+
+# Content types worth compressing. Media is already compressed and event
+# streams must reach the client as each event is written.
+COMPRESSIBLE = ('application/json', 'application/javascript', 'application/xml', 'text/')
+UNCOMPRESSIBLE = ('text/event-stream',)
+
+accept_encoding_re = _lazy_re_compile(r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*')
+
+
+def negotiate(accept_encoding, available):
+    """
+    The coding in ``available`` (most preferred first) the Accept-Encoding
+    header ranks highest, or None. q=0 refuses a coding and ``*`` stands for
+    any coding not listed.
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        match = accept_encoding_re.fullmatch(item)
+        if not match:
+            continue
+        try:
+            weights[match[1].lower()] = float(match[2]) if match[2] is not None else 1.0
+        except ValueError:
+            continue
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def brotli_compressed(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        # Flushed per chunk, so a streamed list still arrives as it is produced
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def brotli_compressed_async(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    async for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses text responses, streamed ones included, with the best coding
+    the client accepts: brotli when the brotli package is installed, gzip
+    otherwise. Goes right after MetricsMiddleware so every other middleware
+    sees the plain body.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if (
+            not getattr(settings, 'API_COMPRESSION', True)
+            or response.has_header('Content-Encoding')
+            or not content_type.startswith(COMPRESSIBLE) or content_type in UNCOMPRESSIBLE
+        ):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'API_COMPRESSION_MIN_SIZE', 200):
+            return response
+
+        available = ('br', 'gzip') if brotli is not None else ('gzip',)
+        coding = negotiate(request.headers.get('Accept-Encoding', ''), available)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if coding == 'gzip':
+            return super().process_response(request, response)
+        if coding is None:
+            return response
+
+        quality = getattr(settings, 'API_BROTLI_QUALITY', 5)  # 11, the library default, is too slow per request
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = brotli_compressed_async(response.streaming_content, quality)
+            else:
+                response.streaming_content = brotli_compressed(response.streaming_content, quality)
+            del response.headers['Content-Length']
+        else:
+            compressed = brotli.compress(response.content, quality=quality)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Same as GZipMiddleware: the compressed body is a different byte sequence
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,121 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from api import reaction_buffer
+from api.pagination import KeysetPagination
+
+
+# Columns whose values stand in for a response, per resource. The author's
+# follower count is there for the viewer's is_following flag and like_count
+# for is_liked_by_user: the viewer's own (un)follows and likes move them.
+# Every user embedded in a response counts, reposts' included.
+SUMMARY_COLUMNS = (
+    'username', 'first_name', 'last_name', 'profile_picture', 'profile_picture_width',
+    'followers_count', 'following_count',
+)
+AUTHOR_VALIDATORS = tuple(f'author__{column}' for column in SUMMARY_COLUMNS)
+POST_VALIDATORS = (
+    'id', 'updated_at', 'like_count', 'dislike_count', 'is_public', 'image_width',
+    'reposted_from_id', 'reposted_from__updated_at', 'reposted_from__image_width',
+    *(f'reposted_from__author__{column}' for column in SUMMARY_COLUMNS),
+    # reposted_by is rendered with User.__str__
+    'reposted_by_id', 'reposted_by__username', 'reposted_by__first_name',
+    'reposted_by__followers_count', 'reposted_by__following_count',
+    *AUTHOR_VALIDATORS,
+)
+COMMENT_VALIDATORS = ('id', 'created_at', 'content', 'like_count', *AUTHOR_VALIDATORS)
+SUBCOMMENT_VALIDATORS = ('id', 'updated_at', 'like_count', *AUTHOR_VALIDATORS)
+USER_VALIDATORS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'bio', 'gender', 'profile_picture',
+    'profile_picture_width', 'location', 'phone_number', 'website', 'date_of_birth', 'age',
+    'followers_count', 'following_count',
+)
+
+
+def field_value(instance, path):
+    # 'author__followers_count' read off a model instance, None-safe like values() is
+    for name in path.split('__'):
+        if instance is None:
+            return None
+        instance = getattr(instance, name)
+    return instance
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET for generic list and detail views. Before anything is
+    serialized, the ``validator_fields`` of the rows the response would
+    show are hashed, with the viewer, the URL and the media type, into a
+    weak ETag. A request whose If-None-Match still matches gets a 304 and
+    the serializers never run.
+
+    Lists read those columns with the same keyset page query the response
+    would use, so a check costs one light query. Detail views go through
+    get_object(), keeping its permission checks, and reuse the object if
+    the response has to be built after all.
+
+    Last-Modified (the newest ``last_modified_field`` of the rows, which
+    also answers If-Modified-Since) is off unless a view sets that field,
+    and only a field that moves with every change to the payload will do.
+    None of the API's timestamps do: counter updates, the author's columns
+    and deleted rows leave updated_at alone, and comments have no edit
+    time at all, so the views rely on the ETag.
+    """
+    validator_fields = ('id',)
+    last_modified_field = None
+
+    def get(self, request, *args, **kwargs):
+        rows = self.get_validator_rows()
+        etag = self.compute_etag(rows)
+        last_modified = self.compute_last_modified(rows)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()),
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def is_detail(self):
+        return (self.lookup_url_kwarg or self.lookup_field) in self.kwargs
+
+    def retrieve(self, request, *args, **kwargs):
+        # The object the validators were read from, instead of a second lookup
+        instance = self._conditional_object if hasattr(self, '_conditional_object') else self.get_object()
+        return Response(self.get_serializer(instance).data)
+
+    def get_validator_rows(self):
+        if self.is_detail():
+            instance = self._conditional_object = self.get_object()
+            return [tuple(field_value(instance, field) for field in self.validator_fields)]
+
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        paginator = self.paginator
+        if isinstance(paginator, KeysetPagination) and paginator.is_enabled(self.request):
+            # The page the response will show, as plain values
+            paginator.page_size = paginator.get_page_size(self.request)
+            cursor = paginator.decode_cursor(self.request)
+            ordering = paginator.get_ordering(cursor.reverse if cursor else False)
+            fields = {*self.validator_fields, *(field.lstrip('-') for field in ordering)}
+            rows = paginator.fetch(queryset.values(*sorted(fields)), cursor, ordering)
+            return [tuple(row[field] for field in self.validator_fields) for row in rows]
+        return list(queryset.values_list(*self.validator_fields))
+
+    def compute_etag(self, rows):
+        viewer = self.request.user.pk if self.request.user.is_authenticated else None
+        # The viewer's unflushed likes and follows change their flags before any column moves
+        pending = reaction_buffer.buffer.user_state(viewer) if viewer and reaction_buffer.enabled() else []
+        state = repr((viewer, self.request.get_full_path(), self.request.accepted_media_type, rows, pending))
+        return f'W/"{hashlib.blake2b(state.encode(), digest_size=16).hexdigest()}"'
+
+    def compute_last_modified(self, rows):
+        if self.last_modified_field is None:
+            return None
+        index = self.validator_fields.index(self.last_modified_field)
+        return max((row[index] for row in rows if row[index] is not None), default=None)
@@ -0,0 +1,61 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.models import User, Post, Comment, SubComment
+
+
+# (model, counter column, M2M relation it counts)
+COUNTERS = [
+    (User, 'followers_count', 'followers'),
+    (User, 'following_count', 'following'),
+    (Post, 'like_count', 'likes'),
+    (Post, 'dislike_count', 'dislikes'),
+    (Comment, 'like_count', 'likes'),
+    (SubComment, 'like_count', 'likes'),
+]
+
+
+def adjust(model, pk, **deltas):
+    # Atomic in-database increment, e.g. adjust(Post, 1, like_count=1)
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def actual_count(model, relation):
+    # Correlated COUNT(*) over the through table for the outer row
+    m2m = model._meta.get_field(relation)
+    if m2m.auto_created:
+        # Reverse side of the relation, e.g. User.following
+        through = m2m.through
+        source = m2m.field.m2m_reverse_field_name()
+    else:
+        through = m2m.remote_field.through
+        source = m2m.m2m_field_name()
+    counts = (
+        through.objects.filter(**{source: OuterRef('pk')})
+        .values(source)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile(model, field, relation, batch_size=1000):
+    """
+    Rewrite ``field`` for every row whose stored value drifted from the
+    through table. Works through primary key ranges so each UPDATE only holds
+    the write lock for one batch. Returns the number of repaired rows.
+    """
+    repaired = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return repaired
+        last_pk = pks[-1]
+        batch = model.objects.filter(pk__gte=pks[0], pk__lte=last_pk)
+        drifted = batch.annotate(actual=actual_count(model, relation)).exclude(**{field: F('actual')})
+        repaired += model.objects.filter(pk__in=drifted.values('pk')).update(
+            **{field: actual_count(model, relation)}
+        )
@@ -0,0 +1,55 @@
+from rest_framework.serializers import ListSerializer
+
+
+def requested(request, param):
+    # ?fields=id,content&fields=author.username -> {'id', 'content', 'author.username'}
+    if request is None:
+        return set()
+    values = request.query_params.getlist(param)
+    return {item.strip() for value in values for item in value.split(',') if item.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients shape a serializer through the query string.
+
+    ``?fields=id,content,author.username`` keeps only the listed fields; dotted
+    paths reach into nested serializers and a bare ``author`` keeps the whole
+    nested object. ``?expand=author`` swaps an embedded summary for the full
+    representation listed in ``expandable_fields``.
+    """
+    expandable_fields = {}
+
+    def field_path(self):
+        # Dotted path of this serializer from the root, '' for the root itself
+        names = []
+        node = self
+        while node is not None:
+            if getattr(node, 'field_name', None):
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None:
+            return fields
+
+        path = self.field_path()
+        prefix = f'{path}.' if path else ''
+
+        expand = requested(request, 'expand')
+        for name, serializer_class in self.expandable_fields.items():
+            if name in fields and prefix + name in expand:
+                field = fields[name]
+                many = isinstance(field, ListSerializer)
+                fields[name] = serializer_class(many=many, read_only=True, source=field.source)
+
+        selected = requested(request, 'fields')
+        if not selected or path in selected:
+            return fields
+        wanted = {item[len(prefix):].split('.')[0] for item in selected if item.startswith(prefix)}
+        if not wanted:
+            return fields
+        return {name: field for name, field in fields.items() if name in wanted}
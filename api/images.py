@@ -0,0 +1,150 @@
+import atexit
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections
+from PIL import Image, ImageOps, features
+
+from api import jobs
+
+logger = logging.getLogger(__name__)
+
+
+# model label -> (image field, width column, height column, variants column, target widths)
+IMAGE_FIELDS = {
+    'api.Post': ('image', 'image_width', 'image_height', 'image_variants', (320, 640, 1280)),
+    'api.User': ('profile_picture', 'profile_picture_width', 'profile_picture_height', 'profile_picture_variants', (64, 160, 320)),
+}
+
+FORMATS = {
+    # format -> (Pillow format, extension, save options)
+    'image/webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'image/jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def output_formats():
+    return [mime for mime in FORMATS if mime != 'image/webp' or features.check('webp')]
+
+
+def variant_name(source, width, extension):
+    # post_images/photo.jpg -> post_images/variants/photo_320w.webp
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{width}w.{extension}')
+
+
+def needs_variants(instance):
+    field_name, _, _, variants_field, _ = IMAGE_FIELDS[instance._meta.label]
+    image = getattr(instance, field_name)
+    variants = getattr(instance, variants_field) or {}
+    return bool(image) and variants.get('source') != image.name
+
+
+def build_variants(source, widths, storage=default_storage):
+    """
+    Resize ``source`` to every width below its own (never upscaling) in each
+    output format, skipping files that already exist, e.g. for reposts that
+    share an image. Returns the JSON stored in the variants column.
+    """
+    with storage.open(source, 'rb') as handle:
+        original = ImageOps.exif_transpose(Image.open(handle))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+    targets = [width for width in widths if width < original.width] or [original.width]
+    variants = {'source': source, 'width': original.width, 'height': original.height, 'files': {}}
+    for mime in output_formats():
+        pil_format, extension, options = FORMATS[mime]
+        files = variants['files'][mime] = []
+        for width in targets:
+            height = max(1, round(original.height * width / original.width))
+            name = variant_name(source, width, extension)
+            if not storage.exists(name):
+                resized = original.resize((width, height), Image.LANCZOS)
+                if pil_format == 'JPEG' and resized.mode != 'RGB':
+                    resized = resized.convert('RGB')
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, **options)
+                name = storage.save(name, ContentFile(buffer.getvalue()))
+            files.append({'name': name, 'width': width, 'height': height})
+    return variants
+
+
+def update_variants(label, pk):
+    # Regenerate derivatives for one row; errors propagate (the job queue retries them)
+    model = apps.get_model(label)
+    field_name, width_field, height_field, variants_field, widths = IMAGE_FIELDS[label]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_variants(instance):
+        return
+    source = getattr(instance, field_name).name
+    variants = build_variants(source, widths)
+    # Only record the result if the image was not replaced in the meantime
+    model.objects.filter(pk=pk, **{field_name: source}).update(**{
+        width_field: variants['width'],
+        height_field: variants['height'],
+        variants_field: variants,
+    })
+
+
+def process(label, pk):
+    # Worker entry point for the thread and process executors
+    close_old_connections()
+    try:
+        update_variants(label, pk)
+    except Exception:
+        logger.exception('Building image variants failed for %s %s', label, pk)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        workers = getattr(settings, 'IMAGE_PIPELINE_WORKERS', 2)
+        if getattr(settings, 'IMAGE_PIPELINE_EXECUTOR', 'thread') == 'process':
+            # Forked workers must not reuse the parent's database connections
+            _executor = ProcessPoolExecutor(max_workers=workers, initializer=connections.close_all)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        atexit.register(_executor.shutdown, wait=True)
+    return _executor
+
+
+def schedule(instance):
+    # Called after commit; 'sync' mode (tests, management commands) runs inline
+    label = instance._meta.label
+    executor = getattr(settings, 'IMAGE_PIPELINE_EXECUTOR', 'thread')
+    if executor == 'sync':
+        process(label, instance.pk)
+    elif executor == 'jobs':
+        # Durable and retried, run by run_jobs; see api/tasks.py
+        jobs.enqueue('images.update_variants', {'label': label, 'pk': instance.pk})
+    else:
+        get_executor().submit(process, label, instance.pk)
+
+
+def srcset(variants, request=None, storage=default_storage):
+    # {'image/webp': 'https://.../a_320w.webp 320w, ...', ...} for <picture>/<img srcset>
+    if not variants or 'files' not in variants:
+        return None
+    result = {}
+    for mime, files in variants['files'].items():
+        urls = []
+        for entry in files:
+            url = storage.url(entry['name'])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.append(f"{url} {entry['width']}w")
+        result[mime] = ', '.join(urls)
+    return result
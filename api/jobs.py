@@ -0,0 +1,270 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from api import metrics
+from api.models import Job
+
+
+# Deferred work in the database, so it survives restarts and needs no
+# broker. enqueue() inserts a Job row, in the caller's transaction: a job
+# exists exactly when the data it works on was committed. run_jobs workers
+# claim due rows queue by queue, under each queue's concurrency limit
+# (JOBS_QUEUES), and run the registered task. A failure is retried with
+# exponential backoff up to the job's max_attempts; a worker that dies
+# mid-job loses its lease and the job is claimed again. Tasks must
+# therefore be idempotent.
+
+logger = logging.getLogger(__name__)
+
+
+class Task:
+    __slots__ = ('name', 'func', 'queue', 'max_attempts')
+
+    def __init__(self, name, func, queue, max_attempts):
+        self.name, self.func, self.queue, self.max_attempts = name, func, queue, max_attempts
+
+
+TASKS = {}  # name -> Task
+
+
+def task(name, queue='default', max_attempts=5):
+    # Register a function as a job task; its payload is passed as keyword arguments
+    def register(func):
+        TASKS[name] = Task(name, func, queue, max_attempts)
+        return func
+    return register
+
+
+def queue_limit(queue):
+    # Jobs of the queue running at once, across all workers
+    return getattr(settings, 'JOBS_QUEUES', {}).get(queue, getattr(settings, 'JOBS_DEFAULT_CONCURRENCY', 1))
+
+
+def backoff(attempts):
+    # Exponential with jitter, so jobs that failed together do not retry together
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF', 5)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOBS_RETRY_BACKOFF_MAX', 3600))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+def enqueue(name, payload=None, key=None, queue=None, delay=0):
+    """
+    Schedule task ``name`` with ``payload`` (JSON-serializable keyword
+    arguments) and return its Job. With ``key``, a job is only ever
+    created once per key: later calls return the existing job, finished
+    or not, until prune_jobs removes it. JOBS_RUNNER = 'sync' (tests)
+    runs the job inline instead of leaving it to run_jobs; with no worker
+    to retry it, a failure there is final.
+    """
+    registered = TASKS[name]
+    fields = {
+        'task': name, 'payload': payload or {}, 'queue': queue or registered.queue,
+        'max_attempts': registered.max_attempts, 'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+    sync = getattr(settings, 'JOBS_RUNNER', 'sync') == 'sync' and not delay
+    if sync:
+        fields.update(status=Job.RUNNING, attempts=1, started_at=fields['run_at'], locked_by='sync')
+    if key is None:
+        job = Job.objects.create(**fields)
+    else:
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(idempotency_key=key, **fields)
+        except IntegrityError:
+            return Job.objects.get(idempotency_key=key)
+    if sync:
+        execute(job)
+    return job
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim(queue, worker, count):
+    """
+    Mark up to ``count`` due jobs of ``queue`` as running for ``worker``,
+    without exceeding the queue's limit, and return them. The claim opens
+    with a write, which on SQLite takes the database write lock for the
+    whole transaction, so concurrent workers claim one after the other and
+    the running count they see is exact.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'JOBS_LEASE', 300))
+    with transaction.atomic():
+        expired = Job.objects.filter(queue=queue, status=Job.RUNNING, locked_until__lt=now)
+        expired.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, finished_at=now, locked_until=None, last_error='Lease expired: the worker stopped',
+        )
+        expired.update(status=Job.QUEUED, locked_by='', locked_until=None)
+
+        running = Job.objects.filter(queue=queue, status=Job.RUNNING).count()
+        room = min(count, queue_limit(queue) - running)
+        if room <= 0:
+            return []
+        ids = list(
+            Job.objects.filter(queue=queue, status=Job.QUEUED, run_at__lte=now)
+            .order_by('run_at', 'id').values_list('id', flat=True)[:room]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker, locked_until=now + lease, started_at=now, attempts=F('attempts') + 1,
+        )
+        return list(Job.objects.filter(id__in=ids, status=Job.RUNNING, locked_by=worker).order_by('run_at', 'id'))
+
+
+def execute(job):
+    """
+    Run one claimed job and record the outcome: done, queued again after
+    a backoff, or failed once its attempts are used up. Returns the status.
+    """
+    wait = max(0.0, (job.started_at - job.run_at).total_seconds())
+    started = time.perf_counter()
+    registered = TASKS.get(job.task)
+    try:
+        if registered is None:
+            raise LookupError(f'No task named {job.task!r} is registered')
+        # Inside the caller's transaction ('sync'), a savepoint keeps a failing task from breaking it
+        with transaction.atomic() if connection.in_atomic_block else nullcontext():
+            registered.func(**job.payload)
+    except Exception:
+        duration = time.perf_counter() - started
+        retry = registered is not None and job.attempts < job.max_attempts and job.locked_by != 'sync'
+        now = timezone.now()
+        fields = {'locked_by': '', 'locked_until': None, 'last_error': traceback.format_exc()[-4000:]}
+        if retry:
+            fields.update(status=Job.QUEUED, run_at=now + backoff(job.attempts))
+        else:
+            fields.update(status=Job.FAILED, finished_at=now)
+        logger.warning('Job %s (%s) failed on attempt %s', job.id, job.task, job.attempts, exc_info=True)
+        status = 'retry' if retry else Job.FAILED
+    else:
+        duration = time.perf_counter() - started
+        fields = {'status': Job.DONE, 'finished_at': timezone.now(), 'locked_by': '', 'locked_until': None}
+        status = Job.DONE
+    # Guarded by the lease: a job that was reclaimed after it expired belongs to its new worker
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by, status=Job.RUNNING).update(**fields)
+    metrics.registry.observe_job(job.queue, job.task, status, wait, duration)
+    return status
+
+
+def run_pending(queues, worker=None):
+    # Run due jobs inline until there are none left; returns how many ran (run_jobs --once)
+    worker = worker or worker_name()
+    ran = 0
+    while True:
+        claimed = [job for queue in queues for job in claim(queue, worker, queue_limit(queue))]
+        if not claimed:
+            return ran
+        for job in claimed:
+            execute(job)
+            ran += 1
+
+
+class WorkerPool:
+    """
+    Threads running claimed jobs. The dispatcher (the caller of run())
+    polls every queue with the pool's free threads, so one busy queue
+    cannot starve the others beyond its own limit, and stops claiming as
+    soon as stop() is called; jobs in flight are finished.
+    """
+
+    def __init__(self, queues, threads, poll_interval=1.0):
+        self.queues = queues
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = worker_name()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='jobs')
+        self.lock = threading.Lock()
+        self.active = Counter()  # queue -> jobs in flight here
+        self.stopping = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                claimed = False
+                for queue in self.queues:
+                    with self.lock:
+                        free = self.threads - sum(self.active.values())
+                    if free <= 0:
+                        break
+                    for job in claim(queue, self.name, free):
+                        claimed = True
+                        with self.lock:
+                            self.active[queue] += 1
+                        self.executor.submit(self.execute, job)
+                close_old_connections()
+                if not claimed:
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def execute(self, job):
+        try:
+            execute(job)
+        except Exception:
+            logger.exception('Recording the outcome of job %s failed; its lease will expire', job.id)
+        finally:
+            with self.lock:
+                self.active[job.queue] -= 1
+            close_old_connections()
+
+    def stop(self):
+        self.stopping.set()
+
+
+def queue_stats(now=None):
+    """
+    {queue: {status: count, 'oldest_due_seconds': float}} from the table,
+    for /metrics and run_jobs --stats. The age is how long the oldest due
+    job has been waiting, the number to alert on.
+    """
+    now = now or timezone.now()
+    stats = {}
+    for row in Job.objects.order_by().values('queue', 'status').annotate(count=Count('id')):
+        stats.setdefault(row['queue'], {})[row['status']] = row['count']
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by().values('queue').annotate(oldest=Min('run_at'))
+    for row in due:
+        stats.setdefault(row['queue'], {})['oldest_due_seconds'] = (now - row['oldest']).total_seconds()
+    return stats
+
+
+def exposition(stats):
+    # Prometheus lines for queue_stats(), appended to /metrics
+    lines = ['# HELP api_job_queue_depth Jobs in the table by queue and status.', '# TYPE api_job_queue_depth gauge']
+    for queue, counts in sorted(stats.items()):
+        for status, _ in Job.STATUSES:
+            lines.append(f'api_job_queue_depth{{queue="{metrics.escape(queue)}",status="{status}"}} {counts.get(status, 0)}')
+    lines += [
+        '# HELP api_job_oldest_due_seconds How long the oldest due job of the queue has waited.',
+        '# TYPE api_job_oldest_due_seconds gauge',
+    ]
+    for queue, counts in sorted(stats.items()):
+        lines.append(f'api_job_oldest_due_seconds{{queue="{metrics.escape(queue)}"}} {counts.get("oldest_due_seconds", 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def prune(days=7, batch_size=1000):
+    # Delete finished jobs older than ``days``, releasing their idempotency keys; failed ones are kept
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while ids := list(
+        Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).order_by().values_list('id', flat=True)[:batch_size]
+    ):
+        deleted += Job.objects.filter(id__in=ids).delete()[0]
+    return deleted
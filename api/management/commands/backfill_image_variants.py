@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from api import images
+
+
+class Command(BaseCommand):
+    help = 'Build resized/WebP derivatives and dimensions for existing post images and profile pictures.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Images resized in parallel.')
+        parser.add_argument('--force', action='store_true', help='Rebuild rows that already have variants.')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for label, (field_name, _, _, variants_field, _) in images.IMAGE_FIELDS.items():
+                model = apps.get_model(label)
+                rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                if options['force']:
+                    rows.update(**{variants_field: {}})
+                pks = [instance.pk for instance in rows.iterator() if images.needs_variants(instance)]
+                if options['workers'] > 1:
+                    list(executor.map(lambda pk: images.process(label, pk), pks))
+                else:
+                    for pk in pks:
+                        images.process(label, pk)
+                self.stdout.write(f'{label}: processed {len(pks)} image(s)')
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import User, Post
+
+
+# scenario -> (method, sync path, async path); {id} is a random post
+SCENARIOS = {
+    'like toggle': ('POST', '/api/posts/{id}/like/', '/api/async/posts/{id}/like/'),
+    'comment list': ('GET', '/api/posts/{id}/comments/', '/api/async/posts/{id}/comments/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare requests/sec and latency of the sync views under WSGI with the async views under ASGI '
+        'at several client concurrencies. Runs in-process against a scratch copy of the schema: WSGI '
+        'requests are served by a fixed thread pool (like a threaded WSGI server), ASGI requests on one '
+        'event loop (like uvicorn/daphne).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,50,500', help='Comma separated client counts.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run.')
+        parser.add_argument('--wsgi-threads', type=int, default=32, help='Worker threads of the simulated WSGI server.')
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--posts', type=int, default=200)
+        parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            old_name = connection.settings_dict['NAME']
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, options):
+        User.objects.bulk_create(
+            User(username=f'bench{i}', email=f'bench{i}@example.com', password='!') for i in range(options['users'])
+        )
+        users = list(User.objects.all())
+        Post.objects.bulk_create(Post(author=random.choice(users), content=f'post {i}') for i in range(options['posts']))
+        connection.close()  # Worker threads open their own connections
+        return [str(AccessToken.for_user(user)) for user in users], list(Post.objects.values_list('id', flat=True))
+
+    def run(self, options):
+        tokens, post_ids = self.seed(options)
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)  # Failures are counted, not printed
+        wsgi, asgi = WSGIHandler(), ASGIHandler()
+        factory = RequestFactory()
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        self.stdout.write(f"{'scenario':<14}{'server':<7}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for scenario in options['scenario'] or sorted(SCENARIOS):
+            method, sync_path, async_path = SCENARIOS[scenario]
+
+            def request_args(path):
+                return method, path.format(id=random.choice(post_ids)), random.choice(tokens)
+
+            for clients in levels:
+                with ThreadPoolExecutor(max_workers=options['wsgi_threads']) as pool:
+                    async def call_wsgi():
+                        loop = asyncio.get_running_loop()
+                        return await loop.run_in_executor(pool, self.call_wsgi, wsgi, factory, *request_args(sync_path))
+                    self.report(scenario, 'WSGI', clients, asyncio.run(self.load(call_wsgi, clients, options['requests'])))
+
+                async def call_asgi():
+                    return await self.call_asgi(asgi, *request_args(async_path))
+                self.report(scenario, 'ASGI', clients, asyncio.run(self.load(call_asgi, clients, options['requests'])))
+
+    def call_wsgi(self, handler, factory, method, path, token):
+        request = factory.generic(method, path, HTTP_HOST='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+        statuses = []
+        body = handler(request.environ, lambda status, headers, exc_info=None: statuses.append(status))
+        for _ in body:
+            pass
+        body.close()  # Fires request_finished, which closes the thread's connection
+        return int(statuses[0][:3])
+
+    async def call_asgi(self, handler, method, path, token):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+        }
+        received = False
+        connected = asyncio.Event()  # Never set: the client stays connected until the response is sent
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await connected.wait()
+
+        statuses = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        await handler(scope, receive, send)
+        return statuses[0]
+
+    async def load(self, call, clients, total):
+        # Closed loop: each client sends its next request as soon as the previous one returns
+        latencies, errors = [], 0
+        remaining = total
+
+        async def client():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                status = await call()
+                latencies.append(time.perf_counter() - started)
+                errors += status >= 400
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return time.perf_counter() - started, latencies, errors
+
+    def report(self, scenario, server, clients, result):
+        elapsed, latencies, errors = result
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100)
+            p50, p99 = cuts[49] * 1000, cuts[98] * 1000
+        else:
+            p50 = p99 = latencies[0] * 1000
+        self.stdout.write(
+            f'{scenario:<14}{server:<7}{clients:>8}{len(latencies) / elapsed:>10.0f}{p50:>10.1f}{p99:>10.1f}{errors:>8}'
+        )
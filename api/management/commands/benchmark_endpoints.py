@@ -0,0 +1,215 @@
+import gc
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, F, Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.counters import COUNTERS, reconcile
+from api.models import User, Post, Comment, SubComment
+from api.serializers import MyTokenObtainPairSerializer
+from api.timeline import rebuild_timeline
+
+
+# endpoint -> (method, path); {post} and {comment} are the most commented post and its
+# busiest comment, {author} the most followed account, picked after each dataset is seeded
+ENDPOINTS = {
+    'posts list': ('GET', '/api/posts/?page_size=20'),
+    'post detail': ('GET', '/api/posts/{post}/'),
+    'post thread': ('GET', '/api/posts/{post}/thread/'),
+    'feed': ('GET', '/api/feed/'),
+    'comment list': ('GET', '/api/posts/{post}/comments/?page_size=20'),
+    'subcomment list': ('GET', '/api/comments/{comment}/subcomments/list/?page_size=20'),
+    'followers list': ('GET', '/api/{author}/followers/?page_size=20'),
+    'follow toggle': ('POST', '/api/follow-unfollow/{author}/'),
+    'post like toggle': ('POST', '/api/posts/{post}/like/'),
+}
+
+# Latency differences below this are noise whatever the threshold says
+LATENCY_FLOOR_MS = 1.0
+
+
+def compare(results, baseline, threshold):
+    """
+    Regressions of ``results`` against ``baseline`` (both as written by this
+    command): any extra query, or a median more than ``threshold`` (a
+    fraction) slower. The gate uses p50 because a p95 over a few dozen
+    requests swings too much between runs. Rows missing from either side
+    are not compared.
+    """
+    previous = {(row['endpoint'], row['size']): row for row in baseline['results']}
+    regressions = []
+    for row in results['results']:
+        before = previous.get((row['endpoint'], row['size']))
+        if before is None:
+            continue
+        label = f"{row['endpoint']} @ {row['size']} posts"
+        if row['queries'] > before['queries']:
+            regressions.append(f"{label}: {before['queries']} -> {row['queries']} queries")
+        slower = row['p50_ms'] - before['p50_ms']
+        if slower > LATENCY_FLOOR_MS and row['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append(f"{label}: p50 {before['p50_ms']:.1f} -> {row['p50_ms']:.1f} ms")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the main API endpoints against seeded datasets of increasing size, in a scratch '
+        'database. Reports wall time, p50/p95 latency, SQL queries and response bytes per endpoint, '
+        'writes them as JSON and fails when they regress against a baseline file.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='500,2000,8000', help='Comma separated dataset sizes, in posts.')
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per endpoint and size.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), action='append', help='Only these endpoints.')
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--baseline', help='Results file to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.5, help='Allowed p50 slowdown, as a fraction.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            old_name = connection.settings_dict['NAME']
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                regressions = compare(results, json.load(handle), options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        endpoints = options['endpoint'] or list(ENDPOINTS)
+        results = {
+            'meta': {
+                'seed': options['seed'], 'repeat': options['repeat'], 'python': platform.python_version(),
+                'django': django.get_version(), 'sqlite': sqlite3.sqlite_version,
+            },
+            'results': [],
+        }
+        self.stdout.write(
+            f"{'endpoint':<18}{'posts':>7}{'wall ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}{'bytes':>9}"
+        )
+        for size in sorted(int(size) for size in options['sizes'].split(',')):
+            viewer, targets = self.seed(rng, size)
+            client = Client(HTTP_HOST='localhost')  # testserver is not in ALLOWED_HOSTS
+            token = MyTokenObtainPairSerializer.get_token(viewer).access_token
+            for endpoint in endpoints:
+                method, path = ENDPOINTS[endpoint]
+                row = self.measure(client, method, path.format(**targets), str(token), options['repeat'])
+                row.update(endpoint=endpoint, size=size)
+                results['results'].append(row)
+                self.stdout.write(
+                    f"{endpoint:<18}{size:>7}{row['wall_ms']:>10.1f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+                    f"{row['queries']:>9}{row['bytes']:>9}"
+                )
+        return results
+
+    def seed(self, rng, size):
+        """
+        Grow the dataset to ``size`` posts, keeping the same shape at every
+        size: a user per ten posts, about two comments per post, half a
+        reply per comment, a few likes each and a skewed follow graph.
+        Returns the viewer and the URL parameters of ENDPOINTS.
+        """
+        existing = Post.objects.count()
+        user_count = max(50, size // 10)
+        start = User.objects.count()
+        User.objects.bulk_create(
+            User(username=f'bench{i}', email=f'bench{i}@example.com', password='!') for i in range(start, user_count)
+        )
+        users = list(User.objects.order_by('id').values_list('id', flat=True))
+        popular = users[:max(5, len(users) // 20)]  # Most follows and likes go to the first few accounts
+
+        Follow = User.followers.through
+        Follow.objects.bulk_create(
+            [Follow(from_user_id=rng.choice(popular), to_user_id=rng.choice(users)) for _ in range(len(users) * 3)]
+            + [Follow(from_user_id=author, to_user_id=users[0]) for author in popular[1:]],
+            ignore_conflicts=True,
+        )
+        Follow.objects.filter(from_user_id=F('to_user_id')).delete()
+
+        last_post = Post.objects.aggregate(top=Max('id'))['top'] or 0
+        Post.objects.bulk_create(
+            Post(author_id=rng.choice(popular if rng.random() < 0.5 else users), content=f'post {i}')
+            for i in range(existing, size)
+        )
+        new_posts = list(Post.objects.filter(id__gt=last_post).values_list('id', flat=True))
+        Comment.objects.bulk_create(
+            Comment(post_id=rng.choice(new_posts[:max(1, len(new_posts) // 10)] if rng.random() < 0.5 else new_posts),
+                    author_id=rng.choice(users), content='comment')
+            for _ in range(len(new_posts) * 2)
+        )
+        comments = list(Comment.objects.filter(post_id__in=new_posts).values_list('id', flat=True))
+        SubComment.objects.bulk_create(
+            SubComment(comment_id=rng.choice(comments), author_id=rng.choice(users), content='reply')
+            for _ in range(len(comments) // 2)
+        )
+        Post.likes.through.objects.bulk_create(
+            [Post.likes.through(post_id=post_id, user_id=rng.choice(users)) for post_id in new_posts for _ in range(3)],
+            ignore_conflicts=True,
+        )
+        Comment.likes.through.objects.bulk_create(
+            [Comment.likes.through(comment_id=comment_id, user_id=rng.choice(users)) for comment_id in comments],
+            ignore_conflicts=True,
+        )
+        for model, field, relation in COUNTERS:
+            reconcile(model, field, relation, batch_size=5000)
+
+        viewer = User.objects.get(id=users[0])
+        rebuild_timeline(viewer)
+        post = Post.objects.annotate(n=Count('comments')).order_by('-n', 'id').values_list('id', flat=True).first()
+        comment = Comment.objects.filter(post_id=post).annotate(n=Count('sub_comments')).order_by('-n', 'id').first()
+        author = User.objects.exclude(id=viewer.id).order_by('-followers_count', 'id').first()
+        return viewer, {'post': post, 'comment': comment.id, 'author': author.username}
+
+    def measure(self, client, method, path, token, repeat):
+        call = getattr(client, method.lower())
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        for _ in range(2):
+            call(path, **headers)  # Warm up caches and lazy imports
+
+        timings, queries, size, status = [], [], 0, None
+        gc.collect()
+        gc.disable()  # Like timeit: a collection landing in one request is noise, not a regression
+        try:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as captured:
+                    request_started = time.perf_counter()
+                    response = call(path, **headers)
+                    timings.append((time.perf_counter() - request_started) * 1000)
+                queries.append(len(captured))
+                size, status = len(response.content), response.status_code
+            wall = (time.perf_counter() - started) * 1000
+        finally:
+            gc.enable()
+
+        cuts = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        return {
+            'requests': repeat, 'status': status, 'wall_ms': round(wall, 2),
+            'p50_ms': round(cuts[49], 3), 'p95_ms': round(cuts[94], 3),
+            'queries': max(queries), 'bytes': size,
+        }
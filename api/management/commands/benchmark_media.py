@@ -0,0 +1,69 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.views.static import serve as static_serve
+
+from api import media
+
+
+def consume(response):
+    # Drain the body the way a WSGI server would
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    response.close()
+    return size
+
+
+class Command(BaseCommand):
+    help = 'Compare media serving throughput of api.media.serve against django.views.static.serve.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='File under MEDIA_ROOT (default: the largest one).')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario.')
+
+    def largest_file(self, root):
+        candidates = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                full = os.path.join(directory, filename)
+                candidates.append((os.path.getsize(full), os.path.relpath(full, root)))
+        if not candidates:
+            raise CommandError(f'No files under {root}')
+        return max(candidates)[1]
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        path = options['path'] or self.largest_file(root)
+        factory = RequestFactory()
+        probe = media.serve(factory.get(f'/media/{path}'), path, document_root=root)
+        etag, last_modified = probe['ETag'], probe['Last-Modified']
+        consume(probe)
+
+        scenarios = [
+            ('full GET', {}),
+            ('If-None-Match', {'HTTP_IF_NONE_MATCH': etag}),
+            ('If-Modified-Since', {'HTTP_IF_MODIFIED_SINCE': last_modified}),
+            ('Range 0-65535', {'HTTP_RANGE': 'bytes=0-65535'}),
+        ]
+        views = [('django.views.static.serve', static_serve), ('api.media.serve', media.serve)]
+
+        self.stdout.write(f"{path} ({os.path.getsize(os.path.join(root, path))} bytes), {options['requests']} requests each")
+        self.stdout.write(f"{'scenario':<20}{'view':<28}{'req/s':>10}{'MB/s':>10}{'status':>8}")
+        for label, headers in scenarios:
+            for name, view in views:
+                transferred = 0
+                started = time.perf_counter()
+                for _ in range(options['requests']):
+                    response = view(factory.get(f'/media/{path}', **headers), path, document_root=root)
+                    status = response.status_code
+                    transferred += consume(response)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{label:<20}{name:<28}{options['requests'] / elapsed:>10.0f}"
+                    f"{transferred / elapsed / 1e6:>10.1f}{status:>8}"
+                )
@@ -0,0 +1,167 @@
+import gc
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+
+from api import renderers
+from api.models import User
+from api.serializers import MyTokenObtainPairSerializer
+
+
+# Unpaginated lists, the responses streaming is for
+ENDPOINTS = {
+    'profiles': '/api/profiles/',
+    'posts': '/api/posts/',
+}
+
+# mode -> settings; 'drf' is DRF's own encoder with the whole body built in memory
+MODES = {
+    'drf': {'API_JSON_ENCODER': 'stdlib', 'API_STREAM_LISTS': False},
+    'orjson': {'API_JSON_ENCODER': 'orjson', 'API_STREAM_LISTS': False},
+    'stream': {'API_JSON_ENCODER': 'orjson', 'API_STREAM_LISTS': True},
+}
+
+
+def status_bytes(field):
+    # VmRSS / VmHWM from /proc, None where there is no procfs
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the JSON renderers on large unpaginated lists in a scratch database seeded by '
+        'generate_social_graph: DRF\'s encoder, orjson, and orjson streamed in chunks. Reports time to '
+        'first byte, total time, throughput, peak Python allocations and peak RSS growth per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.02, help='generate_social_graph --scale (0.02: 2k users, 20k posts).')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per endpoint and mode.')
+        parser.add_argument('--mode', choices=sorted(MODES), action='append', help='Only these modes.')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), action='append', help='Only these endpoints.')
+        parser.add_argument('--encoding', default='identity', help='Accept-Encoding to send, e.g. gzip or br.')
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stderr.write('orjson is not installed; the orjson and stream modes fall back to the stdlib encoder')
+        with tempfile.TemporaryDirectory() as directory:
+            old_name = connection.settings_dict['NAME']
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, options):
+        call_command(
+            'generate_social_graph', scale=options['scale'], seed=options['seed'],
+            skip_search_index=True, stdout=StringIO(),
+        )
+        viewer = User.objects.order_by('-following_count', 'id').first()
+        token = MyTokenObtainPairSerializer.get_token(viewer).access_token
+        client = Client(HTTP_HOST='localhost')  # testserver is not in ALLOWED_HOSTS
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}', 'HTTP_ACCEPT_ENCODING': options['encoding']}
+
+        results = {'meta': {'scale': options['scale'], 'seed': options['seed'], 'encoding': options['encoding']}, 'results': []}
+        self.stdout.write(
+            f"{'endpoint':<10}{'mode':<8}{'bytes':>12}{'ttfb ms':>10}{'total ms':>10}{'MB/s':>8}"
+            f"{'py peak MB':>12}{'rss peak MB':>13}"
+        )
+        for endpoint in options['endpoint'] or list(ENDPOINTS):
+            for mode in options['mode'] or list(MODES):
+                with override_settings(**MODES[mode]):
+                    row = self.measure(client, ENDPOINTS[endpoint], headers, options['repeat'])
+                row.update(endpoint=endpoint, mode=mode)
+                results['results'].append(row)
+                rss = f"{row['rss_peak_mb']:>13.1f}" if row['rss_peak_mb'] is not None else f"{'-':>13}"
+                self.stdout.write(
+                    f"{endpoint:<10}{mode:<8}{row['bytes']:>12,}{row['ttfb_ms']:>10.1f}{row['total_ms']:>10.1f}"
+                    f"{row['mb_per_s']:>8.1f}{row['python_peak_mb']:>12.1f}{rss}"
+                )
+        return results
+
+    def fetch(self, client, path, headers):
+        # (time to the first body bytes, total time, body size)
+        started = time.perf_counter()
+        response = client.get(path, **headers)
+        if response.streaming:
+            chunks = iter(response.streaming_content)
+            first = next(chunks, b'')
+            ttfb = time.perf_counter() - started
+            size = len(first) + sum(len(chunk) for chunk in chunks)
+        else:
+            ttfb = time.perf_counter() - started
+            size = len(response.content)
+        response.close()
+        assert response.status_code == 200, response.status_code
+        return ttfb, time.perf_counter() - started, size
+
+    def measure(self, client, path, headers, repeat):
+        self.fetch(client, path, headers)  # Warm up caches and lazy imports
+
+        ttfbs, totals = [], []
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(repeat):
+                ttfb, total, size = self.fetch(client, path, headers)
+                ttfbs.append(ttfb)
+                totals.append(total)
+        finally:
+            gc.enable()
+
+        # Memory is measured on separate requests: tracemalloc slows what it watches and takes RSS of its own
+        gc.collect()
+        baseline = status_bytes('VmRSS') if reset_peak_rss() else None
+        self.fetch(client, path, headers)
+        peak = status_bytes('VmHWM') if baseline is not None else None
+        gc.collect()
+        tracemalloc.start()
+        try:
+            self.fetch(client, path, headers)
+            python_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        total = statistics.median(totals)
+        return {
+            'requests': repeat, 'bytes': size,
+            'ttfb_ms': round(statistics.median(ttfbs) * 1000, 2), 'total_ms': round(total * 1000, 2),
+            'mb_per_s': round(size / total / 2**20, 2),
+            'python_peak_mb': round(python_peak / 2**20, 2),
+            'rss_peak_mb': round(max(0, peak - baseline) / 2**20, 2) if peak is not None else None,
+        }
@@ -0,0 +1,86 @@
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure search latency on a synthetic corpus in a scratch SQLite file, '
+        'using the same FTS5 schema and ranked page query as /api/search/.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000, help='Synthetic posts to index.')
+        parser.add_argument('--vocabulary', type=int, default=50_000, help='Distinct words in the corpus.')
+        parser.add_argument('--queries', type=int, default=200, help='Queries per scenario.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def build(self, db, options):
+        rng = random.Random(options['seed'])
+        words = [f'w{i}' for i in range(options['vocabulary'])]
+        cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))  # Zipf-like frequencies
+        db.execute('CREATE TABLE api_post (id INTEGER PRIMARY KEY, author_id INTEGER, is_public INTEGER, content TEXT)')
+        db.execute(search.create_sql(search.POST_INDEX))
+        batch = []
+        for post_id in range(1, options['posts'] + 1):
+            content = ' '.join(rng.choices(words, cum_weights=cumulative, k=rng.randint(5, 40)))
+            batch.append((post_id, rng.randint(1, 10_000), rng.random() < 0.9, content))
+            if len(batch) == 10_000:
+                db.executemany('INSERT INTO api_post VALUES (?, ?, ?, ?)', batch)
+                batch = []
+        db.executemany('INSERT INTO api_post VALUES (?, ?, ?, ?)', batch)
+        db.execute(search.populate_sql(search.POST_INDEX))
+        db.execute(f"INSERT INTO {search.POST_INDEX}({search.POST_INDEX}) VALUES ('optimize')")
+        db.commit()
+        return words
+
+    def measure(self, db, terms, page_size, follow_cursor, candidates):
+        ordering = ('rank', 'id')
+        visibility = ('src.is_public = %s OR src.author_id = %s', [True, 42])
+        match = search.match_expression(terms)
+        started = time.perf_counter()
+        sql, params = search.ranked_sql(search.POST_INDEX, match, visibility, ordering, None, page_size + 1, candidates)
+        rows = db.execute(sql.replace('%s', '?'), params).fetchall()
+        if follow_cursor and len(rows) > page_size:
+            position = list(rows[page_size - 1])
+            sql, params = search.ranked_sql(search.POST_INDEX, match, visibility, ordering, position, page_size + 1, candidates)
+            db.execute(sql.replace('%s', '?'), params).fetchall()
+        return (time.perf_counter() - started) * 1000
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with tempfile.TemporaryDirectory() as directory:
+            db = sqlite3.connect(os.path.join(directory, 'search.sqlite3'))
+            started = time.perf_counter()
+            words = self.build(db, options)
+            size = os.path.getsize(os.path.join(directory, 'search.sqlite3'))
+            self.stdout.write(
+                f"Indexed {options['posts']} posts in {time.perf_counter() - started:.1f}s "
+                f"({size / 1e6:.0f} MB database)"
+            )
+
+            head, tail = words[:20], words[1000:]
+            scenarios = [
+                ('rare term', lambda: [rng.choice(tail)], False),
+                ('common term', lambda: [rng.choice(head)], False),
+                ('two terms', lambda: [rng.choice(head), rng.choice(words[20:1000])], False),
+                ('prefix (typeahead)', lambda: [rng.choice(words[:5000])[:3]], False),
+                ('rare term, page 2', lambda: [rng.choice(words[200:1000])], True),
+            ]
+            self.stdout.write(f"{'scenario':<22}{'candidates':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            for label, terms, follow_cursor in scenarios:
+                for candidates in (None, search.candidate_limit()):
+                    timings = [self.measure(db, terms(), 20, follow_cursor, candidates) for _ in range(options['queries'])]
+                    cuts = statistics.quantiles(timings, n=100)
+                    self.stdout.write(
+                        f"{label:<22}{candidates or 'all':>12}{cuts[49]:>10.1f}{cuts[94]:>10.1f}{cuts[98]:>10.1f}"
+                    )
+            db.close()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import blobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Move post images and profile pictures into the content-addressed blob store, so identical files are '
+        'kept once, recount blob references and delete files no row uses. Run backfill_image_variants '
+        'afterwards to rebuild derivatives under the new names.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600, help='Keep unreferenced files younger than this many seconds.')
+        parser.add_argument('--skip-collect', action='store_true', help='Only dedupe and recount, delete nothing.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would happen without changing anything.')
+
+    def handle(self, *args, **options):
+        moved, distinct, missing = blobs.dedupe(dry_run=options['dry_run'])
+        self.stdout.write(f'Moved {moved} file(s) into {distinct} blob(s)')
+        for name in missing:
+            self.stdout.write(self.style.WARNING(f'Missing file, left as is: {name}'))
+        if not options['dry_run']:
+            self.stdout.write(f'Recounted {blobs.reconcile()} blob reference count(s)')
+        if not options['skip_collect']:
+            deleted, freed = blobs.collect(grace=options['grace'], dry_run=options['dry_run'])
+            self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {deleted} file(s), {freed / 1e6:.1f} MB")
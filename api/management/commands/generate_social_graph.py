@@ -0,0 +1,287 @@
+import itertools
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api import search
+from api.counters import reconcile
+from api.models import User, Post, Comment, SubComment
+
+
+# Row counts at --scale 1, about 12M rows in total
+DEFAULTS = {
+    'users': 100_000,
+    'follows_per_user': 25,
+    'posts': 1_000_000,
+    'comments_per_post': 2.0,
+    'replies_per_comment': 0.5,
+    'likes_per_post': 3.0,
+    'dislikes_per_post': 0.3,
+    'likes_per_comment': 1.0,
+    'likes_per_reply': 0.5,
+}
+
+
+def power_law_weights(count, exponent):
+    # Cumulative Zipf weights: rank r is chosen with probability proportional to 1 / r**exponent
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def heavy_tailed(rng, mean):
+    # Non-negative integer with the given mean and a long tail
+    # Pareto, shape 2, rounded stochastically so small means are not truncated towards zero
+    return int(rng.paretovariate(2.0) * mean / 2 + rng.random())
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the database with a synthetic social graph for scale testing: power-law follower counts, '
+        'bursty posting, repost chains, comments, replies and reactions, with counter columns filled in. '
+        'Rows are appended to whatever the database already holds; the same --seed and sizes produce the '
+        'same data. Run rebuild_timelines afterwards if feeds are needed, and prune_trending --rebuild for trending.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplies every size (1.0 is about 12M rows).')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=20_000, help='Rows per executemany.')
+        parser.add_argument('--days', type=int, default=365, help='Span of the generated activity, ending now.')
+        parser.add_argument('--repost-rate', type=float, default=0.05, help='Share of posts that are reposts.')
+        parser.add_argument('--skip-search-index', action='store_true', help='Do not rebuild the full-text index.')
+        for name, value in DEFAULTS.items():
+            parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.totals = {}
+        scale = options['scale']
+        self.end = timezone.now()
+        self.start = self.end - timedelta(days=options['days'])
+
+        started = time.perf_counter()
+        with self.fast_writes():
+            user_ids = self.create_users(max(2, int(options['users'] * scale)))
+            self.create_follows(user_ids, options['follows_per_user'])
+            posts = self.create_posts(user_ids, max(1, int(options['posts'] * scale)), options)
+            comments = self.create_comments(
+                Comment, 'post_id', posts, user_ids, options['comments_per_post'], options['likes_per_comment'],
+            )
+            self.create_comments(
+                SubComment, 'comment_id', comments, user_ids, options['replies_per_comment'], options['likes_per_reply'],
+            )
+        for field, relation in (('followers_count', 'followers'), ('following_count', 'following')):
+            reconcile(User, field, relation, batch_size=5000)
+        if not options['skip_search_index'] and search.fts_enabled():
+            search.rebuild()
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.totals.values())
+        for table, rows in self.totals.items():
+            self.stdout.write(f'{table:<28}{rows:>12,}')
+        self.stdout.write(f"{'total':<28}{total:>12,} rows in {elapsed:.0f}s ({total / elapsed:,.0f} rows/s)")
+
+    @contextmanager
+    def fast_writes(self):
+        # Nothing is worth fsyncing until the run is over; SQLite refuses the switch inside a transaction
+        if connection.vendor != 'sqlite' or connection.in_atomic_block:
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            level = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous = OFF')
+            try:
+                yield
+            finally:
+                cursor.execute(f'PRAGMA synchronous = {int(level)}')
+
+    def insert(self, model, columns, rows):
+        """
+        Insert tuples of ``columns`` values in batches with executemany.
+        bulk_create spends most of its time preparing each field of each
+        object, several times what SQLite needs to store the row, so rows
+        stay plain tuples and every other column gets its model default,
+        prepared once. Counted per table.
+        """
+        fields = [model._meta.get_field(column) for column in columns]
+        defaults = [
+            field for field in model._meta.concrete_fields
+            if field.attname not in columns and not field.primary_key
+        ]
+        default_values = tuple(field.get_db_prep_save(field.get_default(), connection) for field in defaults)
+        names = ', '.join(connection.ops.quote_name(field.column) for field in [*fields, *defaults])
+        placeholders = ', '.join(['%s'] * (len(fields) + len(defaults)))
+        sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({names}) VALUES ({placeholders})'
+
+        inserted = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            for batch in batched(rows, self.batch_size):
+                cursor.executemany(sql, [row + default_values for row in batch])
+                inserted += len(batch)
+        self.totals[model._meta.db_table] = self.totals.get(model._meta.db_table, 0) + inserted
+
+    def next_id(self, model):
+        # Ids are assigned here so later tables can point at rows without reading them back
+        return (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+
+    def db_time(self, value):
+        return connection.ops.adapt_datetimefield_value(value)
+
+    def random_time(self):
+        return self.db_time(self.start + (self.end - self.start) * self.rng.random())
+
+    def create_users(self, count):
+        first = self.next_id(User)
+        self.insert(User, ('id', 'username', 'email', 'password', 'first_name', 'date_joined'), (
+            (user_id, f'gen{user_id}', f'gen{user_id}@example.com', '!', f'Gen{user_id}', self.random_time())
+            for user_id in range(first, first + count)
+        ))
+        user_ids = list(range(first, first + count))
+        # Popularity is independent of id order: rank -> user
+        self.popular = user_ids[:]
+        self.rng.shuffle(self.popular)
+        self.popularity = power_law_weights(count, 1.0)
+        return user_ids
+
+    def pick_popular(self, k=1):
+        return self.rng.choices(self.popular, cum_weights=self.popularity, k=k)
+
+    def create_follows(self, user_ids, follows_per_user):
+        # Who follows is roughly uniform, who gets followed is Zipf, so follower counts follow a power law
+        Follow = User.followers.through
+
+        def rows():
+            for follower in user_ids:
+                followed = set(self.pick_popular(heavy_tailed(self.rng, follows_per_user)))
+                followed.discard(follower)
+                for user_id in followed:
+                    yield user_id, follower
+
+        self.insert(Follow, ('from_user_id', 'to_user_id'), rows())
+
+    def post_times(self, count):
+        """
+        Bursty timestamps, oldest first: most posts cluster around burst
+        centers (news, evenings) with exponentially decaying density, the
+        rest are spread evenly.
+        """
+        span = (self.end - self.start).total_seconds()
+        centers = [self.rng.random() * span for _ in range(max(1, count // 500))]
+        center_weights = power_law_weights(len(centers), 0.8)
+        offsets = []
+        for _ in range(count):
+            if self.rng.random() < 0.7:
+                center = self.rng.choices(centers, cum_weights=center_weights)[0]
+                offsets.append(min(span, center + self.rng.expovariate(1 / 1800)))
+            else:
+                offsets.append(self.rng.random() * span)
+        offsets.sort()
+        return [self.start + timedelta(seconds=offset) for offset in offsets]
+
+    def likers(self, user_ids, mean):
+        count = min(heavy_tailed(self.rng, mean), len(user_ids))
+        return set(self.pick_popular(count)) if count else set()
+
+    def create_posts(self, user_ids, count, options):
+        """
+        Posts in time order, so ids and created_at agree. Prolific authors
+        are the popular ones. A repost points at a recent post, and
+        reposting a repost makes chains through ``reposted_from``. Returns
+        [(id, created_at)].
+        """
+        first = self.next_id(Post)
+        times = self.post_times(count)
+        recent = deque(maxlen=10_000)  # Recent post ids, the candidates for reposting
+        reposts = deque(maxlen=1_000)  # Recent reposts, so some reposts extend a chain
+        posts = []
+        likes, dislikes = [], []
+        Like, Dislike = Post.likes.through, Post.dislikes.through
+
+        def rows():
+            for offset, created_at in enumerate(times):
+                post_id = first + offset
+                author = self.pick_popular()[0]
+                reposted_from = None
+                if recent and self.rng.random() < options['repost_rate']:
+                    # Half of all reposts share something that was itself reposted
+                    pool = reposts if reposts and self.rng.random() < 0.5 else recent
+                    reposted_from = pool[-1 - min(int(self.rng.expovariate(1 / 50)), len(pool) - 1)]
+                    reposts.append(post_id)
+                liked = self.likers(user_ids, options['likes_per_post'])
+                disliked = self.likers(user_ids, options['dislikes_per_post']) - liked
+                likes.extend((post_id, user_id) for user_id in liked)
+                dislikes.extend((post_id, user_id) for user_id in disliked)
+                recent.append(post_id)
+                posts.append((post_id, created_at))
+                stamp = self.db_time(created_at)
+                yield (
+                    post_id, author, stamp, stamp,
+                    f'Post {post_id} ' + ' '.join(self.rng.choices(WORDS, k=self.rng.randint(3, 25))),
+                    reposted_from, author if reposted_from else None, len(liked), len(disliked),
+                )
+
+        columns = (
+            'id', 'author_id', 'created_at', 'updated_at', 'content',
+            'reposted_from_id', 'reposted_by_id', 'like_count', 'dislike_count',
+        )
+        for chunk in batched(rows(), self.batch_size * 5):
+            self.insert(Post, columns, chunk)
+            self.insert(Like, ('post_id', 'user_id'), likes)
+            self.insert(Dislike, ('post_id', 'user_id'), dislikes)
+            likes.clear()
+            dislikes.clear()
+        return posts
+
+    def create_comments(self, model, parent_field, parents, user_ids, per_parent, likes_per_row):
+        # Comments (or replies) land shortly after their parent; busy parents get most of them
+        first = self.next_id(model)
+        Like = model.likes.through
+        like_field = Like._meta.get_field(model._meta.model_name).attname
+        created, likes = [], []
+        content = 'comment' if model is Comment else 'reply'
+        columns = ('id', parent_field, 'author_id', 'content', 'created_at', 'like_count')
+        if model is SubComment:
+            columns += ('updated_at',)
+
+        def rows():
+            row_id = first
+            for parent_id, parent_time in parents:
+                for _ in range(heavy_tailed(self.rng, per_parent)):
+                    created_at = min(self.end, parent_time + timedelta(seconds=self.rng.expovariate(1 / 7200)))
+                    liked = self.likers(user_ids, likes_per_row)
+                    likes.extend((row_id, user_id) for user_id in liked)
+                    created.append((row_id, created_at))
+                    stamp = self.db_time(created_at)
+                    row = (row_id, parent_id, self.pick_popular()[0], content, stamp, len(liked))
+                    yield row + (stamp,) if model is SubComment else row
+                    row_id += 1
+
+        for chunk in batched(rows(), self.batch_size * 5):
+            self.insert(model, columns, chunk)
+            self.insert(Like, (like_field, 'user_id'), likes)
+            likes.clear()
+        return created
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+# Small vocabulary so full-text search has common and rare terms to chew on
+WORDS = (
+    'the a and to of in is it you that was for on are with as his they be at one have this from or had by '
+    'hot word but what some we can out other were all there when up use your how said an each she which do '
+    'their time if will way about many then them write would like so these her long make thing see him two '
+    'django python coffee weekend music travel photo sunset match game recipe garden launch release bug fix '
+    'concert movie review startup design city beach mountain book podcast election storm marathon'
+).split()
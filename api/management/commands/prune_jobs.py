@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete finished jobs older than --days, which also frees their idempotency keys. Failed jobs are '
+        'kept for inspection in the admin. Safe to run on a schedule.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--batch-size', type=int, default=1000, help='Jobs per DELETE.')
+
+    def handle(self, *args, **options):
+        deleted = jobs.prune(options['days'], options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} finished job(s)')
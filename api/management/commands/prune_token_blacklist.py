@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.tokens import prune_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens in small batches. Safe to run on a schedule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = prune_expired(options['batch_size'], options['pause'])
+        self.stdout.write(f'Pruned {outstanding} outstanding and {blacklisted} blacklisted token(s)')
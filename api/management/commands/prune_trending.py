@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import trending
+
+
+class Command(BaseCommand):
+    help = (
+        'Clear trending scores that have decayed below TRENDING_MIN_SCORE, in small batches. Safe to run on '
+        'a schedule; --rebuild first recomputes recent scores from the tables, e.g. after a bulk import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Posts per UPDATE.')
+        parser.add_argument('--rebuild', action='store_true', help='Recompute scores for recent posts first.')
+        parser.add_argument('--days', type=int, default=7, help='With --rebuild, how far back posts are scored.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            scored = trending.rebuild(options['days'], options['batch_size'])
+            self.stdout.write(f'Scored {scored} post(s)')
+        cleared = trending.prune(options['batch_size'])
+        self.stdout.write(f'Cleared {cleared} decayed trending score(s)')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FTS5 search tables from posts and users (backfill after deploy or drift).'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'{connection.vendor} has no FTS5 index; search uses the icontains fallback there.')
+        for index, rows in search.rebuild().items():
+            self.stdout.write(f'{index}: indexed {rows} row(s)')
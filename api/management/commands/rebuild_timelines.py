@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.models import User
+from api.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from the follow graph (backfill after deploy or drift).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone).')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        rebuilt = 0
+        for user in users.iterator():
+            rebuild_timeline(user)
+            rebuilt += 1
+        self.stdout.write(f'Rebuilt {rebuilt} timeline(s)')
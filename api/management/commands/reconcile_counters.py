@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import COUNTERS, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Repair denormalized reaction counters that drifted from the M2M through tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows rewritten per UPDATE.')
+
+    def handle(self, *args, **options):
+        for model, field, relation in COUNTERS:
+            repaired = reconcile(model, field, relation, batch_size=options['batch_size'])
+            self.stdout.write(f'{model.__name__}.{field}: repaired {repaired} row(s)')
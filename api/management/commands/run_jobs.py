@@ -0,0 +1,51 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import jobs, metrics
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs from the Job table with a pool of threads, claiming them queue by queue under '
+        'JOBS_QUEUES limits, until SIGTERM or Ctrl-C; jobs in flight are finished first. Run as many of these '
+        'as needed, the limits hold across all of them. With METRICS_DIR set, job timings reach /metrics.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', help='Only these queues (default: all configured ones).')
+        parser.add_argument('--threads', type=int, help='Jobs run at once by this worker (default: sum of the queue limits).')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle.')
+        parser.add_argument('--once', action='store_true', help='Run the due jobs inline, then exit.')
+        parser.add_argument('--stats', action='store_true', help='Print queue depths and exit.')
+
+    def handle(self, *args, **options):
+        configured = {*getattr(settings, 'JOBS_QUEUES', {}), *(task.queue for task in jobs.TASKS.values())}
+        queues = options['queue'] or sorted(configured)
+
+        if options['stats']:
+            for queue, counts in sorted(jobs.queue_stats().items()):
+                summary = ', '.join(f'{status} {counts.get(status, 0)}' for status, _ in jobs.Job.STATUSES)
+                self.stdout.write(f"{queue:<12}{summary}, oldest due {counts.get('oldest_due_seconds', 0):.1f}s")
+            return
+
+        if options['once']:
+            ran = jobs.run_pending(queues)
+            self.stdout.write(f'Ran {ran} job(s)')
+            self.flush_metrics()
+            return
+
+        threads = options['threads'] or sum(jobs.queue_limit(queue) for queue in queues)
+        pool = jobs.WorkerPool(queues, threads, options['poll_interval'])
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: pool.stop())
+        self.stdout.write(f"Worker {pool.name}: {threads} thread(s) on {', '.join(queues)}")
+        pool.run()
+        self.flush_metrics()
+        self.stdout.write('Stopped')
+
+    def flush_metrics(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory:
+            metrics.registry.flush(directory)
@@ -0,0 +1,163 @@
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from django.views.decorators.http import require_safe
+
+from api.storage import is_blob
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def is_immutable(path):
+    # Derivative and content-addressed names never change content, so clients may cache them forever
+    return '/variants/' in f'/{path}' or is_blob(path)
+
+
+def make_etag(stats):
+    # Strong validator: any rewrite of the file changes size, mtime or inode
+    digest = hashlib.md5(f'{stats.st_ino}-{stats.st_size}-{stats.st_mtime_ns}'.encode(), usedforsecurity=False)
+    return f'"{digest.hexdigest()}"'
+
+
+def not_modified(request, etag, mtime):
+    # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags or f'W/{etag}' in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def parse_range(header, size):
+    """
+    Returns (start, end) inclusive for a single satisfiable byte range, None
+    for a header we answer with the full body (absent or multi-range), or
+    False if the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)  # Suffix range: the final N bytes
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def range_applies(request, etag, mtime):
+    # If-Range: only honour the Range header when the client's copy is current
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+def iter_range(path, start, length):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def sendfile_response(path, fullpath):
+    # Hand the body to the front proxy: nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile
+    mode = getattr(settings, 'MEDIA_SENDFILE', None)
+    response = HttpResponse()
+    if mode == 'nginx':
+        prefix = getattr(settings, 'MEDIA_SENDFILE_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + path.lstrip('/')
+    else:
+        response['X-Sendfile'] = fullpath
+    return response
+
+
+@require_safe
+def serve(request, path, document_root=None):
+    """
+    Media view replacing ``django.views.static.serve``: strong ETags,
+    304 on If-None-Match/If-Modified-Since, single byte ranges (206/416),
+    long-lived caching for immutable derivatives and an optional
+    X-Accel-Redirect/X-Sendfile handoff (``MEDIA_SENDFILE``).
+    """
+    document_root = document_root or settings.MEDIA_ROOT
+    try:
+        fullpath = safe_join(document_root, path)
+        stats = os.stat(fullpath)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404('File does not exist')
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404('File does not exist')
+
+    etag = make_etag(stats)
+    cache_headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stats.st_mtime),
+        'Cache-Control': (
+            'public, max-age=31536000, immutable' if is_immutable(path)
+            else f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+        ),
+    }
+    if not_modified(request, etag, stats.st_mtime):
+        response = HttpResponseNotModified()
+        for header, value in cache_headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    if getattr(settings, 'MEDIA_SENDFILE', None):
+        # The proxy handles ranges and the body; we only validate and set headers
+        response = sendfile_response(path, fullpath)
+        response['Content-Type'] = content_type
+    else:
+        byte_range = None
+        if range_applies(request, etag, stats.st_mtime):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), stats.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stats.st_size}'
+        elif byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(iter_range(fullpath, start, length), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{stats.st_size}'
+            response['Content-Length'] = str(length)
+        else:
+            # FileResponse goes through wsgi.file_wrapper, i.e. sendfile(2) under most servers
+            response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(stats.st_size)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['Accept-Ranges'] = 'bytes'
+    for header, value in cache_headers.items():
+        response[header] = value
+    return response
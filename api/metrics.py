@@ -0,0 +1,344 @@
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+
+# Per-view request metrics in the Prometheus text format. MetricsMiddleware
+# times each request; the database, serializer and renderer timings come
+# from hooks installed by install() and land on the request's RequestStats.
+# Every process aggregates on its own, and with METRICS_DIR set writes
+# snapshots there that /metrics merges, so any worker can answer a scrape.
+# run_jobs workers record the jobs they run the same way.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152)
+
+# name -> (help, buckets, RequestStats attribute); all labelled by view and method
+HISTOGRAMS = {
+    'api_request_duration_seconds': ('Request latency, rendering included.', LATENCY_BUCKETS, 'duration'),
+    'api_db_duration_seconds': ('Time spent executing SQL per request.', LATENCY_BUCKETS, 'db'),
+    'api_db_queries': ('SQL queries per request.', QUERY_BUCKETS, 'queries'),
+    'api_serializer_duration_seconds': (
+        'Time spent producing serializer.data per request, the queries it runs included.', LATENCY_BUCKETS, 'serializer',
+    ),
+    'api_render_duration_seconds': ('Time spent rendering DRF responses per request.', LATENCY_BUCKETS, 'render'),
+    'api_response_size_bytes': ('Response body size; streamed responses are not counted.', SIZE_BUCKETS, 'size'),
+}
+
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Jobs run by this process (api/jobs.py), labelled by queue and task
+JOB_HISTOGRAMS = {
+    'api_job_wait_seconds': ('Time from when a job was due to when a worker started it.', JOB_BUCKETS),
+    'api_job_duration_seconds': ('Time spent running a job.', JOB_BUCKETS),
+}
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class RequestStats:
+    __slots__ = ('duration', 'db', 'queries', 'serializer', 'render', 'size', 'timing')
+
+    def __init__(self):
+        self.duration = self.db = self.serializer = self.render = 0.0
+        self.queries = 0
+        self.size = None
+        self.timing = set()  # Hooks in progress, so nested serializers are not counted twice
+
+
+current = ContextVar('request_stats', default=None)
+
+
+class Registry:
+    """
+    This process's histograms, keyed by (view, method). Each request takes
+    the lock once to record all its observations; counts are per bucket
+    and made cumulative only when exposed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}  # (view, method) -> {name: [bucket counts..., overflow, sum]}
+        self.responses = {}  # (view, method, status) -> count
+        self.jobs = {}  # (queue, task) -> {name: [bucket counts..., overflow, sum]}
+        self.job_results = {}  # (queue, task, status) -> count
+        self.flushed_at = 0.0
+
+    def observe(self, view, method, status, stats):
+        key = (view, method)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    name: [0] * (len(buckets) + 1) + [0.0] for name, (_, buckets, _) in HISTOGRAMS.items()
+                }
+            for name, (_, buckets, attribute) in HISTOGRAMS.items():
+                value = getattr(stats, attribute)
+                if value is None:
+                    continue
+                counts = series[name]
+                counts[bisect_left(buckets, value)] += 1
+                counts[-1] += value
+            status_key = (view, method, str(status))
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+        self.maybe_flush()
+
+    def observe_job(self, queue, task, status, wait, duration):
+        key = (queue, task)
+        with self.lock:
+            series = self.jobs.get(key)
+            if series is None:
+                series = self.jobs[key] = {
+                    name: [0] * (len(buckets) + 1) + [0.0] for name, (_, buckets) in JOB_HISTOGRAMS.items()
+                }
+            for name, value in (('api_job_wait_seconds', wait), ('api_job_duration_seconds', duration)):
+                counts = series[name]
+                counts[bisect_left(JOB_HISTOGRAMS[name][1], value)] += 1
+                counts[-1] += value
+            status_key = (queue, task, status)
+            self.job_results[status_key] = self.job_results.get(status_key, 0) + 1
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if directory and time.monotonic() - self.flushed_at >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+            self.flush(directory)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'series': [[view, method, {name: list(counts) for name, counts in series.items()}]
+                           for (view, method), series in self.series.items()],
+                'responses': [[*key, count] for key, count in self.responses.items()],
+                'jobs': [[queue, task, {name: list(counts) for name, counts in series.items()}]
+                         for (queue, task), series in self.jobs.items()],
+                'job_results': [[*key, count] for key, count in self.job_results.items()],
+            }
+
+    def flush(self, directory):
+        # Written whole and renamed into place, so a reader never sees half a snapshot
+        self.flushed_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(temporary, os.path.join(directory, f'{os.getpid()}.json'))
+
+    def collect(self):
+        """
+        Snapshots of every process: this one's live counts plus, with
+        METRICS_DIR, the files other workers flushed. Files of exited
+        workers are kept so totals never go backwards; clear the directory
+        when the whole server restarts.
+        """
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return [self.snapshot()]
+        self.flush(directory)
+        snapshots = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(directory, filename)) as handle:
+                        snapshots.append(json.load(handle))
+                except (OSError, ValueError):
+                    continue  # Removed or replaced while listing
+        return snapshots
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+            self.responses.clear()
+            self.jobs.clear()
+            self.job_results.clear()
+
+
+registry = Registry()
+
+
+def merge(snapshots, series_key='series', counts_key='responses'):
+    series, responses = {}, {}
+    for snapshot in snapshots:
+        for first, second, histograms in snapshot.get(series_key, ()):
+            merged = series.setdefault((first, second), {})
+            for name, counts in histograms.items():
+                if name in merged:
+                    merged[name] = [a + b for a, b in zip(merged[name], counts)]
+                else:
+                    merged[name] = list(counts)
+        for first, second, status, count in snapshot.get(counts_key, ()):
+            responses[(first, second, status)] = responses.get((first, second, status), 0) + count
+    return series, responses
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def exposition(snapshots):
+    # Prometheus text format 0.0.4
+    series, responses = merge(snapshots)
+    lines = []
+    for name, (help_text, buckets, _) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (view, method), histograms in sorted(series.items()):
+            counts = histograms.get(name)
+            if counts is None:
+                continue
+            labels = f'view="{escape(view)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {counts[-1]}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+    lines += ['# HELP api_responses_total Responses by view, method and status.', '# TYPE api_responses_total counter']
+    for (view, method, status), count in sorted(responses.items()):
+        lines.append(f'api_responses_total{{view="{escape(view)}",method="{method}",status="{status}"}} {count}')
+
+    jobs, results = merge(snapshots, 'jobs', 'job_results')
+    for name, (help_text, buckets) in JOB_HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (queue, task), histograms in sorted(jobs.items()):
+            labels = f'queue="{escape(queue)}",task="{escape(task)}"'
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], histograms[name]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histograms[name][-1]}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+    lines += ['# HELP api_jobs_total Jobs run by queue, task and outcome.', '# TYPE api_jobs_total counter']
+    for (queue, task, status), count in sorted(results.items()):
+        lines.append(f'api_jobs_total{{queue="{escape(queue)}",task="{escape(task)}",status="{status}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    view = getattr(match.func, 'view_class', match.func)
+    return getattr(view, '__name__', 'unknown')
+
+
+def record(request, response, stats, started):
+    stats.duration = time.perf_counter() - started
+    if not response.streaming:
+        stats.size = len(response.content)
+    method = request.method if request.method in METHODS else 'OTHER'  # Keeps label values bounded
+    registry.observe(view_name(request), method, response.status_code, stats)
+
+
+class MetricsMiddleware:
+    """
+    Times every request and records it under its view class. Goes first in
+    MIDDLEWARE so the latency covers the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        stats, started = RequestStats(), time.perf_counter()
+        token = current.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        record(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        stats, started = RequestStats(), time.perf_counter()
+        token = current.set(stats)  # sync_to_async copies the context, so queries in worker threads count too
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        record(request, response, stats, started)
+        return response
+
+
+def time_queries(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db += time.perf_counter() - started
+        stats.queries += 1
+
+
+def timed(getter, attribute):
+    # Wraps a property getter so the outermost call adds its time to the request's stats
+    def wrapper(self):
+        stats = current.get()
+        if stats is None or attribute in stats.timing:
+            return getter(self)
+        stats.timing.add(attribute)
+        started = time.perf_counter()
+        try:
+            return getter(self)
+        finally:
+            setattr(stats, attribute, getattr(stats, attribute) + time.perf_counter() - started)
+            stats.timing.discard(attribute)
+    wrapper.timed = True
+    return wrapper
+
+
+def add_query_timer(sender, connection, **kwargs):
+    if time_queries not in connection.execute_wrappers:  # The wrapper outlives reconnects
+        connection.execute_wrappers.append(time_queries)
+
+
+def install():
+    """
+    Hook SQL execution, serializer.data and DRF rendering. Called from
+    ApiConfig.ready(); safe to call more than once.
+    """
+    from rest_framework.response import Response
+    from rest_framework.serializers import BaseSerializer
+
+    if not getattr(settings, 'METRICS_ENABLED', True) or getattr(BaseSerializer.data.fget, 'timed', False):
+        return
+    BaseSerializer.data = property(timed(BaseSerializer.data.fget, 'serializer'))
+    Response.rendered_content = property(timed(Response.rendered_content.fget, 'render'))
+    connection_created.connect(add_query_timer, dispatch_uid='api.metrics')
+    for connection in connections.all(initialized_only=True):
+        add_query_timer(None, connection)
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        raise Http404  # Unconfigured, the endpoint is for development only
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    from api import jobs  # Queue depths come from the table, whichever process ran the jobs
+    body = exposition(registry.collect()) + jobs.exposition(jobs.queue_stats())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
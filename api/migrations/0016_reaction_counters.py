@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    for model_name, field, relation in [
+        ('Post', 'like_count', 'likes'),
+        ('Post', 'dislike_count', 'dislikes'),
+        ('Comment', 'like_count', 'likes'),
+        ('SubComment', 'like_count', 'likes'),
+    ]:
+        model = apps.get_model('api', model_name)
+        m2m = model._meta.get_field(relation)
+        source = m2m.m2m_field_name()
+        counts = (
+            m2m.remote_field.through.objects.filter(**{source: OuterRef('pk')})
+            .values(source)
+            .annotate(total=Count('*'))
+            .values('total')
+        )
+        model.objects.update(**{field: Coalesce(Subquery(counts), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_post_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='subcomment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, OperationalError
+
+
+# FTS5 table -> (source table, indexed columns); frozen copy of api.search.INDEXES
+INDEXES = {
+    'api_post_fts': ('api_post', ('content',)),
+    'api_user_fts': ('api_user', ('username', 'first_name', 'last_name', 'bio', 'location')),
+}
+
+
+def create_search_index(apps, schema_editor):
+    # SQLite only; other backends (or SQLite builds without FTS5) use the icontains fallback
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for index, (table, columns) in INDEXES.items():
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {index} USING fts5({', '.join(columns)}, "
+                    f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+                )
+            except OperationalError:
+                return  # No FTS5 module compiled in
+            values = ', '.join(f"COALESCE({column}, '')" for column in columns)
+            cursor.execute(f"INSERT INTO {index}(rowid, {', '.join(columns)}) SELECT id, {values} FROM {table}")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for index in INDEXES:
+            cursor.execute(f'DROP TABLE IF EXISTS {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -2,6 +2,9 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from datetime import date
 from django.conf import settings
+from django.utils import timezone
+
+from api.storage import get_blob_storage
 
 
 class User(AbstractUser): 
@@ -9,7 +12,10 @@ class User(AbstractUser):
     email = models.EmailField(unique=True)
     bio = models.TextField(max_length=500, blank=True)  # Optional user bio
     gender = models.CharField(max_length=10, null=True, blank=True)
-    profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)  # Profile image
+    profile_picture = models.ImageField(upload_to='profile_pictures/', storage=get_blob_storage, blank=True, null=True)  # Profile image, stored by content hash
+    profile_picture_width = models.PositiveIntegerField(null=True, blank=True)  # Filled by the image pipeline (api/images.py)
+    profile_picture_height = models.PositiveIntegerField(null=True, blank=True)
+    profile_picture_variants = models.JSONField(default=dict, blank=True)  # Resized/WebP derivatives
     location = models.CharField(max_length=100, blank=True)  # User's location (optional)
     phone_number = models.CharField(max_length=15, null=True, blank=True)
     website = models.URLField(blank=True, null=True)  # Optional personal website
@@ -17,15 +23,16 @@ class User(AbstractUser):
     age = models.IntegerField(null=True, blank=True)
     
     followers = models.ManyToManyField('self', symmetrical=False, related_name='following', blank=True)  # ManyToMany relationship for followers and following
+    followers_count = models.PositiveIntegerField(default=0)  # Denormalized followers.count()
+    following_count = models.PositiveIntegerField(default=0)  # Denormalized following.count()
  
     
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email', 'first_name', 'last_name']
     
     def __str__(self):
-        followers_count = self.followers.count()  # Number of users following this user
-        following_count = self.following.count()  # Number of users this user is following
-        return f'{self.first_name} ({self.username}): {followers_count} followers, {following_count} following'
+        # Counter columns are maintained by the follow views, so no COUNT queries here
+        return f'{self.first_name} ({self.username}): {self.followers_count} followers, {self.following_count} following'
 
 
     # Override the save method to calculate age based on date_of_birth
@@ -42,7 +49,10 @@ class User(AbstractUser):
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')  # User who created the post
     content = models.TextField(max_length=1000, blank=True, null=True)  # Post text content (optional)
-    image = models.ImageField(upload_to='post_images/', blank=True, null=True)  # Optional image for the post
+    image = models.ImageField(upload_to='post_images/', storage=get_blob_storage, blank=True, null=True)  # Optional image for the post, stored by content hash
+    image_width = models.PositiveIntegerField(null=True, blank=True)  # Filled by the image pipeline (api/images.py)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)  # Resized/WebP derivatives
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp for when the post is created
     updated_at = models.DateTimeField(auto_now=True)  # Timestamp for when the post is last updated
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)  # Users who liked the post
@@ -50,19 +60,11 @@ class Post(models.Model):
     is_public = models.BooleanField(default=True)  # Visibility flag (public or private post)
     reposted_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='reposts')  # Link to the original post
     reposted_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='reposted_posts')
+    like_count = models.PositiveIntegerField(default=0)  # Denormalized likes.count(), maintained with F() updates
+    dislike_count = models.PositiveIntegerField(default=0)  # Denormalized dislikes.count()
+    trending_score = models.FloatField(null=True, blank=True, editable=False)  # Decayed engagement, see api/trending.py
 
     # Repost related fields
-   
-    
-    
-
-    @property
-    def like_count(self):
-        return self.likes.count()  # Count the number of likes
-    
-    @property
-    def dislike_count(self):
-        return self.dislikes.count()  # Count the number of dislikes
 
 
        
@@ -71,7 +73,15 @@ class Post(models.Model):
         return f'Post by {self.author.username} on {self.created_at} liked by {liked_by}'
 
     class Meta:
-        ordering = ['-created_at']  # Order by newest post first
+        ordering = ['-created_at', '-id']  # Order by newest post first
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='post_created_id_idx'),  # Backs keyset pagination
+            models.Index(fields=['author', '-created_at', '-id'], name='post_author_created_id_idx'),  # Fan-out-on-read
+            models.Index(  # Top-K trending reads; only posts still trending are in it
+                fields=['-trending_score'], name='post_trending_idx',
+                condition=models.Q(trending_score__isnull=False, is_public=True),
+            ),
+        ]
 
 
 class Comment(models.Model):
@@ -80,16 +90,16 @@ class Comment(models.Model):
     content = models.TextField(max_length=500)  # The content of the comment
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp for when the comment is created
     likes = models.ManyToManyField(User, related_name='liked_comments', blank=True)  # Users who liked the comment
-
-    @property
-    def like_count(self):
-        return self.likes.count()  # Count the number of likes on the comment
+    like_count = models.PositiveIntegerField(default=0)  # Denormalized likes.count()
 
     def __str__(self):
         return f'Comment by {self.author.username}'  # Assuming Post has a title field
 
     class Meta:
-        ordering = ['-created_at']  # Order by newest comment first
+        ordering = ['-created_at', '-id']  # Order by newest comment first
+        indexes = [
+            models.Index(fields=['post', '-created_at', '-id'], name='comment_post_created_id_idx'),
+        ]
         
 class SubComment(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='sub_comments')  # Link to the parent comment
@@ -98,16 +108,80 @@ class SubComment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)  # Timestamp for when the sub-comment is created
     updated_at = models.DateTimeField(auto_now=True)  # Timestamp for when the sub-comment is last updated
     likes = models.ManyToManyField(User, related_name='liked_sub_comments', blank=True)  # Users who liked the sub-comment
-
-    @property
-    def like_count(self):
-        return self.likes.count()  # Count the number of likes on the comment
+    like_count = models.PositiveIntegerField(default=0)  # Denormalized likes.count()
 
     def __str__(self):
         return f'Comment by {self.author.username}'  # Assuming Post has a title field
 
     class Meta:
-        ordering = ['-created_at']  # Order by newest comment first
+        ordering = ['-created_at', '-id']  # Order by newest comment first
+        indexes = [
+            models.Index(fields=['comment', '-created_at', '-id'], name='subcomment_created_id_idx'),
+        ]
 
     def __str__(self):
-        return f'SubComment by {self.author.username} on comment {self.comment.id}'
\ No newline at end of file
+        return f'SubComment by {self.author.username} on comment {self.comment.id}'
+
+
+class TimelineEntry(models.Model):
+    # Materialized home timeline row, written when a followed author posts (fan-out-on-write)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')  # Owner of the timeline
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')  # Deleted posts cascade out
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')  # Copy of post.author, lets unfollow skip a join
+    created_at = models.DateTimeField()  # Copy of post.created_at so the feed sorts on this table alone
+
+    class Meta:
+        ordering = ['-created_at', '-post_id']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_created_idx'),
+            models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'Timeline entry for {self.user_id}: post {self.post_id}'
+
+
+class MediaBlob(models.Model):
+    # One content-addressed file (api/storage.py) and how many image fields point at it
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} references)'
+
+
+class Job(models.Model):
+    # A deferred task (api/jobs.py), run by the run_jobs workers
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=100)  # Name registered with @jobs.task
+    payload = models.JSONField(default=dict, blank=True)  # Keyword arguments of the task
+    idempotency_key = models.CharField(max_length=200, null=True, blank=True, unique=True)  # Enqueue once per key
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # Not before; pushed back by each retry
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)  # Of the latest attempt
+    finished_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)  # Worker running it
+    locked_until = models.DateTimeField(null=True, blank=True)  # Lease; an expired one means the worker died
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.task} job {self.id} ({self.status})'
+
+    class Meta:
+        indexes = [
+            models.Index(  # Claiming: the due jobs of a queue, oldest first
+                fields=['queue', 'run_at', 'id'], name='job_ready_idx', condition=models.Q(status='queued'),
+            ),
+            models.Index(  # Concurrency limits and expired leases
+                fields=['queue', 'locked_until'], name='job_running_idx', condition=models.Q(status='running'),
+            ),
+        ]
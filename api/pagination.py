@@ -0,0 +1,241 @@
+import base64
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+Cursor = namedtuple('Cursor', ['position', 'reverse'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a tuple of columns, e.g. (created_at, id).
+
+    Every page is fetched with a ``WHERE (created_at, id) < (...)`` style
+    predicate instead of an OFFSET, so page 10,000 costs the same as page 1
+    as long as ``ordering`` is backed by an index.
+
+    Cursor mode is opt-in: a request without ``cursor`` or ``page_size``
+    gets the plain list the frontend already understands, cut to the first
+    API_LEGACY_LIST_LIMIT rows so no request reads a whole table.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+    # Model fields that convert and check the cursor's position values, by ordering column
+    position_fields = {'created_at': models.DateTimeField(), 'id': models.IntegerField()}
+
+    def is_enabled(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def limit_legacy(self, queryset, request):
+        # The plain list a request without cursor or page_size gets, bounded
+        limit = getattr(settings, 'API_LEGACY_LIST_LIMIT', None)
+        if limit is None or self.is_enabled(request):
+            return queryset
+        if not queryset.ordered:
+            queryset = queryset.order_by(*self.ordering)
+        return queryset[:limit]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_enabled(request):
+            return None  # Legacy mode, the list limit_legacy() bounded
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = cursor.reverse if cursor else False
+        ordering = self.get_ordering(reverse)
+
+        # Fetch one extra row to find out whether another page exists
+        results = self.fetch(queryset, cursor, ordering)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            has_next, has_previous = cursor is not None, has_more
+        else:
+            has_next, has_previous = has_more, cursor is not None
+
+        self.next_position = self.get_position(results[-1]) if has_next and results else None
+        self.previous_position = self.get_position(results[0]) if has_previous and results else None
+        return results
+
+    def fetch(self, queryset, cursor, ordering):
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(cursor.position, ordering))
+        return list(queryset[:self.page_size + 1])
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        # Walking backwards flips every column's direction
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def keyset_filter(self, position, ordering):
+        # Builds (a < x) OR (a = x AND b < y) OR ... for the given ordering
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return position
+
+    def link_after(self, url, instance):
+        # Next-page link for a listing at ``url`` whose last shown row is ``instance``
+        self.base_url = url
+        return self.encode_cursor(self.get_position(instance), reverse=False)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = payload['p']
+            reverse = bool(payload.get('r', 0))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(position=self.parse_position(position), reverse=reverse)
+
+    def parse_position(self, position):
+        # Cursors come from the client: each value must be a valid one for its column
+        parsed = []
+        for field, value in zip(self.ordering, position):
+            try:
+                value = self.position_fields[field.lstrip('-')].to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            parsed.append(value)
+        return parsed
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CreatedAtCursorPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')  # Newest first, id breaks ties
+
+
+class ThreadPagination(CreatedAtCursorPagination):
+    page_size = 10
+
+    def is_enabled(self, request):
+        return True  # A thread always shows one page of comments
+
+
+class UserCursorPagination(KeysetPagination):
+    ordering = ('id',)  # Users have no creation column in the ordering, the PK is stable
+
+
+class TimelinePagination(KeysetPagination):
+    """
+    Keyset pagination over several sources at once, as returned by
+    ``api.timeline.timeline_sources``. Each source is read with its own
+    indexed page query and the results are merged, so a page costs
+    O(page_size) per source however many accounts the user follows.
+    Rows are ``{'created_at': ..., 'post_id': ...}`` dicts.
+    """
+    ordering = ('-created_at', '-post_id')
+    position_fields = {'created_at': models.DateTimeField(), 'post_id': models.IntegerField()}
+
+    def is_enabled(self, request):
+        return True  # The feed is always paginated
+
+    def fetch(self, sources, cursor, ordering):
+        rows = {}
+        for queryset in sources:
+            for row in super().fetch(queryset, cursor, ordering):
+                rows[row['post_id']] = row  # A post can come from both sources
+        descending = ordering[0].startswith('-')
+        merged = sorted(rows.values(), key=lambda row: (row['created_at'], row['post_id']), reverse=descending)
+        return merged[:self.page_size + 1]
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Keyset pagination over an ``api.search.Search``, best match first.
+    With FTS5 the search runs its own ranked SQL page query; the portable
+    fallback is a plain queryset paged by the inherited ``fetch``. Rows
+    are ``{'id': ..., 'rank': ...}`` dicts.
+    """
+    ordering = ('rank', 'id')  # bm25() is lower for better matches
+    position_fields = {'rank': models.FloatField(), 'id': models.IntegerField()}
+
+    def is_enabled(self, request):
+        return True  # Search results are always paginated
+
+    def fetch(self, search, cursor, ordering):
+        if search.uses_fts:
+            return search.fetch_ranked(cursor.position if cursor else None, ordering, self.page_size + 1)
+        return super().fetch(search.queryset(), cursor, ordering)
@@ -0,0 +1,78 @@
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+
+from api.fieldsets import requested
+from api.models import User, SubComment
+
+
+# Serialization plans: each helper attaches the select_related/prefetch_related
+# calls its serializer needs, so a page costs a fixed number of queries no
+# matter how many rows are on it. Per-viewer flags (is_following,
+# is_liked_by_user) are answered by api.resolvers, not here.
+
+
+def id_only(queryset=None):
+    # The serializers only ever read primary keys from M2M relations
+    return (queryset if queryset is not None else User.objects.all()).only('id')
+
+
+def user_prefetches(prefix=''):
+    # followers/following PK lists rendered by the full UserSerializer
+    return [
+        Prefetch(f'{prefix}followers', queryset=id_only()),
+        Prefetch(f'{prefix}following', queryset=id_only()),
+    ]
+
+
+def expanded_user_prefetches(request, path):
+    # Embedded summaries are plain columns; follower lists are only fetched for ?expand= paths
+    if path not in requested(request, 'expand'):
+        return []
+    return user_prefetches(path.replace('.', '__') + '__')
+
+
+def users_for_serialization(queryset, request=None):
+    return queryset.prefetch_related(*user_prefetches())
+
+
+def user_summaries_for_serialization(queryset, request=None):
+    return queryset  # Counts are columns, nothing to prefetch
+
+
+def posts_for_serialization(queryset, request=None):
+    return queryset.select_related(
+        'author', 'reposted_from__author',
+        'reposted_by',  # reposted_by renders through User.__str__, which reads counter columns
+    ).prefetch_related(
+        *expanded_user_prefetches(request, 'author'),
+        *expanded_user_prefetches(request, 'reposted_from.author'),
+        Prefetch('likes', queryset=id_only()),
+        Prefetch('dislikes', queryset=id_only()),
+    )
+
+
+def comments_for_serialization(queryset, request=None):
+    return queryset.select_related('author').prefetch_related(
+        *expanded_user_prefetches(request, 'author'),
+        Prefetch('likes', queryset=id_only()),
+    )
+
+
+def subcomments_for_serialization(queryset, request=None):
+    return queryset.select_related('author').prefetch_related(
+        *expanded_user_prefetches(request, 'author'),
+        Prefetch('likes', queryset=id_only()),
+    )
+
+
+def comments_with_replies(queryset, request=None, replies=3):
+    """
+    Comments for a thread: each carries ``reply_count`` and, in
+    ``first_replies``, its newest ``replies`` sub-comments. The sliced
+    prefetch becomes one ROW_NUMBER() window query for the whole page.
+    """
+    counts = SubComment.objects.filter(comment=OuterRef('pk')).order_by().values('comment').annotate(n=Count('id'))
+    first = subcomments_for_serialization(SubComment.objects.order_by('-created_at', '-id'), request)[:replies]
+    return comments_for_serialization(queryset, request).annotate(
+        reply_count=Coalesce(Subquery(counts.values('n')), 0),
+    ).prefetch_related(Prefetch('sub_comments', queryset=first, to_attr='first_replies'))
@@ -0,0 +1,433 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import signal
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import F
+from django.http import Http404
+
+from api import realtime, reactions, timeline, trending
+from api.models import User
+
+
+logger = logging.getLogger(__name__)
+
+# Follows are buffered like reactions, keyed ('user', 'follow') with the
+# followed account as the target
+FOLLOW = ('user', 'follow')
+
+# api.resolvers relation -> buffered (target, reaction)
+RELATIONS = {
+    'following': FOLLOW,
+    'post_likes': ('post', 'like'),
+    'post_dislikes': ('post', 'dislike'),
+    'comment_likes': ('comment', 'like'),
+    'subcomment_likes': ('subcomment', 'like'),
+}
+
+
+def enabled():
+    return getattr(settings, 'REACTION_BUFFER', False)
+
+
+def stored_state(target, reaction, target_id, user_id):
+    # What the database says; raises Http404 for a post or comment that does not exist
+    if (target, reaction) == FOLLOW:
+        return timeline.Follow.objects.filter(from_user_id=target_id, to_user_id=user_id).exists()
+    model, relation, _ = reactions.REACTIONS[(target, reaction)]
+    through, target_column, user_column = reactions.through_columns(model, relation)
+    if through.objects.filter(**{target_column: target_id, user_column: user_id}).exists():
+        return True
+    if not model.objects.filter(pk=target_id).exists():
+        raise Http404(f'No {model.__name__} matches the given query.')
+    return False
+
+
+def write_states(target, reaction, states):
+    """
+    Bring the database to ``states``, {(target id, user id): active}, for
+    one kind of reaction: one bulk INSERT, one DELETE and one counter UPDATE
+    per distinct delta, whatever the number of rows. Targets and users
+    deleted since the toggle are skipped. Call inside a transaction.
+    """
+    model, relation, counter = reactions.REACTIONS[(target, reaction)]
+    through, target_column, user_column = reactions.through_columns(model, relation)
+    existing = set(model.objects.filter(pk__in={target_id for target_id, _ in states}).values_list('pk', flat=True))
+    users = set(User.objects.filter(pk__in={user_id for _, user_id in states}).values_list('pk', flat=True))
+    rows = through.objects.filter(**{
+        f'{target_column}__in': existing, f'{user_column}__in': {user_id for _, user_id in states},
+    })
+    current = {(target_id, user_id): pk for pk, target_id, user_id in rows.values_list('pk', target_column, user_column)}
+
+    added = [
+        key for key, active in states.items()
+        if active and key[0] in existing and key[1] in users and key not in current
+    ]
+    removed = [key for key, active in states.items() if not active and key in current]
+    through.objects.bulk_create(
+        [through(**{target_column: target_id, user_column: user_id}) for target_id, user_id in added],
+        ignore_conflicts=True,
+    )
+    through.objects.filter(pk__in=[current[key] for key in removed]).delete()
+
+    deltas = defaultdict(int)
+    for target_id, _ in added:
+        deltas[target_id] += 1
+    for target_id, _ in removed:
+        deltas[target_id] -= 1
+    by_delta = defaultdict(list)
+    for target_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(target_id)
+    for delta, target_ids in by_delta.items():
+        model.objects.filter(pk__in=target_ids).update(**{counter: F(counter) + delta})
+        trending.reaction_changed(target, reaction, target_ids, delta)
+    if deltas:
+        realtime.reaction_changed(target, list(deltas))
+
+
+def write_follows(states):
+    # Follows keep their per-row side effects (timeline backfill, suggestions), so they go one at a time
+    users = User.objects.in_bulk({user_id for key in states for user_id in key})
+    for (target_id, user_id), active in states.items():
+        if target_id in users and user_id in users:
+            (reactions.write_follow if active else reactions.write_unfollow)(users[user_id], users[target_id])
+
+
+def write(pending):
+    # {(target, reaction, user id): {target id: active}} in one transaction, so one write lock
+    kinds = defaultdict(dict)
+    for (target, reaction, user_id), states in pending.items():
+        for target_id, (active, _) in states.items():
+            kinds[(target, reaction)][(target_id, user_id)] = active
+    with transaction.atomic():
+        for (target, reaction), states in kinds.items():
+            if (target, reaction) == FOLLOW:
+                write_follows(states)
+            else:
+                write_states(target, reaction, states)
+
+
+class ReactionLog:
+    """
+    Append-only file of accepted toggles, one JSON line each, fsynced
+    before the toggle is acknowledged. The process holds an flock on its
+    files; files nobody holds belong to a process that died and are
+    replayed by the next buffer to start.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sequence = 0
+        self.handle = None
+        self.dirty = False  # Anything appended since the last rotate()
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.sequence += 1
+        path = os.path.join(self.directory, f'{os.getpid()}-{self.sequence:08d}.log')
+        self.handle = open(path, 'ab')
+        fcntl.flock(self.handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.dirty = False
+
+    def append(self, target, reaction, target_id, user_id, active):
+        self.handle.write(json.dumps([target, reaction, target_id, user_id, active]).encode() + b'\n')
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.dirty = True
+
+    def rotate(self):
+        # Start a new file; the returned one is removed once what it holds is committed
+        previous = self.handle
+        self.open()
+        return previous
+
+    @staticmethod
+    def discard(handle):
+        os.unlink(handle.name)
+        handle.close()
+
+    def orphans(self):
+        """
+        Yield {(target, reaction, user id): {target id: (active, None)}}
+        per unlocked file, oldest first, and remove each once the caller
+        has written it.
+        """
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.log'))):
+            with open(path, 'rb') as handle:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # A live process's log
+                pending = defaultdict(dict)
+                for line in handle:
+                    try:
+                        target, reaction, target_id, user_id, active = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a crash; it was never acknowledged
+                    pending[(target, reaction, user_id)][target_id] = (active, None)
+                yield pending
+                os.unlink(path)
+
+
+class ReactionBuffer:
+    """
+    Likes, dislikes and follows accepted in memory and written in batches.
+    Every toggle becomes the user's desired state for that object, so
+    toggling back and forth before a flush costs nothing; a flush writes
+    everything pending with write(), one transaction and so one SQLite
+    write lock, instead of one per tap.
+
+    Flushes run every REACTION_BUFFER_INTERVAL seconds on a background
+    thread, as soon as REACTION_BUFFER_MAX_PENDING states are waiting, and
+    at exit (SIGTERM included). With REACTION_BUFFER_LOG_DIR set, toggles
+    are also appended to a log first and survive a crash: the next process
+    to start replays it. Without the log, a crash (as opposed to a
+    shutdown) loses what is pending.
+
+    A flush the database refuses outright (OperationalError: locked, gone)
+    puts the whole batch back for the next. Any other failure is blamed on
+    the states in it: they are written one by one, and those that still
+    fail go back with an attempt counted, to be dropped and logged after
+    REACTION_BUFFER_MAX_ATTEMPTS, so one bad state cannot hold up the rest.
+
+    The viewer's own pending states are visible at once through
+    state() and api.resolvers; counters catch up at the flush.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = defaultdict(dict)  # (target, reaction, user id) -> {target id: (active, stored state)}
+        self.flushing = {}  # The batch being written, same shape
+        self.attempts = {}  # (key, target id) -> failed writes of that state
+        self.size = 0
+        self.log = None
+        self.retired = []  # Log files whose states are not committed yet
+        self.started = False
+        self.wake = threading.Event()
+
+    def start(self):
+        # First use: replay what a crashed process left behind, then open our own log
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        directory = getattr(settings, 'REACTION_BUFFER_LOG_DIR', None)
+        if directory:
+            log = ReactionLog(directory)
+            for orphan in log.orphans():
+                for key, states in self.write_isolated(orphan).items():
+                    logger.error('Dropping unwritable logged reactions %s: %s', key, states)
+            log.open()
+            self.log = log
+        if getattr(settings, 'REACTION_BUFFER_FLUSHER', 'thread') == 'thread':
+            threading.Thread(target=self.run, name='reaction-buffer', daemon=True).start()
+
+    def known(self, key, target_id):
+        # (active, stored state) when a toggle is pending or being written, else None; call with the lock held
+        entry = self.pending.get(key, {}).get(target_id)
+        if entry is not None:
+            return entry
+        entry = self.flushing.get(key, {}).get(target_id)
+        if entry is not None:
+            return entry[0], entry[0]  # About to be the stored state; the table may not show it yet
+        return None
+
+    def state(self, target, reaction, target_id, user_id):
+        with self.lock:
+            entry = self.known((target, reaction, user_id), target_id)
+        return entry[0] if entry is not None else stored_state(target, reaction, target_id, user_id)
+
+    def set(self, target, reaction, target_id, user_id, active):
+        """
+        Record the user's desired state; returns True when it differs from
+        what they had, pending toggles included. Going back to the stored
+        state drops the entry, so there is nothing left to write.
+        """
+        self.start()
+        key = (target, reaction, user_id)
+        with self.lock:
+            entry = self.known(key, target_id)
+        stored = entry[1] if entry is not None else stored_state(target, reaction, target_id, user_id)
+        with self.lock:
+            states = self.pending[key]
+            entry = self.known(key, target_id)
+            if entry is not None:
+                stored = entry[1]  # Another thread or a flush got there first; that reading stands
+            if (entry[0] if entry is not None else stored) == active:
+                return False
+            if self.log is not None:
+                self.log.append(target, reaction, target_id, user_id, active)
+            if active == stored:
+                if states.pop(target_id, None) is not None:
+                    self.size -= 1
+                return True
+            if target_id not in states:
+                self.size += 1
+            states[target_id] = (active, stored)
+            full = self.size >= getattr(settings, 'REACTION_BUFFER_MAX_PENDING', 1000)
+        if full:
+            if getattr(settings, 'REACTION_BUFFER_FLUSHER', 'thread') == 'thread':
+                self.wake.set()
+            else:
+                self.flush()
+        return True
+
+    def toggle(self, target, reaction, target_id, user_id):
+        # Returns the new state; two toggles racing in one process may both flip, as two taps would
+        active = not self.state(target, reaction, target_id, user_id)
+        self.set(target, reaction, target_id, user_id, active)
+        return active
+
+    def pending_states(self, target, reaction, user_id):
+        # {target id: active} the user has waiting, for api.resolvers
+        key = (target, reaction, user_id)
+        with self.lock:
+            return {
+                target_id: entry[0]
+                for states in (self.flushing.get(key, {}), self.pending.get(key, {}))
+                for target_id, entry in states.items()
+            }
+
+    def user_state(self, user_id):
+        # Everything the user has waiting, sorted; part of api.conditional's ETags
+        with self.lock:
+            return sorted(
+                (target, reaction, target_id, entry[0])
+                for target, reaction in RELATIONS.values()
+                for target_id, entry in self.pending.get((target, reaction, user_id), {}).items()
+            )
+
+    def pending_delta(self, target, reaction, target_id):
+        # Net change to the target's counter that is still waiting, as far as this process knows
+        with self.lock:
+            return sum(
+                int(states[target_id][0]) - int(states[target_id][1])
+                for (kind, name, _), states in self.pending.items()
+                if kind == target and name == reaction and target_id in states
+            )
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.size and not (self.log is not None and self.log.dirty):
+                    return 0
+                batch, self.pending, self.size = self.pending, defaultdict(dict), 0
+                self.flushing = batch
+                if self.log is not None:
+                    self.retired.append(self.log.rotate())
+            count = sum(len(states) for states in batch.values())
+            try:
+                failed = self.write_isolated(batch)
+            except Exception:
+                with self.lock:
+                    self.flushing = {}
+                    self.restore(batch, failed=False)
+                raise
+            with self.lock:
+                self.flushing = {}
+                for key, states in batch.items():
+                    for target_id in states:
+                        if target_id not in failed.get(key, {}):
+                            self.attempts.pop((key, target_id), None)
+                self.restore(failed, failed=True)
+                # A log holding failed states is kept, so a crash replays them
+                retired = [] if failed else self.retired
+                if not failed:
+                    self.retired = []
+            for handle in retired:
+                ReactionLog.discard(handle)
+            return count - sum(len(states) for states in failed.values())
+
+    def write_isolated(self, batch):
+        """
+        write() the batch, falling back to one transaction per state when
+        it fails for any reason but the database itself; returns the states
+        that still failed, same shape. OperationalError is raised.
+        """
+        try:
+            write(batch)
+            return {}
+        except OperationalError:
+            raise
+        except Exception:
+            logger.exception('Writing a batch of reactions failed; writing its states one by one')
+        failed = defaultdict(dict)
+        for key, states in batch.items():
+            for target_id, entry in states.items():
+                try:
+                    write({key: {target_id: entry}})
+                except Exception:
+                    logger.exception('Writing reaction %s on %s failed', key, target_id)
+                    failed[key][target_id] = entry
+        return failed
+
+    def restore(self, batch, failed):
+        # Put states back after a failed write; newer toggles win. Call with the lock held
+        max_attempts = getattr(settings, 'REACTION_BUFFER_MAX_ATTEMPTS', 5)
+        for key, states in batch.items():
+            for target_id, entry in states.items():
+                if target_id in self.pending[key]:
+                    self.attempts.pop((key, target_id), None)
+                    continue
+                if failed:
+                    attempts = self.attempts[(key, target_id)] = self.attempts.get((key, target_id), 0) + 1
+                    if attempts >= max_attempts:
+                        del self.attempts[(key, target_id)]
+                        logger.error('Dropping reaction %s on %s after %s failed writes', key, target_id, attempts)
+                        continue
+                self.pending[key][target_id] = entry
+                self.size += 1
+
+    def run(self):
+        interval = getattr(settings, 'REACTION_BUFFER_INTERVAL', 0.2)
+        while True:
+            self.wake.wait(interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing the reaction buffer failed; retrying')
+            finally:
+                close_old_connections()
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing the reaction buffer at exit failed')
+
+    def reset(self):
+        with self.lock:
+            self.pending.clear()
+            self.flushing = {}
+            self.attempts.clear()
+            self.size = 0
+
+
+buffer = ReactionBuffer()
+
+
+def exit_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def install():
+    """
+    Flush at exit. A plain SIGTERM skips atexit, so when nothing else
+    handles it it is turned into SystemExit. Called from ApiConfig.ready(),
+    which runs in the main thread, the only one that may set handlers.
+    """
+    if not enabled():
+        return
+    atexit.register(buffer.close)
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, exit_on_sigterm)
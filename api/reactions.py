@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import Http404
+
+from api.counters import adjust
+from api.models import User, Post, Comment, SubComment
+from api import realtime, reaction_buffer, suggestions, timeline, trending
+
+
+# (target, reaction) -> (model, M2M relation, counter column)
+REACTIONS = {
+    ('post', 'like'): (Post, 'likes', 'like_count'),
+    ('post', 'dislike'): (Post, 'dislikes', 'dislike_count'),
+    ('comment', 'like'): (Comment, 'likes', 'like_count'),
+    ('subcomment', 'like'): (SubComment, 'likes', 'like_count'),
+}
+
+
+def through_columns(model, relation):
+    # Through model plus its target and user column names, e.g. (Post_likes, 'post_id', 'user_id')
+    m2m = model._meta.get_field(relation)
+    return m2m.remote_field.through, m2m.m2m_column_name(), m2m.m2m_reverse_name()
+
+
+def insert_row(through, **columns):
+    # Single INSERT, a duplicate is reported instead of raised; returns True if the row is new
+    try:
+        with transaction.atomic():
+            through.objects.create(**columns)
+    except IntegrityError:
+        return False
+    return True
+
+
+def add(target, reaction, target_id, user_id):
+    """
+    Idempotent: make sure ``user_id`` reacted to the object. Returns True if
+    this call created the reaction. Raises Http404 for an unknown target; the
+    counter UPDATE doubles as the existence check.
+    """
+    if reaction_buffer.enabled():
+        return reaction_buffer.buffer.set(target, reaction, target_id, user_id, True)
+    model, relation, counter = REACTIONS[(target, reaction)]
+    through, target_column, user_column = through_columns(model, relation)
+    with transaction.atomic():
+        if not insert_row(through, **{target_column: target_id, user_column: user_id}):
+            return False
+        if not model.objects.filter(pk=target_id).update(**{counter: F(counter) + 1}):
+            raise Http404(f'No {model.__name__} matches the given query.')
+        trending.reaction_changed(target, reaction, [target_id], 1)
+        realtime.reaction_changed(target, [target_id])
+        return True
+
+
+def remove(target, reaction, target_id, user_id):
+    # Idempotent: a single DELETE on the through table; returns True if a reaction was removed
+    if reaction_buffer.enabled():
+        return reaction_buffer.buffer.set(target, reaction, target_id, user_id, False)
+    model, relation, counter = REACTIONS[(target, reaction)]
+    through, target_column, user_column = through_columns(model, relation)
+    with transaction.atomic():
+        deleted, _ = through.objects.filter(**{target_column: target_id, user_column: user_id}).delete()
+        if deleted:
+            adjust(model, target_id, **{counter: -deleted})
+            trending.reaction_changed(target, reaction, [target_id], -deleted)
+            realtime.reaction_changed(target, [target_id])
+        return bool(deleted)
+
+
+def toggle(target, reaction, target_id, user_id):
+    # Delete-or-insert instead of read-then-write; returns the new state
+    if reaction_buffer.enabled():
+        return reaction_buffer.buffer.toggle(target, reaction, target_id, user_id)
+    with transaction.atomic():
+        if remove(target, reaction, target_id, user_id):
+            return False
+        add(target, reaction, target_id, user_id)
+        return True
+
+
+def follow(user, target):
+    # Returns True if this call started the follow
+    if reaction_buffer.enabled():
+        return reaction_buffer.buffer.set('user', 'follow', target.id, user.id, True)
+    return write_follow(user, target)
+
+
+def unfollow(user, target):
+    if reaction_buffer.enabled():
+        return reaction_buffer.buffer.set('user', 'follow', target.id, user.id, False)
+    return write_unfollow(user, target)
+
+
+def write_follow(user, target):
+    # Follow rows: from_user is the followed account, to_user the follower
+    with transaction.atomic():
+        if not insert_row(timeline.Follow, from_user_id=target.id, to_user_id=user.id):
+            return False
+        adjust(User, target.id, followers_count=1)
+        adjust(User, user.id, following_count=1)
+        timeline.backfill_author(user, target)
+        suggestions.record_follow(user.id, target.id, True)
+        return True
+
+
+def write_unfollow(user, target):
+    with transaction.atomic():
+        deleted, _ = timeline.Follow.objects.filter(from_user_id=target.id, to_user_id=user.id).delete()
+        if not deleted:
+            return False
+        adjust(User, target.id, followers_count=-1)
+        adjust(User, user.id, following_count=-1)
+        timeline.remove_author(user, target)
+        suggestions.record_follow(user.id, target.id, False)
+        return True
+
+
+def apply_batch(user_id, items):
+    """
+    Apply many reactions in one transaction, e.g. a queue of offline taps.
+    ``items`` are dicts with target, id, reaction and active; the last entry
+    wins when one object appears twice. Every group of (target, reaction,
+    active) costs a fixed number of queries, not one per item. Returns one
+    result per distinct object with status 'applied', 'unchanged' or 'not_found'.
+    """
+    if reaction_buffer.enabled():
+        reaction_buffer.buffer.flush()  # Already one transaction; pending toggles go first so order holds
+    latest = {}
+    for item in items:
+        latest[(item['target'], item['reaction'], item['id'])] = item['active']
+
+    groups = defaultdict(set)
+    for (target, reaction, target_id), active in latest.items():
+        groups[(target, reaction, active)].add(target_id)
+
+    statuses = {}
+    with transaction.atomic():
+        for (target, reaction, active), target_ids in groups.items():
+            model, relation, counter = REACTIONS[(target, reaction)]
+            through, target_column, user_column = through_columns(model, relation)
+            existing_targets = set(model.objects.filter(pk__in=target_ids).values_list('pk', flat=True))
+            rows = through.objects.filter(**{user_column: user_id, f'{target_column}__in': existing_targets})
+            current = set(rows.values_list(target_column, flat=True))
+
+            if active:
+                changed = existing_targets - current
+                through.objects.bulk_create(
+                    [through(**{target_column: target_id, user_column: user_id}) for target_id in changed],
+                    ignore_conflicts=True,
+                )
+                delta = 1
+            else:
+                changed = current
+                rows.delete()
+                delta = -1
+            if changed:
+                model.objects.filter(pk__in=changed).update(**{counter: F(counter) + delta})
+                trending.reaction_changed(target, reaction, changed, delta)
+                realtime.reaction_changed(target, changed)
+
+            for target_id in target_ids:
+                if target_id not in existing_targets:
+                    status = 'not_found'
+                elif target_id in changed:
+                    status = 'applied'
+                else:
+                    status = 'unchanged'
+                statuses[(target, reaction, target_id)] = (active, status)
+
+    return [
+        {'target': target, 'id': target_id, 'reaction': reaction, 'active': active, 'status': status}
+        for (target, reaction, target_id), (active, status) in statuses.items()
+    ]
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from api.models import Post, Comment, SubComment
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def channel_for(post_id):
+    # Everything happening under one post shares a channel: comments, replies, reaction counts
+    return f'post:{post_id}'
+
+
+class Subscription:
+    """
+    One stream's mailbox. Events are queued on the subscriber's event loop;
+    when a slow client lets the queue fill up, its backlog is replaced by a
+    single 'resync' event telling it to re-fetch instead of holding memory.
+    """
+
+    def __init__(self, channels, loop, max_queued=256):
+        self.channels = set(channels)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queued)
+
+    def put(self, event):
+        # Runs on self.loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync'})
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """
+    Fan-out to the streams connected to this process. ``publish`` is safe to
+    call from any thread (sync views, on_commit callbacks); delivery hops
+    onto each subscriber's event loop. A multi-process deployment swaps this
+    for a broker with the same four methods via ``REALTIME_BROKER``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)  # channel -> {Subscription}
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, asyncio.get_running_loop(), getattr(settings, 'REALTIME_MAX_QUEUED', 256))
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[channel]
+
+    def has_subscribers(self, channel=None):
+        # Lets publishers skip building payloads nobody will receive; None asks about any channel
+        return bool(self.subscriptions) if channel is None else channel in self.subscriptions
+
+    def publish(self, channel, event):
+        with self.lock:
+            subscribers = list(self.subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                self.unsubscribe(subscription)  # Its event loop has shut down
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'REALTIME_BROKER', 'api.realtime.InProcessBroker'))()
+    return _broker
+
+
+def publish_after_commit(build_events):
+    """
+    Runs ``build_events`` once the transaction commits, so nothing is
+    announced for a rolled-back write, and only while someone is connected.
+    It returns (post_id, event) pairs; events for posts without subscribers
+    are dropped.
+    """
+    def send():
+        broker = get_broker()
+        if not broker.has_subscribers():
+            return
+        try:
+            events = build_events()
+        except Exception:
+            logger.exception('Building realtime events failed')
+            return
+        for post_id, event in events:
+            channel = channel_for(post_id)
+            if broker.has_subscribers(channel):
+                broker.publish(channel, event)
+
+    transaction.on_commit(send)
+
+
+# target -> (model, path to the post id, extra id fields, counter columns)
+REACTION_COUNTS = {
+    'post': (Post, 'id', (), ('like_count', 'dislike_count')),
+    'comment': (Comment, 'post_id', (), ('like_count',)),
+    'subcomment': (SubComment, 'comment__post_id', ('comment_id',), ('like_count',)),
+}
+
+
+def reaction_changed(target, target_ids):
+    # Pushes the current counters (read after commit) rather than deltas, so clients cannot drift
+    model, post_path, extra, counters = REACTION_COUNTS[target]
+    target_ids = list(target_ids)
+
+    def build_events():
+        rows = model.objects.filter(pk__in=target_ids).values('id', post_path, *extra, *counters)
+        return [
+            (row[post_path], {
+                'type': 'reaction.counts', 'target': target, 'id': row['id'], 'post': row[post_path],
+                **{field: row[field] for field in (*extra, *counters)},
+            })
+            for row in rows
+        ]
+
+    publish_after_commit(build_events)
+
+
+def format_event(event):
+    # Server-Sent Events framing: the event name plus one JSON data line
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'), default=str)}\n\n"
+
+
+async def stream(post_ids, keepalive=None):
+    """
+    SSE body subscribed to the given posts. Comment lines keep proxies from
+    timing out idle connections. The subscription lives exactly as long as
+    the response is being consumed, and the consuming event loop receives
+    the events, so this needs an ASGI server.
+    """
+    keepalive = keepalive or getattr(settings, 'REALTIME_KEEPALIVE', 15)
+    broker = get_broker()
+    subscription = broker.subscribe([channel_for(post_id) for post_id in post_ids])
+    try:
+        yield f"retry: 3000\nevent: subscribed\ndata: {json.dumps({'posts': sorted(post_ids)})}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,106 @@
+import itertools
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from api.pagination import KeysetPagination
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder is used without it
+    orjson = None
+
+
+# JSON output for the API. FastJSONRenderer writes the same bytes as DRF's
+# JSONRenderer through orjson, several times faster and without the
+# intermediate str, and falls back to DRF when orjson is missing or the
+# client asks for indented output. StreamingListMixin sends unpaginated
+# lists a chunk of rows at a time, so neither the queryset nor the body is
+# ever held whole.
+
+_drf_encoder = encoders.JSONEncoder()
+
+
+def fast_json_enabled():
+    return orjson is not None and getattr(settings, 'API_JSON_ENCODER', 'orjson') == 'orjson'
+
+
+def dumps(data):
+    # Types orjson does not know (lazy strings, Decimal) and datetimes, whose DRF
+    # format ('Z' for UTC) differs from orjson's, go through DRF's encoder
+    body = orjson.dumps(data, default=_drf_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    if b'\xe2\x80\xa8' in body or b'\xe2\x80\xa9' in body:
+        # Like DRF, keep the output a strict JavaScript subset
+        body = body.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return body
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if (
+            not fast_json_enabled() or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class StreamingListMixin:
+    """
+    Streams the legacy, unpaginated list of a ListAPIView as a JSON array.
+    Rows are read with ``queryset.iterator()`` and serialized
+    API_STREAM_CHUNK_SIZE at a time, each chunk with its own serializer, so
+    prefetches and resolver lookups stay per chunk and memory stays flat
+    however long the list is. The body is the same as the buffered one, and
+    a list that fits in one chunk is sent as a regular Response.
+
+    Paginated requests, other renderers (the browsable API) and
+    API_STREAM_LISTS = False get the regular response. Errors after the
+    first chunk can only cut the body short, as the status is already sent.
+    Either way the list stops at the paginator's legacy limit.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if isinstance(self.paginator, KeysetPagination):
+            queryset = self.paginator.limit_legacy(queryset, self.request)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if not self.should_stream(request):
+            return super().list(request, *args, **kwargs)
+        chunk_size = getattr(settings, 'API_STREAM_CHUNK_SIZE', 500)
+        rows = self.filter_queryset(self.get_queryset()).iterator(chunk_size=chunk_size)  # Prefetches run per chunk
+        first = list(itertools.islice(rows, chunk_size))
+        if len(first) < chunk_size:
+            # Fits in one chunk: nothing to gain from streaming
+            return Response(self.get_serializer(first, many=True).data)
+        return StreamingHttpResponse(self.stream(first, rows, chunk_size), content_type=request.accepted_renderer.media_type)
+
+    def should_stream(self, request):
+        if not getattr(settings, 'API_STREAM_LISTS', True):
+            return False
+        paginator = self.paginator
+        if paginator is not None and (not isinstance(paginator, KeysetPagination) or paginator.is_enabled(request)):
+            return False
+        renderer = request.accepted_renderer
+        return (
+            type(renderer) is FastJSONRenderer and fast_json_enabled()
+            and renderer.get_indent(request.accepted_media_type, {}) is None
+        )
+
+    def stream(self, chunk, rows, chunk_size):
+        separator = b'['
+        while chunk:
+            body = dumps(self.get_serializer(chunk, many=True).data)
+            yield separator + body[1:-1]  # The chunk's array, unwrapped
+            separator = b','
+            chunk = list(itertools.islice(rows, chunk_size))
+        yield b']'
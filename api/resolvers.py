@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+from django.db import models
+from rest_framework import serializers
+
+from api import reaction_buffer
+from api.models import User, Post, Comment, SubComment
+
+
+# relation name -> (through model, target column, viewer column)
+RELATIONS = {
+    'following': (User.followers.through, 'from_user_id', 'to_user_id'),  # Viewer follows the target user
+    'post_likes': (Post.likes.through, 'post_id', 'user_id'),
+    'post_dislikes': (Post.dislikes.through, 'post_id', 'user_id'),
+    'comment_likes': (Comment.likes.through, 'comment_id', 'user_id'),
+    'subcomment_likes': (SubComment.likes.through, 'subcomment_id', 'user_id'),
+}
+
+
+class RelationResolver:
+    """
+    Request-scoped answers to "does the viewer follow/like this object?".
+
+    Serializers register every object ID on the page up front; the first
+    lookup for a relation then answers all of them with a single
+    ``target IN (...)`` query instead of one exists() per row.
+    """
+
+    def __init__(self, viewer_id=None):
+        self.viewer_id = viewer_id
+        self.pending = defaultdict(set)
+        self.known = defaultdict(dict)
+
+    def register(self, relation, target_id):
+        if target_id is not None and target_id not in self.known[relation]:
+            self.pending[relation].add(target_id)
+
+    def resolve(self, relation, target_id):
+        if self.viewer_id is None or target_id is None:
+            return False
+        known = self.known[relation]
+        if target_id not in known:
+            self.pending[relation].add(target_id)
+            self.flush(relation)
+        return known[target_id]
+
+    def flush(self, relation):
+        target_ids = self.pending.pop(relation, set())
+        if not target_ids:
+            return
+        through, target_column, viewer_column = RELATIONS[relation]
+        matched = set(
+            through.objects.filter(**{viewer_column: self.viewer_id, f'{target_column}__in': target_ids})
+            .values_list(target_column, flat=True)
+        )
+        known = self.known[relation]
+        pending = self.pending_states(relation)
+        for target_id in target_ids:
+            known[target_id] = pending.get(target_id, target_id in matched)
+
+    def pending_states(self, relation):
+        # The viewer's own toggles still in the reaction buffer win over the table
+        if not reaction_buffer.enabled():
+            return {}
+        target, reaction = reaction_buffer.RELATIONS[relation]
+        return reaction_buffer.buffer.pending_states(target, reaction, self.viewer_id)
+
+
+def resolver_for(context):
+    # One resolver per serializer tree; nested serializers share the root's context dict
+    resolver = context.get('resolver')
+    if resolver is None:
+        request = context.get('request')
+        viewer = getattr(request, 'user', None)
+        resolver = RelationResolver(viewer.id if viewer is not None and viewer.is_authenticated else None)
+        context['resolver'] = resolver
+    return resolver
+
+
+def lookup_path(instance, path):
+    # 'reposted_from.author_id' -> instance.reposted_from.author_id, None-safe
+    for name in path.split('.'):
+        if instance is None:
+            return None
+        instance = getattr(instance, name)
+    return instance
+
+
+class ResolverListSerializer(serializers.ListSerializer):
+    # Registers the whole page with the resolver before any row is rendered
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.register_relations(items)
+        return super().to_representation(items)
+
+
+class ResolverMixin:
+    """
+    ``resolver_lookups`` lists (relation, attribute path) pairs this
+    serializer will ask the resolver about, e.g. ('post_likes', 'id').
+    Pair it with ``Meta.list_serializer_class = ResolverListSerializer``.
+    """
+    resolver_lookups = []
+
+    @property
+    def resolver(self):
+        return resolver_for(self.context)
+
+    def register_relations(self, instances):
+        resolver = self.resolver
+        for instance in instances:
+            for relation, path in self.resolver_lookups:
+                resolver.register(relation, lookup_path(instance, path))
+
+    def to_representation(self, instance):
+        self.register_relations([instance])  # No-op when a list serializer already did it
+        return super().to_representation(instance)
@@ -0,0 +1,229 @@
+import re
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import ExpressionWrapper, F, IntegerField, Q
+
+from api.models import User, Post
+
+
+POST_INDEX = 'api_post_fts'
+USER_INDEX = 'api_user_fts'
+
+# FTS5 table -> (source table, indexed columns, bm25 column weights)
+INDEXES = {
+    POST_INDEX: ('api_post', ('content',), (1.0,)),
+    USER_INDEX: ('api_user', ('username', 'first_name', 'last_name', 'bio', 'location'), (10.0, 5.0, 5.0, 1.0, 2.0)),
+}
+
+# model label -> FTS5 table kept in sync by api.signals
+INDEXED_MODELS = {
+    'api.Post': POST_INDEX,
+    'api.User': USER_INDEX,
+}
+
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+
+_available = {}
+
+
+def create_sql(index):
+    # prefix='2 3' keeps short prefix queries (typeahead) on an index lookup
+    _, columns, _ = INDEXES[index]
+    return (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({', '.join(columns)}, "
+        f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def populate_sql(index):
+    table, columns, _ = INDEXES[index]
+    values = ', '.join(f"COALESCE({column}, '')" for column in columns)
+    return f"INSERT INTO {index}(rowid, {', '.join(columns)}) SELECT id, {values} FROM {table}"
+
+
+def fts_enabled():
+    # The FTS5 tables only exist on SQLite builds that ship the extension (see migration 0019)
+    if connection.vendor != 'sqlite':
+        return False
+    key = connection.settings_dict['NAME']
+    if key not in _available:
+        _available[key] = POST_INDEX in connection.introspection.table_names()
+    return _available[key]
+
+
+def is_indexed(instance, update_fields=None):
+    # Saves that only touch other columns (last_login, counters) leave the index alone
+    index = INDEXED_MODELS.get(instance._meta.label)
+    if index is None:
+        return False
+    return update_fields is None or not set(update_fields).isdisjoint(INDEXES[index][1])
+
+
+def index_instance(instance):
+    index = INDEXED_MODELS[instance._meta.label]
+    _, columns, _ = INDEXES[index]
+    placeholders = ', '.join(['%s'] * (len(columns) + 1))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {index} WHERE rowid = %s', [instance.pk])
+        cursor.execute(
+            f"INSERT INTO {index}(rowid, {', '.join(columns)}) VALUES ({placeholders})",
+            [instance.pk, *(getattr(instance, column) or '' for column in columns)],
+        )
+
+
+def unindex_instance(instance):
+    index = INDEXED_MODELS[instance._meta.label]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {index} WHERE rowid = %s', [instance.pk])
+
+
+def rebuild():
+    """
+    Recreate and repopulate every FTS5 table from its source table in one
+    transaction, then merge the index segments. Returns {table: rows}.
+    """
+    counts = {}
+    with transaction.atomic(), connection.cursor() as cursor:
+        for index in INDEXES:
+            cursor.execute(f'DROP TABLE IF EXISTS {index}')
+            cursor.execute(create_sql(index))
+            cursor.execute(populate_sql(index))
+            counts[index] = cursor.rowcount
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('optimize')")
+    _available.clear()
+    return counts
+
+
+def search_terms(text):
+    return TERM_RE.findall(text or '')[:MAX_TERMS]
+
+
+def match_expression(terms):
+    # Every term must match; the last one as a prefix so results follow typing.
+    # Terms are \w+ runs, so quoting them leaves no FTS5 syntax to inject.
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def keyset_sql(position, ordering):
+    # SQL twin of KeysetPagination.keyset_filter for the raw ranked query
+    clauses, params, equal = [], [], []
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        operator = '<' if field.startswith('-') else '>'
+        clauses.append(' AND '.join([*(f'{column} = %s' for column, _ in equal), f'{name} {operator} %s']))
+        params.extend([*(value for _, value in equal), value])
+        equal.append((name, value))
+    return ' OR '.join(f'({clause})' for clause in clauses), params
+
+
+def candidate_limit():
+    # Common terms match most of the corpus; only the newest N matches are ranked
+    return getattr(settings, 'SEARCH_CANDIDATE_LIMIT', 10000)
+
+
+def ranked_sql(index, match, visibility, ordering, position=None, limit=20, candidates=None):
+    """
+    One page of ``(id, rank)`` rows for a MATCH, best first. bm25() is
+    negative and lower is better, so ascending rank is descending relevance.
+    ``visibility`` is a (SQL condition on the source row aliased ``src``,
+    params) pair. ``candidates`` caps the ranked matches to the newest N,
+    which FTS5 finds by walking its doclists backwards. Returns (sql, params).
+    """
+    table, _, weights = INDEXES[index]
+    condition, visibility_params = visibility
+    window, window_params = '', []
+    if candidates:
+        window = (
+            f"AND {index}.rowid >= (SELECT COALESCE(MIN(rowid), 0) FROM ("
+            f"SELECT rowid FROM {index} WHERE {index} MATCH %s ORDER BY rowid DESC LIMIT %s)) "
+        )
+        window_params = [match, candidates]
+    sql = (
+        f"SELECT id, rank FROM ("
+        f"SELECT src.id AS id, bm25({index}, {', '.join(map(str, weights))}) AS rank "
+        f"FROM {index} JOIN {table} AS src ON src.id = {index}.rowid "
+        f"WHERE {index} MATCH %s {window}AND ({condition})"
+        f")"
+    )
+    params = [match, *window_params, *visibility_params]
+    if position is not None:
+        keyset, keyset_params = keyset_sql(position, ordering)
+        sql += f' WHERE {keyset}'
+        params += keyset_params
+    order = ', '.join(f"{field.lstrip('-')} {'DESC' if field.startswith('-') else 'ASC'}" for field in ordering)
+    return f'{sql} ORDER BY {order} LIMIT %s', [*params, limit]
+
+
+class Search:
+    """
+    A query against one model, paginated by ``SearchPagination``. With
+    FTS5 pages come from ``fetch_ranked``; elsewhere ``queryset`` is a
+    portable icontains fallback that has no relevance score and lists
+    the newest rows first.
+    """
+    model = None
+    index = None
+
+    def __init__(self, text, viewer=None):
+        self.terms = search_terms(text)
+        self.viewer = viewer
+
+    @property
+    def uses_fts(self):
+        return fts_enabled()
+
+    def visibility_sql(self):
+        return '1 = 1', []
+
+    def visible(self, queryset):
+        return queryset
+
+    def fetch_ranked(self, position, ordering, limit):
+        if not self.terms:
+            return []
+        sql, params = ranked_sql(
+            self.index, match_expression(self.terms), self.visibility_sql(), ordering, position, limit, candidate_limit(),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [{'id': row[0], 'rank': row[1]} for row in cursor.fetchall()]
+
+    def queryset(self):
+        _, columns, _ = INDEXES[self.index]
+        queryset = self.visible(self.model.objects.all())
+        for term in self.terms:
+            queryset = queryset.filter(reduce(or_, (Q(**{f'{column}__icontains': term}) for column in columns)))
+        queryset = queryset.annotate(rank=ExpressionWrapper(-F('id'), output_field=IntegerField())).values('id', 'rank')
+        return queryset if self.terms else queryset.none()
+
+
+class PostSearch(Search):
+    model = Post
+    index = POST_INDEX
+
+    def visibility_sql(self):
+        # Same rule as PostsListView: public posts plus the viewer's own
+        viewer_id = self.viewer.id if self.viewer is not None and self.viewer.is_authenticated else None
+        return 'src.is_public = %s OR src.author_id = %s', [True, viewer_id]
+
+    def visible(self, queryset):
+        if self.viewer is not None and self.viewer.is_authenticated:
+            return queryset.filter(Q(is_public=True) | Q(author=self.viewer))
+        return queryset.filter(is_public=True)
+
+
+class UserSearch(Search):
+    model = User
+    index = USER_INDEX
+
+    def visibility_sql(self):
+        return 'src.is_active = %s', [True]
+
+    def visible(self, queryset):
+        return queryset.filter(is_active=True)
@@ -1,10 +1,19 @@
+import time
+
 from api.models import User, Post, Comment, SubComment
 from django.contrib.auth.password_validation import validate_password
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from rest_framework import serializers
+from django.urls import reverse
+from api.fieldsets import SparseFieldsetMixin
+from api.pagination import CreatedAtCursorPagination
+from api.resolvers import ResolverMixin, ResolverListSerializer
+from api.reactions import REACTIONS
+from api import images, tokens
+from api.authentication import CLAIM_FIELDS
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ResolverMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     followers = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
         many=True,
@@ -17,9 +26,12 @@ class UserSerializer(serializers.ModelSerializer):
     )
     profile_picture = serializers.ImageField(max_length=None, use_url=True)
     is_following = serializers.SerializerMethodField()  # Add is_following field
+    profile_picture_srcset = serializers.SerializerMethodField()  # Resized/WebP variants, see api/images.py
+    resolver_lookups = [('following', 'id')]
 
     class Meta:
         model = User
+        list_serializer_class = ResolverListSerializer
         fields = [
             'id',
             'username',
@@ -37,41 +49,69 @@ class UserSerializer(serializers.ModelSerializer):
             'followers',
             'following',
             'is_following',  # Include is_following in the fields
+            'profile_picture_width',
+            'profile_picture_height',
+            'profile_picture_srcset',
         ]
+        read_only_fields = ['profile_picture_width', 'profile_picture_height']
 
     def get_is_following(self, obj):
-        # Check if the request is authenticated and if the user is following the serialized user
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.followers.filter(id=request.user.id).exists()  # Check if the user is in the followers list
-        return False  # Not following if the user is not authenticated        
+        # Answered for the whole page by the request's resolver, False for anonymous users
+        return self.resolver.resolve('following', obj.id)
+
+    def get_profile_picture_srcset(self, obj):
+        return images.srcset(obj.profile_picture_variants, self.context.get('request'))
+
+
+class UserSummarySerializer(UserSerializer):
+    # Compact form used whenever a user is embedded in another object; use ?expand= for the full one
+    profile_picture = serializers.ImageField(read_only=True)
+
+    class Meta:
+        model = User
+        list_serializer_class = ResolverListSerializer
+        fields = [
+            'id',
+            'username',
+            'first_name',
+            'last_name',
+            'profile_picture',
+            'profile_picture_srcset',
+            'followers_count',
+            'following_count',
+            'is_following',
+        ]
+        read_only_fields = fields
+
+
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = tokens.RefreshToken
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
 
-        # Add custom claims to the JWT token
-        token['username'] = user.username
-        token['email'] = user.email
-        token['first_name'] = user.first_name
-        token['last_name'] = user.last_name
-        token['bio'] = user.bio
-        token['gender'] = user.gender
-        token['profile_picture'] = user.profile_picture.url if user.profile_picture else None
-        token['location'] = user.location
-        token['phone_number'] = user.phone_number
-        token['website'] = user.website
-        token['date_of_birth'] = str(user.date_of_birth) if user.date_of_birth else None
-        token['age'] = user.age
-
-        # Add followers and following count (optional)
-        token['followers_count'] = user.followers.count()
-        token['following_count'] = user.following.count()
+        # Identity claims only: the token rides on every request, and read-only
+        # requests authenticate from these without loading the user (api.authentication)
+        for claim in CLAIM_FIELDS:
+            token[claim] = getattr(user, claim)
 
         return token
 
 
 
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = tokens.RefreshToken
+
+    def validate(self, attrs):
+        # Timed for the token stats: rotation adds blacklist and outstanding rows on every refresh
+        started = time.perf_counter()
+        try:
+            return super().validate(attrs)
+        finally:
+            tokens.refresh_timings.append(time.perf_counter() - started)
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(
         write_only=True,
@@ -133,95 +173,146 @@ class ProfileSerializer(serializers.ModelSerializer):
         ]  # Include fields relevant for profile update
 
     def update(self, instance, validated_data):
-        # Update user fields with validated data
-        instance.email = validated_data.get('email', instance.email)
-        instance.username = validated_data.get('username', instance.username)
-        instance.first_name = validated_data.get('first_name', instance.first_name)
-        instance.last_name = validated_data.get('last_name', instance.last_name)
-        instance.bio = validated_data.get('bio', instance.bio)
-        instance.gender = validated_data.get('gender', instance.gender)
-        instance.location = validated_data.get('location', instance.location)
-        instance.phone_number = validated_data.get('phone_number', instance.phone_number)
-        instance.website = validated_data.get('website', instance.website)
-        instance.date_of_birth = validated_data.get('date_of_birth', instance.date_of_birth)
-        
-        if 'profile_picture' in validated_data:
-            instance.profile_picture = validated_data['profile_picture']
-
-        instance.save()
+        # Only the submitted profile columns are written: followers_count and
+        # following_count move with F() updates and must never be saved back
+        for field in self.Meta.fields:
+            if field in validated_data:
+                setattr(instance, field, validated_data[field])
+        instance.save(update_fields=[field for field in self.Meta.fields if field in validated_data])
         return instance
 
 
-class RepostedFromSerializer(serializers.ModelSerializer):
-    author = UserSerializer(read_only=True)  # Serialize original author details
+class RepostedFromSerializer(ResolverMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    author = UserSummarySerializer(read_only=True)  # Serialize original author details
+    image_srcset = serializers.SerializerMethodField()
+    expandable_fields = {'author': UserSerializer}
+    resolver_lookups = [('following', 'author_id')]
 
     class Meta:
         model = Post  # Assuming Post has a ForeignKey to User
-        fields = ['id', 'author', 'content', 'image', 'created_at']  # Include necessary fields
+        list_serializer_class = ResolverListSerializer
+        fields = ['id', 'author', 'content', 'image', 'image_width', 'image_height', 'image_srcset', 'created_at']  # Include necessary fields
 
+    def get_image_srcset(self, obj):
+        return images.srcset(obj.image_variants, self.context.get('request'))
 
-class PostSerializer(serializers.ModelSerializer):
-    author = UserSerializer(read_only=True)  # To display the author's username
+
+class PostSerializer(ResolverMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    author = UserSummarySerializer(read_only=True)  # To display the author's username
     reposted_from = RepostedFromSerializer(read_only=True)  # Serialize reposted_from details
     reposted_by = serializers.StringRelatedField(read_only=True)
+    is_liked_by_user = serializers.SerializerMethodField()
+    is_disliked_by_user = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()  # Resized/WebP variants, see api/images.py
+    expandable_fields = {'author': UserSerializer}
+    resolver_lookups = [
+        ('post_likes', 'id'),
+        ('post_dislikes', 'id'),
+        ('following', 'author_id'),
+        ('following', 'reposted_from.author_id'),
+    ]
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'content', 'image', 'created_at', 'updated_at', 
-                  'likes', 'dislikes', 'is_public', 'reposted_from', 'reposted_by']
+        list_serializer_class = ResolverListSerializer
+        fields = ['id', 'author', 'content', 'image', 'image_width', 'image_height', 'image_srcset', 'created_at', 'updated_at', 
+                  'likes', 'dislikes', 'like_count', 'dislike_count', 'is_liked_by_user', 'is_disliked_by_user',
+                  'is_public', 'reposted_from', 'reposted_by']
+        read_only_fields = ['likes', 'dislikes', 'like_count', 'dislike_count', 'image_width', 'image_height']  # Reactions go through api/reactions.py
+
+    def get_image_srcset(self, obj):
+        return images.srcset(obj.image_variants, self.context.get('request'))
+
+    def get_is_liked_by_user(self, obj):
+        return self.resolver.resolve('post_likes', obj.id)
+
+    def get_is_disliked_by_user(self, obj):
+        return self.resolver.resolve('post_dislikes', obj.id)
 
     def create(self, validated_data):
     # Extract reposted_from if present to handle repost logic
         reposted_from_instance = validated_data.pop('reposted_from', None)
 
-    # Create the post instance
-        post = super().create(validated_data)
-
-    # If this is a repost, link it to the original post
+    # If this is a repost, link it to the original post; set before the first save so
+    # post_save sees a repost being created (api.trending counts it there)
         if reposted_from_instance:
-            post.reposted_from = reposted_from_instance  # Set the original post instance
-            post.reposted_by = validated_data['author']  # Set the reposted_by to the current user
-            post.content = reposted_from_instance.content  # Copy the content from the original post
-            post.image = reposted_from_instance.image  # Copy the image from the original post (if any)
-            post.save()
+            validated_data['reposted_from'] = reposted_from_instance  # Set the original post instance
+            validated_data['reposted_by'] = validated_data['author']  # Set the reposted_by to the current user
+            validated_data['content'] = reposted_from_instance.content  # Copy the content from the original post
+            validated_data['image'] = reposted_from_instance.image  # Copy the image from the original post (if any)
 
-        return post
+    # Create the post instance
+        return super().create(validated_data)
      
   
-class CommentSerializer(serializers.ModelSerializer):
-    author = UserSerializer(read_only=True)
+class CommentSerializer(ResolverMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    author = UserSummarySerializer(read_only=True)
+    expandable_fields = {'author': UserSerializer}
     is_liked_by_user = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()  # Add this line
+    resolver_lookups = [('comment_likes', 'id'), ('following', 'author_id')]
 
     class Meta:
         model = Comment
+        list_serializer_class = ResolverListSerializer
         fields = ['id', 'post', 'author', 'content', 'created_at', 'likes', 'is_liked_by_user', 'like_count']
-        read_only_fields = ['author', 'created_at']
+        read_only_fields = ['author', 'created_at', 'likes', 'like_count']
 
     def get_is_liked_by_user(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.likes.filter(id=request.user.id).exists()
-        return False
-
-    def get_like_count(self, obj):
-        return obj.like_count  # Accesses the property from the model
+        return self.resolver.resolve('comment_likes', obj.id)
 
-class SubCommentSerializer(serializers.ModelSerializer):
-    author = UserSerializer(read_only=True)
+class SubCommentSerializer(ResolverMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    author = UserSummarySerializer(read_only=True)
+    expandable_fields = {'author': UserSerializer}
     is_liked_by_user = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()  # Add this line
+    resolver_lookups = [('subcomment_likes', 'id'), ('following', 'author_id')]
     
     class Meta:
         model = SubComment
+        list_serializer_class = ResolverListSerializer
         fields = ['id', 'comment', 'author', 'content', 'created_at', 'likes', 'like_count', 'is_liked_by_user']
-        read_only_fields = ['author', 'created_at']  # Author and created_at should be read-only
+        read_only_fields = ['author', 'created_at', 'likes', 'like_count']  # Author and created_at should be read-only
         
     def get_is_liked_by_user(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.likes.filter(id=request.user.id).exists()
-        return False
+        return self.resolver.resolve('subcomment_likes', obj.id)
+
+
+class ThreadCommentSerializer(CommentSerializer):
+    """
+    A comment inside /posts/<id>/thread/, built from
+    ``comments_with_replies``: its reply count and newest replies, plus a
+    link continuing them on the sub-comment list when there are more.
+    """
+    reply_count = serializers.IntegerField(read_only=True)
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['reply_count', 'replies']
+
+    def get_replies(self, obj):
+        replies = obj.first_replies
+        next_link = None
+        if obj.reply_count > len(replies) and replies:
+            request = self.context['request']
+            url = request.build_absolute_uri(reverse('subcomment-list', args=[obj.id]))
+            next_link = CreatedAtCursorPagination().link_after(f'{url}?page_size={len(replies)}', replies[-1])
+        return {
+            'results': SubCommentSerializer(replies, many=True, context=self.context).data,
+            'has_more': obj.reply_count > len(replies),
+            'next': next_link,
+        }
+
+
+class ReactionSerializer(serializers.Serializer):
+    target = serializers.ChoiceField(choices=['post', 'comment', 'subcomment'])
+    id = serializers.IntegerField(min_value=1)
+    reaction = serializers.ChoiceField(choices=['like', 'dislike'])
+    active = serializers.BooleanField()  # True to react, False to withdraw the reaction
+
+    def validate(self, attrs):
+        if (attrs['target'], attrs['reaction']) not in REACTIONS:
+            raise serializers.ValidationError(f"A {attrs['target']} cannot be {attrs['reaction']}d.")
+        return attrs
+
 
-    def get_like_count(self, obj):
-        return obj.like_count  # Accesses the property from the model
\ No newline at end of file
+class ReactionBatchSerializer(serializers.Serializer):
+    reactions = ReactionSerializer(many=True, allow_empty=False, max_length=500)
@@ -0,0 +1,152 @@
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from api import blobs, images, realtime, search, trending
+from api.authentication import user_cache
+from api.models import User, Post, Comment, SubComment
+from api.serializers import CommentSerializer, SubCommentSerializer
+
+
+class Withdrawing(threading.local):
+    # Posts and comments on their way out, and the replies deleted with each comment
+    def __init__(self):
+        self.posts = set()
+        self.comments = set()
+        self.replies = defaultdict(int)
+
+
+withdrawing = Withdrawing()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def schedule_image_variants(sender, instance, **kwargs):
+    # Derivatives are built off the request thread once the upload is committed
+    if images.needs_variants(instance):
+        transaction.on_commit(lambda: images.schedule(instance))
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=User)
+def remember_image_blob(sender, instance, update_fields=None, **kwargs):
+    instance._previous_image_name = blobs.previous_name(instance, update_fields)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def count_image_blob_references(sender, instance, created, **kwargs):
+    # Same transaction as the save; reposts sharing the original's image add a reference
+    previous = getattr(instance, '_previous_image_name', None)
+    current = blobs.stored_name(instance)
+    if previous is None and not created:
+        return  # An update_fields save that left the image alone
+    if previous != current:
+        blobs.acquire(current)
+        blobs.release(previous or '')
+    instance._previous_image_name = current
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+def release_image_blob(sender, instance, **kwargs):
+    blobs.release(blobs.stored_name(instance))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Same transaction as the save, so the index never sees uncommitted text
+    if search.fts_enabled() and search.is_indexed(instance, update_fields):
+        search.index_instance(instance)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+def remove_from_search_index(sender, instance, **kwargs):
+    if search.fts_enabled():
+        search.unindex_instance(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, created=False, update_fields=None, **kwargs):
+    # Profile edits and password changes both save the user; sign-up and a login's last_login stamp change nothing tokens claim
+    user_cache.invalidate(instance.pk, changed=not created and update_fields != frozenset({'last_login'}))
+
+
+@receiver(post_save, sender=Comment)
+def announce_comment(sender, instance, created, **kwargs):
+    # Viewer-neutral payload: per-viewer flags come back false, clients keep their own state
+    if created:
+        realtime.publish_after_commit(lambda: [(instance.post_id, {
+            'type': 'comment.created', 'post': instance.post_id, 'comment': CommentSerializer(instance).data,
+        })])
+
+
+@receiver(post_save, sender=SubComment)
+def announce_subcomment(sender, instance, created, **kwargs):
+    if created:
+        realtime.publish_after_commit(lambda: [(instance.comment.post_id, {
+            'type': 'subcomment.created', 'post': instance.comment.post_id, 'comment': instance.comment_id,
+            'subcomment': SubCommentSerializer(instance).data,
+        })])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=SubComment)
+@receiver(post_save, sender=Post)
+def count_trending_event(sender, instance, created, **kwargs):
+    if created:
+        move_trending_score(instance, 1)
+
+
+@receiver(pre_delete, sender=Post)
+def withdraw_post_thread(sender, instance, **kwargs):
+    # Comments on an original only ever counted for the post going away; a repost's go in one UPDATE
+    withdrawing.posts.add(instance.pk)
+    if instance.reposted_from_id:
+        totals = Comment.objects.filter(post_id=instance.pk).aggregate(
+            comments=Count('id', distinct=True), replies=Count('sub_comments'))
+        trending.withdraw_thread([instance.pk], totals['comments'], totals['replies'])
+
+
+@receiver(pre_delete, sender=Comment)
+def remember_deleted_comment(sender, instance, **kwargs):
+    withdrawing.comments.add(instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=SubComment)
+@receiver(post_delete, sender=Post)
+def withdraw_trending_event(sender, instance, **kwargs):
+    # Cascades delete replies, then comments, then posts: replies are tallied
+    # for their comment, and a comment's thread goes in one UPDATE unless its
+    # post's pre_delete already took it
+    if isinstance(instance, SubComment):
+        if instance.comment_id in withdrawing.comments:
+            withdrawing.replies[instance.comment_id] += 1
+        else:
+            move_trending_score(instance, -1)
+    elif isinstance(instance, Comment):
+        withdrawing.comments.discard(instance.pk)
+        replies = withdrawing.replies.pop(instance.pk, 0)
+        if instance.post_id not in withdrawing.posts:
+            trending.withdraw_thread([instance.post_id], 1, replies)
+    else:
+        withdrawing.posts.discard(instance.pk)
+        move_trending_score(instance, -1)
+
+
+def move_trending_score(instance, count):
+    # Comments and replies count towards their post, reposts towards the post they repost
+    if isinstance(instance, Comment):
+        trending.record('comment', [instance.post_id], count)
+    elif isinstance(instance, SubComment):
+        trending.record('subcomment', Comment.objects.filter(pk=instance.comment_id).values('post_id'), count)
+    elif instance.reposted_from_id:
+        trending.record('repost', [instance.reposted_from_id], count)
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+
+BLOB_PREFIX = 'cas/'
+
+
+def blob_name(digest, extension):
+    # cas/3f/3f9a...c1.jpg; the two-character fan-out keeps directories small
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every upload under the SHA-256 of its bytes, so identical files
+    share one blob whatever they were called and wherever they came from.
+    The digest is computed while the upload streams into a temporary file,
+    which is then renamed into place, or dropped if the blob already
+    exists. The uploaded name only contributes its extension.
+
+    Blobs are shared, so deleting one is left to ``api.blobs.collect``,
+    which honours the reference counts kept in ``MediaBlob``.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name  # Collisions are the point: the same bytes get the same name
+
+    def _save(self, name, content):
+        directory = self.path(f'{BLOB_PREFIX}.tmp')
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        digest = hashlib.sha256()
+        handle, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    output.write(chunk)
+
+            name = blob_name(digest.hexdigest(), os.path.splitext(name)[1].lower())
+            path = self.path(name)
+            if os.path.exists(path):
+                os.utime(path)  # Fresh mtime: collect() spares blobs younger than its grace period
+                return name
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+            return name
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+
+blob_storage = ContentAddressedStorage()  # Location follows MEDIA_ROOT, including under override_settings
+
+
+def get_blob_storage():
+    # Callable storage for the model fields, so migrations record a reference instead of a path
+    return blob_storage
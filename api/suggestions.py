@@ -0,0 +1,249 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from api.models import User
+
+
+logger = logging.getLogger(__name__)
+
+Follow = User.followers.through  # from_user is the followed account, to_user the follower
+
+# Bytes per entry in the arrays, for the memory budget: 'q' offsets and fill positions, 'i' targets and degrees
+OFFSET_BYTES, POSITION_BYTES, TARGET_BYTES, DEGREE_BYTES = 8, 8, 4, 4
+
+FETCH_SIZE = 10_000  # Rows per fetchmany() while building
+
+
+class Overlay:
+    # Follows and unfollows applied since the arrays were built, newest state per edge
+
+    def __init__(self):
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.size = 0
+
+    def apply(self, follower_id, followee_id, following):
+        (self.added if following else self.removed)[follower_id].add(followee_id)
+        (self.removed if following else self.added)[follower_id].discard(followee_id)
+        self.size += 1
+
+    def patch(self, follower_id, followees):
+        removed, added = self.removed.get(follower_id), self.added.get(follower_id)
+        if removed:
+            followees = [user_id for user_id in followees if user_id not in removed]
+        if added:
+            present = set(followees)
+            followees = [user_id for user_id in added if user_id not in present] + followees
+        return followees
+
+
+def degree_cap(degrees, capacity):
+    # Largest per-user cap that keeps sum(min(degree, cap)) within capacity; None when no cap is needed
+    if sum(degrees) <= capacity:
+        return None
+    low, high = 0, max(degrees)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if sum(min(degree, middle) for degree in degrees) <= capacity:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class FollowGraph:
+    """
+    The follow graph in compressed sparse row form: the accounts user ``u``
+    follows are ``targets[offsets[u]:offsets[u + 1]]``, newest first, and
+    ``indegree[u]`` counts u's followers. User ids index the arrays
+    directly. Building peaks with every array allocated at once, and that
+    peak fits in SUGGESTIONS_MEMORY_BUDGET bytes; when the edges do not,
+    every account keeps only its newest follows, down to the cap that fits.
+
+    Follows made in this process land in an Overlay straight away. The
+    arrays are rebuilt from the database, in the background, once the
+    overlay holds SUGGESTIONS_OVERLAY_LIMIT changes or they are older than
+    SUGGESTIONS_RELOAD_INTERVAL seconds, which is also how follows made by
+    other workers arrive. Until the first build finishes, suggest() returns
+    None.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.offsets = self.targets = self.indegree = None
+        self.overlays = [Overlay()]  # Oldest first; a reload keeps only those started after it began
+        self.loading = False
+        self.loaded_at = 0.0
+        self.capped_at = None
+
+    def ready(self):
+        return self.offsets is not None
+
+    def load(self):
+        """
+        Build the arrays from the follow table and swap them in. Degrees
+        are counted first, so the arrays are allocated once, at their
+        final size, and filled in a single ordered scan.
+        """
+        with self.lock:
+            overlay = Overlay()
+            self.overlays.append(overlay)  # Changes from here on may or may not be in the scan; both are fine
+        try:
+            offsets, targets, indegree, cap = self.build()
+        except Exception:
+            with self.lock:
+                self.loading = False
+            raise
+        with self.lock:
+            self.offsets, self.targets, self.indegree, self.capped_at = offsets, targets, indegree, cap
+            self.overlays = self.overlays[self.overlays.index(overlay):]
+            self.loaded_at = time.monotonic()
+            self.loading = False
+
+    def build(self):
+        table = connection.ops.quote_name(Follow._meta.db_table)
+        follower, followee = (connection.ops.quote_name(name) for name in ('to_user_id', 'from_user_id'))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT MAX(id) FROM {connection.ops.quote_name(User._meta.db_table)}')
+            count = (cursor.fetchone()[0] or 0) + 1
+            degrees = array('i', bytes(DEGREE_BYTES * count))
+            cursor.execute(f'SELECT {follower}, COUNT(*) FROM {table} GROUP BY {follower}')
+            while rows := cursor.fetchmany(FETCH_SIZE):
+                for user_id, degree in rows:
+                    if user_id < count:  # Users created since MAX(id) wait for the next reload
+                        degrees[user_id] = degree
+
+            # The fill below holds offsets, indegree, position and targets at once; degrees is gone by then
+            budget = getattr(settings, 'SUGGESTIONS_MEMORY_BUDGET', 64 * 2**20)
+            fixed = OFFSET_BYTES * (count + 1) + DEGREE_BYTES * count + POSITION_BYTES * count
+            if fixed > budget:
+                logger.warning('The follow graph needs %s bytes for %s users before any edge, over the budget', fixed, count)
+            cap = degree_cap(degrees, max(0, budget - fixed) // TARGET_BYTES)
+            offsets = array('q', bytes(OFFSET_BYTES * (count + 1)))
+            for user_id, degree in enumerate(degrees):
+                offsets[user_id + 1] = offsets[user_id] + (degree if cap is None else min(degree, cap))
+            del degrees
+
+            targets = array('i', bytes(TARGET_BYTES * offsets[-1]))
+            indegree = array('i', bytes(DEGREE_BYTES * count))
+            position = array('q', offsets[:-1])  # Next free slot per follower, reused as a fill cursor
+            cursor.execute(f'SELECT {follower}, {followee} FROM {table} ORDER BY {follower}, id DESC')
+            while rows := cursor.fetchmany(FETCH_SIZE):
+                for user_id, followed_id in rows:
+                    if user_id >= count or followed_id >= count:
+                        continue
+                    indegree[followed_id] += 1
+                    if position[user_id] < offsets[user_id + 1]:
+                        targets[position[user_id]] = followed_id
+                        position[user_id] += 1
+        return offsets, targets, indegree, cap
+
+    def refresh(self):
+        # Start a rebuild when due; 'sync' (tests, management commands) builds inline
+        with self.lock:
+            pending = sum(overlay.size for overlay in self.overlays)
+            due = (
+                not self.ready()
+                or pending >= getattr(settings, 'SUGGESTIONS_OVERLAY_LIMIT', 100_000)
+                or time.monotonic() - self.loaded_at >= getattr(settings, 'SUGGESTIONS_RELOAD_INTERVAL', 600)
+            )
+            if not due or self.loading:
+                return
+            self.loading = True
+        if getattr(settings, 'SUGGESTIONS_LOADER', 'thread') == 'sync':
+            self.load()
+        else:
+            threading.Thread(target=self.load_in_background, name='follow-graph', daemon=True).start()
+
+    def load_in_background(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception('Loading the follow graph failed')
+        finally:
+            close_old_connections()
+
+    def apply(self, follower_id, followee_id, following):
+        with self.lock:
+            self.overlays[-1].apply(follower_id, followee_id, following)
+            if self.indegree is not None and followee_id < len(self.indegree):
+                self.indegree[followee_id] += 1 if following else -1
+
+    def following(self, user_id):
+        # Newest first: the overlays' additions, then the arrays
+        if user_id < len(self.offsets) - 1:
+            followees = list(self.targets[self.offsets[user_id]:self.offsets[user_id + 1]])
+        else:
+            followees = []
+        for overlay in self.overlays:
+            followees = overlay.patch(user_id, followees)
+        return followees
+
+    def suggest(self, user_id, limit=20):
+        """
+        Accounts followed by the accounts ``user_id`` follows, ranked by
+        how many of them do (the mutual count), then by follower count.
+        Only the newest SUGGESTIONS_FANOUT follows are walked at each of the
+        two hops, which bounds the work for accounts following thousands.
+        Returns [(user id, mutual count)], or None while the graph loads.
+        """
+        self.refresh()
+        fanout = getattr(settings, 'SUGGESTIONS_FANOUT', 500)
+        # Only the copies of the adjacency slices are taken under the lock; counting and ranking run outside it
+        with self.lock:
+            if not self.ready():
+                return None
+            followees = self.following(user_id)
+            hops = [self.following(followee_id)[:fanout] for followee_id in islice(followees, fanout)]
+            indegree = self.indegree  # A reload swaps in new arrays rather than refilling this one
+        mutuals = Counter()
+        for followed in hops:
+            mutuals.update(followed)
+        for known in (user_id, *followees):
+            mutuals.pop(known, None)
+        size = len(indegree)
+        # Single reads race only with apply()'s one-step changes to the follower count, harmless for ranking
+        return heapq.nlargest(
+            limit, mutuals.items(),
+            key=lambda item: (item[1], indegree[item[0]] if item[0] < size else 0, -item[0]),
+        )
+
+    def stats(self):
+        with self.lock:
+            arrays = [array_ for array_ in (self.offsets, self.targets, self.indegree) if array_ is not None]
+            return {
+                'ready': self.ready(),
+                'loading': self.loading,
+                'edges': len(self.targets) if self.targets is not None else 0,
+                'bytes': sum(array_.itemsize * len(array_) for array_ in arrays),
+                'capped_at': self.capped_at,
+                'overlay_changes': sum(overlay.size for overlay in self.overlays),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.offsets = self.targets = self.indegree = None
+            self.overlays = [Overlay()]
+            self.loading = False
+            self.loaded_at = 0.0
+            self.capped_at = None
+
+
+follow_graph = FollowGraph()
+
+
+def record_follow(follower_id, followee_id, following):
+    # Called inside the follow/unfollow transaction; the graph only hears about it once committed
+    transaction.on_commit(lambda: follow_graph.apply(follower_id, followee_id, following))
+
+
+def suggest(user_id, limit=20):
+    return follow_graph.suggest(user_id, limit)
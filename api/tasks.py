@@ -0,0 +1,18 @@
+from api import images, jobs, timeline
+from api.models import Post
+
+
+# Job tasks (api/jobs.py). Each may run more than once, so each is idempotent.
+
+
+@jobs.task('timeline.fan_out_post', queue='timeline')
+def fan_out_post(post_id):
+    # Rows already written by an earlier attempt are skipped by the unique constraint
+    post = Post.objects.select_related('author').filter(pk=post_id).first()
+    if post is not None:  # Deleted before its turn
+        timeline.fan_out_post(post)
+
+
+@jobs.task('images.update_variants', queue='media', max_attempts=3)
+def update_image_variants(label, pk):
+    images.update_variants(label, pk)
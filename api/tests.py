@@ -1,3 +1,1301 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Max
+from django.http import Http404
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import jobs, media, metrics, reaction_buffer, reactions, realtime, search, suggestions, tokens, trending
+from api.management.commands import benchmark_endpoints
+from api.authentication import CachedJWTAuthentication, user_cache
+from api.compression import negotiate
+from api.models import User, Post, Comment, SubComment, TimelineEntry, MediaBlob, Job
+from api.renderers import FastJSONRenderer
+from api.resolvers import RelationResolver
+
+
+class SerializationQueryCountTests(TestCase):
+    # The list views must cost a fixed number of queries regardless of page size
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}', email=f'author{i}@example.com', password='pw')
+            for i in range(3)
+        ]
+        for author in cls.authors:
+            author.followers.add(cls.viewer)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def create_posts(self, count):
+        for i in range(count):
+            author = self.authors[i % len(self.authors)]
+            original = Post.objects.create(author=author, content=f'post {i}')
+            original.likes.add(self.viewer, *self.authors)
+            original.dislikes.add(self.authors[0])
+            Comment.objects.create(post=original, author=author, content='comment').likes.add(self.viewer)
+            Post.objects.create(
+                author=self.viewer, content=f'repost {i}', reposted_from=original, reposted_by=self.viewer,
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_posts_list_query_count_is_constant(self):
+        self.create_posts(2)
+        small = self.count_queries('/api/posts/')
+        self.create_posts(20)
+        self.assertEqual(self.count_queries('/api/posts/'), small)
+        self.assertEqual(self.count_queries('/api/posts/?page_size=10'), small)
+        self.assertLessEqual(small, 10)
+
+    def test_comment_list_query_count_is_constant(self):
+        post = Post.objects.create(author=self.authors[0], content='discussion')
+        Comment.objects.create(post=post, author=self.authors[1], content='first')
+        small = self.count_queries(f'/api/posts/{post.id}/comments/')
+        for author in self.authors * 5:
+            Comment.objects.create(post=post, author=author, content='more').likes.add(self.viewer)
+        self.assertEqual(self.count_queries(f'/api/posts/{post.id}/comments/'), small)
+
+    def test_thread_query_count_is_constant(self):
+        post = Post.objects.create(author=self.authors[0], content='discussion')
+        first = Comment.objects.create(post=post, author=self.authors[1], content='first')
+        SubComment.objects.create(comment=first, author=self.viewer, content='reply')
+        small = self.count_queries(f'/api/posts/{post.id}/thread/')
+        for author in self.authors * 4:
+            comment = Comment.objects.create(post=post, author=author, content='more')
+            for _ in range(4):
+                SubComment.objects.create(comment=comment, author=author, content='reply').likes.add(self.viewer)
+        self.assertEqual(self.count_queries(f'/api/posts/{post.id}/thread/?replies=3'), small)
+        self.assertLessEqual(small, 12)
+
+        thread = self.client.get(f'/api/posts/{post.id}/thread/?replies=3').json()
+        self.assertEqual(thread['post']['id'], post.id)
+        self.assertEqual(len(thread['comments']['results']), 10)
+        newest = thread['comments']['results'][0]
+        self.assertEqual((newest['reply_count'], len(newest['replies']['results'])), (4, 3))
+        self.assertTrue(newest['replies']['has_more'])
+        self.assertTrue(newest['replies']['results'][0]['is_liked_by_user'])
+        rest = self.client.get(newest['replies']['next']).json()
+        self.assertEqual(len(rest['results']), 1)
+        self.assertIsNone(rest['next'])
+        last_page = self.client.get(thread['comments']['next']).json()['comments']
+        self.assertEqual(last_page['results'][-1]['replies'], {
+            'results': [last_page['results'][-1]['replies']['results'][0]], 'has_more': False, 'next': None,
+        })
+
+    def test_serialized_flags_match_data(self):
+        self.create_posts(1)
+        posts = self.client.get('/api/posts/').json()
+        repost = next(post for post in posts if post['reposted_from'])
+        self.assertTrue(repost['reposted_from']['author']['is_following'])
+        self.assertFalse(repost['author']['is_following'])
+        self.assertNotIn('followers', repost['reposted_from']['author'])  # Embedded users are summaries
+        original = next(post for post in posts if not post['reposted_from'])
+        self.assertEqual(len(original['likes']), 4)
+        self.assertEqual(original['dislikes'], [self.authors[0].id])
+        self.assertTrue(original['is_liked_by_user'])
+        self.assertFalse(original['is_disliked_by_user'])
+
+    def test_resolver_answers_a_page_with_one_query(self):
+        self.create_posts(3)
+        resolver = RelationResolver(self.viewer.id)
+        posts = list(Post.objects.filter(reposted_from__isnull=True))
+        for post in posts:
+            resolver.register('post_likes', post.id)
+            resolver.register('post_dislikes', post.id)
+        with self.assertNumQueries(2):
+            self.assertTrue(all(resolver.resolve('post_likes', post.id) for post in posts))
+            self.assertFalse(any(resolver.resolve('post_dislikes', post.id) for post in posts))
+
+    def test_sparse_fieldsets_and_expand(self):
+        self.create_posts(1)
+        posts = self.client.get('/api/posts/?fields=id,reposted_from.author&expand=reposted_from.author').json()
+        repost = next(post for post in posts if post['reposted_from'])
+        self.assertEqual(set(repost), {'id', 'reposted_from'})
+        self.assertEqual(set(repost['reposted_from']), {'author'})
+        self.assertIn(self.viewer.id, repost['reposted_from']['author']['followers'])
+
+        expanded = self.count_queries('/api/posts/?expand=author,reposted_from.author')
+        self.create_posts(10)
+        self.assertEqual(self.count_queries('/api/posts/?expand=author,reposted_from.author'), expanded)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pager', email='pager@example.com', password='pw')
+        now = timezone.now()
+        self.ids = [Post.objects.create(author=self.user, content=f'post {i}', created_at=now).id for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_forward_and_back(self):
+        newest_first = list(reversed(self.ids))  # Equal timestamps, the id breaks the tie
+        first = self.client.get('/api/posts/?page_size=2').json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        third = self.client.get(second['next']).json()
+        self.assertEqual([post['id'] for page in (first, second, third) for post in page['results']], newest_first)
+        self.assertIsNone(third['next'])
+
+        back = self.client.get(third['previous']).json()
+        self.assertEqual([post['id'] for post in back['results']], newest_first[2:4])
+        self.assertEqual([post['id'] for post in self.client.get(back['previous']).json()['results']], newest_first[:2])
+
+    def test_forged_cursors_are_rejected(self):
+        def cursor(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for url, payload in [
+            ('/api/posts/', {'p': [1, 2]}),
+            ('/api/posts/', {'p': ['notadate', 2]}),
+            ('/api/posts/', {'p': [None, 2]}),
+            ('/api/posts/', {'p': ['2024-01-01T00:00:00+00:00']}),
+            ('/api/profiles/', {'p': ['x']}),
+            ('/api/profiles/', {'p': [[1]]}),
+        ]:
+            with self.subTest(url=url, payload=payload):
+                self.assertEqual(self.client.get(url, {'cursor': cursor(payload)}).status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/', {'cursor': 'not base64!'}).status_code, 404)
+
+    @override_settings(API_LEGACY_LIST_LIMIT=3)
+    def test_unpaginated_lists_are_bounded(self):
+        newest = list(reversed(self.ids))[:3]
+        for stream in (True, False):
+            with self.subTest(stream=stream), override_settings(API_STREAM_LISTS=stream, API_STREAM_CHUNK_SIZE=2):
+                response = self.client.get('/api/posts/')
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertEqual([post['id'] for post in json.loads(body)], newest)
+        self.assertEqual(len(self.client.get('/api/profiles/').json()), 1)
+        self.assertEqual(len(self.client.get('/api/posts/?page_size=4').json()['results']), 4)
+
+
+class ReactionCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        self.post = Post.objects.create(author=self.user, content='counted')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_toggle_views_maintain_counters(self):
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.client.post(f'/api/posts/{self.post.id}/dislike/')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (1, 1))
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_reactions_cannot_be_written_through_the_serializers(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        created = self.client.post('/api/posts/create/', {'content': 'new', 'likes': [other.id]}, format='json').json()
+        self.client.patch(f'/api/posts/{self.post.id}/', {'dislikes': [other.id]}, format='json')
+        self.assertFalse(Post.objects.get(id=created['id']).likes.exists())
+        self.assertFalse(self.post.dislikes.exists())
+        self.assertEqual(created['like_count'], 0)
+
+    def test_reconcile_repairs_drift(self):
+        self.post.likes.add(self.user)  # Bypasses the views, so the counter drifts
+        Post.objects.filter(pk=self.post.pk).update(dislike_count=5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (1, 0))
+
+
+@override_settings(JOBS_RUNNER='sync')
+class TimelineTests(TestCase):
+
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        self.writer = User.objects.create_user(username='writer', email='writer@example.com', password='pw')
+        self.star = User.objects.create_user(username='star', email='star@example.com', password='pw')
+        self.client = APIClient()
+
+    def post_as(self, user, content):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/posts/create/', {'content': content}, format='json').json()['id']
+
+    def feed(self, url='/api/feed/'):
+        self.client.force_authenticate(self.reader)
+        return self.client.get(url).json()
+
+    def test_fan_out_and_cleanup(self):
+        old = self.post_as(self.writer, 'before follow')
+        self.client.force_authenticate(self.reader)
+        self.client.post(f'/api/follow-unfollow/{self.writer.username}/')
+        new = self.post_as(self.writer, 'after follow')
+        self.assertEqual([post['id'] for post in self.feed()['results']], [new, old])
+
+        Post.objects.get(id=new).delete()
+        self.assertEqual([post['id'] for post in self.feed()['results']], [old])
+
+        self.client.force_authenticate(self.reader)
+        self.client.post(f'/api/follow-unfollow/{self.writer.username}/')
+        self.assertEqual(self.feed()['results'], [])
+
+    def test_posts_made_private_leave_follower_feeds(self):
+        self.client.force_authenticate(self.reader)
+        self.client.post(f'/api/follow-unfollow/{self.writer.username}/')
+        post = self.post_as(self.writer, 'soon private')
+        self.client.patch(f'/api/posts/{post}/', {'is_public': False}, format='json')
+        self.assertEqual(self.feed()['results'], [])
+        self.client.force_authenticate(self.writer)
+        self.assertEqual([row['id'] for row in self.client.get('/api/feed/').json()['results']], [post])
+
+        # An entry left behind is still filtered out when the feed is read
+        TimelineEntry.objects.create(user=self.reader, post_id=post, author=self.writer, created_at=timezone.now())
+        self.assertEqual(self.feed()['results'], [])
+
+        self.client.force_authenticate(self.writer)
+        self.client.patch(f'/api/posts/{post}/', {'is_public': True}, format='json')
+        self.assertEqual([row['id'] for row in self.feed()['results']], [post])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_wide_authors_are_merged_at_read_time_with_paging(self):
+        self.client.force_authenticate(self.reader)
+        self.client.post(f'/api/follow-unfollow/{self.star.username}/')
+        self.star.refresh_from_db()  # Authenticated users are loaded fresh on every real request
+        ids = [self.post_as(self.star, f'star {i}') for i in range(3)]
+        ids += [self.post_as(self.reader, f'own {i}') for i in range(2)]
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader, author=self.star).exists())
+
+        page = self.feed('/api/feed/?page_size=2')
+        seen = [post['id'] for post in page['results']]
+        while page['next']:
+            page = self.feed(page['next'])
+            seen += [post['id'] for post in page['results']]
+        self.assertEqual(seen, list(reversed(ids)))
+
+
+class IdempotentReactionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tapper', email='tapper@example.com', password='pw')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        self.post = Post.objects.create(author=self.other, content='tap me')
+        self.comment = Comment.objects.create(post=self.post, author=self.other, content='and me')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_put_and_delete_are_idempotent(self):
+        for _ in range(2):
+            self.assertEqual(self.client.put(f'/api/posts/{self.post.id}/like/').status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        for _ in range(2):
+            self.assertEqual(self.client.delete(f'/api/posts/{self.post.id}/like/').status_code, 204)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(self.post.likes.exists())
+
+    def test_unknown_target_is_not_found(self):
+        self.assertEqual(self.client.put('/api/posts/999/like/').status_code, 404)
+        self.assertEqual(self.client.post('/api/comments/999/like/').status_code, 404)
+        self.assertFalse(Post.likes.through.objects.exists())
+
+    def test_follow_put_delete(self):
+        self.client.put(f'/api/follow-unfollow/{self.other.username}/')
+        response = self.client.put(f'/api/follow-unfollow/{self.other.username}/')
+        self.assertEqual(response.json()['followers_count'], 1)
+        self.client.delete(f'/api/follow-unfollow/{self.other.username}/')
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.followers_count, 0)
+        self.assertEqual(self.client.put(f'/api/follow-unfollow/{self.user.username}/').status_code, 400)
+
+    def test_bulk_reactions(self):
+        self.post.dislikes.add(self.user)
+        Post.objects.filter(pk=self.post.pk).update(dislike_count=1)
+        response = self.client.post('/api/reactions/bulk/', {'reactions': [
+            {'target': 'post', 'id': self.post.id, 'reaction': 'like', 'active': False},
+            {'target': 'post', 'id': self.post.id, 'reaction': 'like', 'active': True},
+            {'target': 'post', 'id': self.post.id, 'reaction': 'dislike', 'active': False},
+            {'target': 'comment', 'id': self.comment.id, 'reaction': 'like', 'active': True},
+            {'target': 'subcomment', 'id': 999, 'reaction': 'like', 'active': True},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        statuses = {(r['target'], r['reaction']): r['status'] for r in response.json()['results']}
+        self.assertEqual(statuses, {
+            ('post', 'like'): 'applied',
+            ('post', 'dislike'): 'applied',
+            ('comment', 'like'): 'applied',
+            ('subcomment', 'like'): 'not_found',
+        })
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count, self.comment.like_count), (1, 0, 1))
+
+        invalid = {'reactions': [{'target': 'comment', 'id': self.comment.id, 'reaction': 'dislike', 'active': True}]}
+        self.assertEqual(self.client.post('/api/reactions/bulk/', invalid, format='json').status_code, 400)
+
+
+@override_settings(IMAGE_PIPELINE_EXECUTOR='sync')
+class ImagePipelineTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='painter', email='painter@example.com', password='pw')
+
+    def upload(self, size=(800, 400)):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, 'teal').save(buffer, 'JPEG')
+        return SimpleUploadedFile('canvas.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_variants_are_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.user, content='art', image=self.upload())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (800, 400))
+        widths = [entry['width'] for entry in post.image_variants['files']['image/jpeg']]
+        self.assertEqual(widths, [320, 640])  # Never upscaled to 1280
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = client.get(f'/api/posts/{post.id}/').json()
+        self.assertIn('_320w.jpg 320w', data['image_srcset']['image/jpeg'])
+
+    def test_backfill_command(self):
+        post = Post.objects.create(author=self.user, content='art', image=self.upload((200, 100)))
+        call_command('backfill_image_variants', workers=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants['files']['image/jpeg'][0]['width'], 200)
+
+
+class BlobStorageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='keeper', email='keeper@example.com', password='pw')
+
+    def upload(self, name='photo.JPG'):
+        return SimpleUploadedFile(name, b'same bytes' * 1000, content_type='image/jpeg')
+
+    def refs(self, name):
+        return MediaBlob.objects.get(name=name).ref_count
+
+    def test_identical_uploads_share_one_counted_blob(self):
+        first = Post.objects.create(author=self.user, image=self.upload())
+        second = Post.objects.create(author=self.user, image=self.upload('other.jpg'))
+        name = first.image.name
+        self.assertTrue(name.startswith('cas/') and name.endswith('.jpg'))
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+        self.assertEqual(self.refs(name), 2)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='fan', email='fan@example.com', password='pw'))
+        self.assertEqual(client.post('/api/posts/repost/', {'post_id': first.id}).status_code, 201)
+        self.assertEqual(self.refs(name), 3)
+
+        second.delete()
+        first.content = 'edited'
+        first.save()
+        self.user.profile_picture = self.upload()
+        self.user.save()
+        self.assertEqual(self.refs(name), 3)
+        self.user.profile_picture = None
+        self.user.save()
+        self.assertEqual(self.refs(name), 2)
+
+    def test_dedupe_command_moves_legacy_files_and_collects_orphans(self):
+        os.makedirs(os.path.join(self.media_root, 'post_images'))
+        for filename in ('a.jpg', 'a_x1.jpg', 'orphan.jpg'):
+            with open(os.path.join(self.media_root, 'post_images', filename), 'wb') as handle:
+                handle.write(b'legacy')
+        posts = [Post.objects.create(author=self.user, content=str(i)) for i in range(2)]
+        Post.objects.filter(pk=posts[0].pk).update(image='post_images/a.jpg')
+        Post.objects.filter(pk=posts[1].pk).update(image='post_images/a_x1.jpg')
+
+        call_command('dedupe_media', grace=0, stdout=StringIO())
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(self.refs(name), 2)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'post_images')), [])
+        with open(os.path.join(self.media_root, name), 'rb') as handle:
+            self.assertEqual(handle.read(), b'legacy')
+
+
+class MediaServingTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'post_images', 'variants'))
+        for name in ('post_images/a.jpg', 'post_images/variants/a_320w.jpg'):
+            with open(os.path.join(self.media_root, name), 'wb') as handle:
+                handle.write(bytes(range(256)) * 4)
+        self.factory = RequestFactory()
+
+    def get(self, path, **headers):
+        return media.serve(self.factory.get(f'/media/{path}', **headers), path, document_root=self.media_root)
+
+    def test_conditional_requests(self):
+        response = self.get('post_images/a.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)) * 4)
+        self.assertEqual(self.get('post_images/a.jpg', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get('post_images/a.jpg', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get('post_images/a.jpg', HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+        self.assertIn('immutable', self.get('post_images/variants/a_320w.jpg')['Cache-Control'])
+
+    def test_ranges(self):
+        response = self.get('post_images/a.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(b''.join(self.get('post_images/a.jpg', HTTP_RANGE='bytes=-2').streaming_content), bytes([254, 255]))
+        self.assertEqual(self.get('post_images/a.jpg', HTTP_RANGE='bytes=5000-').status_code, 416)
+        self.assertEqual(self.get('post_images/a.jpg', HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    @override_settings(MEDIA_SENDFILE='nginx', MEDIA_SENDFILE_PREFIX='/protected-media/')
+    def test_sendfile_offload(self):
+        response = self.get('post_images/a.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/post_images/a.jpg')
+        self.assertEqual(response.content, b'')
+
+    def test_path_traversal_is_rejected(self):
+        with self.assertRaises(Http404):
+            self.get('../settings.py')
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com', password='pw')
+        self.other = User.objects.create_user(
+            username='gardener', email='gardener@example.com', password='pw', first_name='Rosa', bio='Tomatoes and roses',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def search(self, query, **params):
+        return self.client.get('/api/search/', {'q': query, **params}).json()
+
+    def ids(self, page):
+        return [row['id'] for row in page['results']]
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertTrue(search.fts_enabled())
+        post = Post.objects.create(author=self.other, content='Growing tomatoes on a balcony')
+        self.assertEqual(self.ids(self.search('tomato')), [post.id])  # Last term matches as a prefix
+
+        post.content = 'Growing peppers instead'
+        post.save()
+        self.assertEqual(self.ids(self.search('tomatoes')), [])
+        self.assertEqual(self.ids(self.search('peppers')), [post.id])
+
+        post.delete()
+        self.assertEqual(self.ids(self.search('peppers')), [])
+
+    def test_ranking_visibility_and_paging(self):
+        strong = Post.objects.create(author=self.other, content='roses roses roses')
+        weak = Post.objects.create(author=self.other, content='a long post that mentions roses once among many other words')
+        Post.objects.create(author=self.other, content='secret roses', is_public=False)
+        own = Post.objects.create(author=self.viewer, content='my private roses', is_public=False)
+
+        page = self.search('roses', page_size=2)
+        seen = self.ids(page)
+        self.assertEqual(seen[0], strong.id)
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            seen += self.ids(page)
+        self.assertCountEqual(seen, [strong.id, weak.id, own.id])
+
+    def test_user_search_weights_names(self):
+        page = self.search('rosa', type='users')
+        self.assertEqual(self.ids(page), [self.other.id])
+        self.assertEqual(self.ids(self.search('roses', type='users')), [self.other.id])  # Matches the bio
+        self.assertEqual(self.client.get('/api/search/', {'q': 'x', 'type': 'nope'}).status_code, 400)
+
+    def test_fallback_without_fts(self):
+        older = Post.objects.create(author=self.other, content='Roses in June')
+        newer = Post.objects.create(author=self.other, content='more roses')
+        with mock.patch('api.search.fts_enabled', return_value=False):
+            self.assertEqual(self.ids(self.search('ROSES')), [newer.id, older.id])
+
+    def test_rebuild_command(self):
+        Post.objects.create(author=self.other, content='indexed later')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.POST_INDEX}')
+        self.assertEqual(self.ids(self.search('indexed')), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.ids(self.search('indexed'))), 1)
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='async', email='async@example.com', password='pw')
+        self.author = User.objects.create_user(username='author', email='author@example.com', password='pw')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.token = AccessToken.for_user(self.user)
+        self.client = AsyncClient()
+
+    def auth(self):
+        # AsyncClient only sends headers given per request
+        return {'headers': {'Authorization': f'Bearer {self.token}'}}
+
+    async def test_reaction_toggle_and_idempotent_writes(self):
+        url = f'/api/async/posts/{self.post.id}/like/'
+        response = await self.client.post(url, **self.auth())
+        self.assertEqual(response.json(), {'message': 'You have liked the post.'})
+        self.assertEqual((await self.client.put(url, **self.auth())).json(), {'liked': True})
+        self.assertEqual(await Post.objects.values_list('like_count', flat=True).aget(id=self.post.id), 1)
+        self.assertEqual((await self.client.delete(url, **self.auth())).status_code, 204)
+        self.assertEqual(await Post.objects.values_list('like_count', flat=True).aget(id=self.post.id), 0)
+        self.assertEqual((await self.client.post('/api/async/posts/999/like/', **self.auth())).status_code, 404)
+
+    async def test_follow_and_comments(self):
+        response = await self.client.post('/api/async/follow-unfollow/author/', **self.auth())
+        self.assertEqual(response.json()['followers_count'], 1)
+        self.assertEqual((await self.client.post('/api/async/follow-unfollow/async/', **self.auth())).status_code, 400)
+
+        response = await self.client.post(
+            '/api/async/comments/create/', {'post': self.post.id, 'content': 'first'},
+            content_type='application/json', **self.auth(),
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['author']['username'], 'async')
+        page = (await self.client.get(f'/api/async/posts/{self.post.id}/comments/?page_size=1', **self.auth())).json()
+        self.assertEqual([comment['content'] for comment in page['results']], ['first'])
+
+    async def test_requires_valid_token(self):
+        response = await AsyncClient().post(f'/api/async/posts/{self.post.id}/like/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+        response = await self.client.post(f'/api/async/posts/{self.post.id}/like/', headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, 401)
+
+
+class RealtimeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='watcher', email='watcher@example.com', password='pw')
+        self.author = User.objects.create_user(username='poster', email='poster@example.com', password='pw')
+        self.post = Post.objects.create(author=self.author, content='live')
+        self.hidden = Post.objects.create(author=self.author, content='private', is_public=False)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def like_and_comment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.post.id}/like/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/comments/create/', {'post': self.post.id, 'content': 'hi'}, format='json')
+
+    async def next_event(self, events):
+        return await asyncio.wait_for(anext(events), timeout=2)
+
+    async def test_events_reach_subscribers(self):
+        events = realtime.stream([self.post.id])
+        self.assertIn('event: subscribed', await self.next_event(events))
+        await sync_to_async(self.like_and_comment)()
+
+        counts = await self.next_event(events)
+        self.assertTrue(counts.startswith('event: reaction.counts'))
+        self.assertIn('"like_count":1', counts)
+        comment = await self.next_event(events)
+        self.assertTrue(comment.startswith('event: comment.created'))
+        self.assertIn('"content":"hi"', comment)
+
+        await events.aclose()
+        self.assertFalse(realtime.get_broker().has_subscribers())
+
+    async def test_stream_endpoint_filters_posts(self):
+        token = await sync_to_async(lambda: str(AccessToken.for_user(self.user)))()
+        response = await AsyncClient().get(f'/api/async/stream/?posts={self.post.id},{self.hidden.id}&token={token}')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        first = await self.next_event(events)
+        self.assertIn(f'"posts": [{self.post.id}]', first.decode())
+        await events.aclose()
+
+        response = await AsyncClient().get(f'/api/async/stream/?posts=x&token={token}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        subscription = realtime.Subscription(['post:1'], loop=None, max_queued=2)
+        for number in range(3):
+            subscription.put({'type': 'reaction.counts', 'n': number})
+        self.assertEqual(subscription.queue.get_nowait(), {'type': 'resync'})
+        self.assertTrue(subscription.queue.empty())
+
+
+class CachedAuthenticationTests(TestCase):
+
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(username='cached', email='cached@example.com', password='pw', bio='x' * 200)
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/token/', {'username': 'cached', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+        return AccessToken(response.data['access'])
+
+    def authenticate(self, method, token):
+        request = getattr(RequestFactory(), method)('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_token_carries_identity_claims_only(self):
+        token = self.login()
+        self.assertEqual(token['username'], 'cached')
+        self.assertEqual(token['email'], 'cached@example.com')
+        self.assertNotIn('bio', token.payload)
+        self.assertNotIn('followers_count', token.payload)
+
+    def test_reads_trust_claims_and_writes_hit_the_cache(self):
+        token = self.login()
+        with self.assertNumQueries(0):
+            user = self.authenticate('get', token)
+        self.assertEqual((user.pk, user.username), (self.user.pk, 'cached'))
+        self.assertEqual(user.bio, 'x' * 200)  # Unclaimed fields load on access
+
+        with self.assertNumQueries(1):
+            self.authenticate('post', token)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate('post', token).pk, self.user.pk)
+            self.assertEqual(self.authenticate('get', token).pk, self.user.pk)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=False)
+    def test_tokens_without_claims_and_inactive_users(self):
+        token = AccessToken.for_user(self.user)
+        self.assertEqual(self.authenticate('get', token).pk, self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)  # Bypasses signals: the cached row still serves
+        self.assertEqual(self.authenticate('get', token).pk, self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate('get', token)
+
+    def test_claims_expire_and_yield_to_account_changes(self):
+        token = self.login()
+        self.assertTrue(token['is_active'])
+        self.user.is_active = False
+        self.user.save()  # Also stops this process trusting claims issued before it
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate('get', token)
+
+        with override_settings(AUTH_CLAIMS_MAX_AGE=-1):  # Every token is too old to trust
+            User.objects.filter(pk=self.user.pk).update(is_active=True)
+            user_cache.clear()
+            with self.assertNumQueries(1):
+                self.assertEqual(self.authenticate('get', token).pk, self.user.pk)
+            User.objects.filter(pk=self.user.pk).update(is_active=False)  # As another process would
+            user_cache.clear()
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate('get', token)
+
+    def test_deleted_users_fail_authentication_instead_of_erroring(self):
+        token = self.login()
+        User.objects.filter(pk=self.user.pk).delete()  # No signal: as if deleted by another process
+        response = self.client.get('/api/token/stats/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_profile_edit_keeps_follow_counts(self):
+        token = self.login()
+        self.authenticate('post', token)  # Caches the user with no followers
+        for i in range(3):
+            fan = User.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='pw')
+            reactions.follow(fan, self.user)
+        response = self.client.patch(
+            f'/api/profiles/{self.user.pk}/edit/', {'bio': 'edited'}, HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.bio, self.user.followers_count), ('edited', 3))
+
+    def test_profile_edit_and_password_change_invalidate(self):
+        token = self.login()
+        self.authenticate('post', token)
+        response = self.client.patch(
+            f'/api/profiles/{self.user.pk}/edit/', {'first_name': 'New'}, HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.authenticate('post', token).first_name, 'New')
+
+        self.user.refresh_from_db()
+        self.user.set_password('changed')
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate('post', token).check_password('changed'))
+
+
+class TokenBlacklistTests(TestCase):
+
+    def setUp(self):
+        tokens.blacklist_filter.reset()
+        self.user = User.objects.create_user(username='refresher', email='refresher@example.com', password='pw')
+        self.client = APIClient()
+
+    def refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': str(token)})
+
+    def test_rotation_blacklists_and_filter_skips_lookups(self):
+        token = tokens.RefreshToken.for_user(self.user)
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(tokens.blacklist_filter.stats['skipped'], 1)
+        self.assertEqual(self.refresh(token).status_code, 401)  # The rotated-out token is refused
+        self.assertEqual(tokens.blacklist_filter.stats['blacklisted'], 1)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, 200)
+        self.assertEqual(tokens.blacklist_filter.stats['skipped'], 2)
+
+    def test_filter_picks_up_rows_from_elsewhere(self):
+        token = tokens.RefreshToken.for_user(self.user)
+        self.assertFalse(tokens.blacklist_filter.is_blacklisted(token['jti']))
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))  # Another worker
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_ids_committed_out_of_order_are_not_missed(self):
+        early, late, fresh = (tokens.RefreshToken.for_user(self.user) for _ in range(3))
+        outstanding = {token['jti']: OutstandingToken.objects.get(jti=token['jti']) for token in (early, late)}
+        self.assertFalse(tokens.blacklist_filter.is_blacklisted(fresh['jti']))
+        # The row for the lower id commits after the higher one, as concurrent transactions may
+        top = BlacklistedToken.objects.aggregate(top=Max('id'))['top'] or 0
+        BlacklistedToken.objects.create(id=top + 2, token=outstanding[late['jti']])
+        self.assertFalse(tokens.blacklist_filter.is_blacklisted(fresh['jti']))
+        BlacklistedToken.objects.create(id=top + 1, token=outstanding[early['jti']])
+        self.assertTrue(tokens.blacklist_filter.is_blacklisted(early['jti']))
+        self.assertEqual(tokens.blacklist_filter.stats['lookups'], 1)  # The filter knew, only the lookup confirmed it
+
+    def test_prune_expired_in_batches(self):
+        past = timezone.now() - timedelta(days=1)
+        for i in range(5):
+            expired = OutstandingToken.objects.create(jti=f'old{i}', token='x', expires_at=past)
+            if i % 2:
+                BlacklistedToken.objects.create(token=expired)
+        live = tokens.RefreshToken.for_user(self.user)
+        self.assertEqual(tokens.prune_expired(batch_size=2), (5, 2))
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live['jti']])
+
+        staff = User.objects.create_user(username='staff', email='staff@example.com', password='pw', is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.get('/api/token/stats/').data['outstanding'], 1)
+
+
+class GenerateSocialGraphTests(TestCase):
+
+    def test_generated_graph_is_consistent(self):
+        call_command('generate_social_graph', scale=0.001, seed=3, skip_search_index=True, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 100)
+        self.assertEqual(Post.objects.count(), 1000)
+        for user in User.objects.annotate(n=Count('followers', distinct=True), m=Count('following', distinct=True)):
+            self.assertEqual((user.followers_count, user.following_count), (user.n, user.m))
+        for post in Post.objects.annotate(n=Count('likes', distinct=True), m=Count('dislikes', distinct=True)):
+            self.assertEqual((post.like_count, post.dislike_count), (post.n, post.m))
+        # Reposts point back in time, and some repost a repost
+        self.assertFalse(Post.objects.filter(reposted_from_id__gte=F('id')).exists())
+        self.assertTrue(Post.objects.filter(reposted_from__reposted_from__isnull=False).exists())
+        self.assertFalse(Comment.objects.filter(created_at__lt=F('post__created_at')).exists())
+
+
+class BenchmarkEndpointsTests(TestCase):
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])  # The command's client sends Host: localhost
+    def test_smoke_run_reports_and_gates_on_a_baseline(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'results.json')
+        options = {'sizes': '60', 'repeat': 2, 'endpoint': ['posts list', 'post detail'], 'threshold': 1000}
+        stdout = StringIO()
+        # The scratch database would be the in-memory test database here, so the test's own is used
+        with mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db'):
+            call_command('benchmark_endpoints', output=output, stdout=stdout, **options)
+            report = stdout.getvalue().splitlines()
+            self.assertTrue(report[0].startswith('endpoint'))
+            self.assertEqual([line.split()[:3] for line in report[1:3]], [['posts', 'list', '60'], ['post', 'detail', '60']])
+            with open(output) as handle:
+                results = json.load(handle)
+            self.assertEqual(
+                [(row['endpoint'], row['size'], row['status']) for row in results['results']],
+                [('posts list', 60, 200), ('post detail', 60, 200)],
+            )
+            self.assertTrue(all(row['queries'] > 0 and row['bytes'] > 0 for row in results['results']))
+
+            stdout = StringIO()
+            call_command('benchmark_endpoints', baseline=output, stdout=stdout, **options)
+            self.assertIn('No regressions against the baseline', stdout.getvalue())
+
+        fewer_queries = {**results, 'results': [{**row, 'queries': row['queries'] - 1} for row in results['results']]}
+        self.assertEqual(len(benchmark_endpoints.compare(results, fewer_queries, threshold=10)), 2)
+
+
+@override_settings(METRICS_TOKEN='scrape')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.user = User.objects.create_user(username='watched', email='watched@example.com', password='pw')
+        Post.objects.create(author=self.user, content='measured')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scrape(self):
+        return self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+
+    def test_views_are_timed_with_queries_and_serializer(self):
+        self.client.get('/api/posts/')
+        body = self.scrape()
+        labels = 'view="PostsListView",method="GET"'
+        self.assertIn(f'api_request_duration_seconds_count{{{labels}}} 1', body)
+        self.assertIn(f'api_responses_total{{{labels},status="200"}} 1', body)
+        sums = dict(line.split() for line in body.splitlines() if line.startswith('api_') and '_sum{' in line)
+        for name in ('api_db_queries', 'api_db_duration_seconds', 'api_serializer_duration_seconds'):
+            self.assertGreater(float(sums[f'{name}_sum{{{labels}}}']), 0)
+
+    def test_snapshots_of_other_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS_DIR=directory):
+            self.client.get('/api/posts/')
+            metrics.registry.flush(directory)
+            os.rename(os.path.join(directory, f'{os.getpid()}.json'), os.path.join(directory, '1.json'))
+            body = self.scrape()
+        self.assertIn('api_request_duration_seconds_count{view="PostsListView",method="GET"} 2', body)
+
+    def test_token_guards_the_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+@override_settings(SUGGESTIONS_LOADER='sync')
+class FollowSuggestionsTests(TestCase):
+
+    def setUp(self):
+        suggestions.follow_graph.reset()
+        self.addCleanup(suggestions.follow_graph.reset)
+        self.me, a, b, self.c, self.d, self.star = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='pw')
+            for name in ('me', 'a', 'b', 'c', 'd', 'star')
+        )
+        for follower, followed in ((self.me, a), (self.me, b), (a, self.c), (a, self.d), (b, self.c), (a, self.me)):
+            followed.followers.add(follower)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def suggested(self):
+        results = self.client.get('/api/users/suggestions/?limit=3').data['results']
+        return [(row['username'], row['mutual_count']) for row in results]
+
+    def test_ranked_by_mutual_follows_then_popular_accounts(self):
+        self.star.followers.add(self.c)
+        self.assertEqual(self.suggested(), [('c', 2), ('d', 1), ('star', 0)])
+
+    def test_follows_apply_before_the_next_reload(self):
+        self.suggested()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/follow-unfollow/{self.c.username}/')
+        self.assertEqual(suggestions.follow_graph.stats()['overlay_changes'], 1)
+        self.assertEqual(self.suggested()[0], ('d', 1))
+
+    def test_budget_caps_each_account_to_its_newest_follows(self):
+        self.assertEqual(suggestions.degree_cap([5, 1, 3], 9), None)
+        self.assertEqual(suggestions.degree_cap([5, 1, 3], 6), 2)
+        count = self.star.id + 1
+        fixed = 8 * (count + 1) + 4 * count + 8 * count  # Offsets, in-degrees and the build's fill positions
+        with override_settings(SUGGESTIONS_MEMORY_BUDGET=fixed + 4 * 4):  # Room for 4 of the 6 follows
+            suggestions.follow_graph.load()
+        stats = suggestions.follow_graph.stats()
+        self.assertEqual((stats['capped_at'], stats['edges']), (1, 3))  # Follow counts 2, 3, 1 capped at 1
+        self.assertLessEqual(stats['bytes'] + 8 * count, fixed + 4 * 4)  # The build's peak
+
+
+class TrendingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fan', email='fan@example.com', password='pw')
+        self.quiet, self.busy = (Post.objects.create(author=self.user, content=name) for name in ('quiet', 'busy'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def score(self, post):
+        post.refresh_from_db()
+        return trending.current_score(post.trending_score)
+
+    def test_events_rank_posts_and_scores_decay(self):
+        self.client.post(f'/api/posts/{self.quiet.id}/like/')
+        self.client.post(f'/api/posts/{self.busy.id}/like/')
+        Comment.objects.create(post=self.busy, author=self.user, content='!')
+        self.client.post('/api/posts/repost/', {'post_id': self.busy.id})
+        self.assertAlmostEqual(self.score(self.quiet), 1.0, places=2)
+        self.assertGreater(self.score(self.busy), 3.0)
+
+        results = self.client.get('/api/posts/trending/').data['results']
+        self.assertEqual([row['id'] for row in results], [self.busy.id, self.quiet.id])
+        later = timezone.now() + timedelta(seconds=trending.half_life())
+        self.assertAlmostEqual(trending.current_score(self.quiet.trending_score, later), 0.5, places=2)
+
+    def test_toggling_a_reaction_cannot_pump_the_score(self):
+        Comment.objects.create(post=self.quiet, author=self.user, content='!')
+        before = self.score(self.quiet)
+        for _ in range(4):
+            self.client.post(f'/api/posts/{self.quiet.id}/like/')
+        self.assertLessEqual(self.score(self.quiet), before)
+        self.client.post(f'/api/posts/{self.busy.id}/like/')
+        self.client.post(f'/api/posts/{self.busy.id}/like/')
+        self.assertEqual(self.score(self.busy), 0.0)
+
+    def test_top_reads_the_index_and_prune_clears_decayed_scores(self):
+        trending.record('like', [self.quiet.id], now=timezone.now() - timedelta(days=30))
+        trending.record('like', [self.busy.id])
+        self.assertEqual(list(trending.top(10)), [self.busy])
+        with connection.cursor() as cursor:
+            sql, params = trending.top(10).query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            self.assertIn('post_trending_idx', str(cursor.fetchall()))
+        self.assertEqual(trending.prune(), 1)
+        self.assertEqual(list(Post.objects.exclude(trending_score=None)), [self.busy])
+
+    def test_rebuild_scores_recent_posts_from_the_tables(self):
+        Post.objects.update(trending_score=None)
+        Comment.objects.create(post=self.busy, author=self.user, content='!')
+        Post.objects.filter(pk=self.busy.pk).update(like_count=2, trending_score=None)
+        call_command('prune_trending', rebuild=True, stdout=StringIO())
+        self.assertAlmostEqual(self.score(self.busy), 4.0, places=1)
+        self.assertIsNone(Post.objects.get(pk=self.quiet.pk).trending_score)
+
+
+    def test_deleting_a_repost_withdraws_its_thread_in_bulk(self):
+        self.client.post(f'/api/posts/{self.busy.id}/like/')
+        before = self.score(self.busy)
+        self.client.post('/api/posts/repost/', {'post_id': self.busy.id})
+        repost = Post.objects.get(reposted_from=self.busy)
+        for n in range(3):
+            comment = Comment.objects.create(post=repost, author=self.user, content=str(n))
+            SubComment.objects.create(comment=comment, author=self.user, content='re')
+        self.assertGreater(self.score(self.busy), before)
+
+        with CaptureQueriesContext(connection) as queries:
+            repost.delete()
+        self.assertEqual(sum('trending_score' in q['sql'] for q in queries), 2)  # The thread, then the repost itself
+        self.assertAlmostEqual(self.score(self.busy), before, places=2)
+
+        comment = Comment.objects.create(post=self.busy, author=self.user, content='!')
+        SubComment.objects.create(comment=comment, author=self.user, content='re')
+        with CaptureQueriesContext(connection) as queries:
+            comment.delete()
+        self.assertEqual(sum('trending_score' in q['sql'] for q in queries), 1)
+        self.assertAlmostEqual(self.score(self.busy), before, places=2)
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='poller', email='poller@example.com', password='pw')
+        self.post = Post.objects.create(author=self.user, content='polled')
+        Comment.objects.create(post=self.post, author=self.user, content='first')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_post_is_not_serialized_again(self):
+        url = f'/api/posts/{self.post.id}/'
+        first = self.client.get(url)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertNotIn('Last-Modified', first)  # updated_at does not move with counters, see api/conditional.py
+        with mock.patch('api.serializers.PostSerializer.to_representation') as to_representation:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+        to_representation.assert_not_called()
+
+        self.client.post(f'/api/posts/{self.post.id}/like/')  # Counter change, no edit
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_liked_by_user'])
+
+    def test_repost_etag_covers_the_original_author(self):
+        original_author = User.objects.create_user(username='origin', email='origin@example.com', password='pw')
+        original = Post.objects.create(author=original_author, content='original')
+        booster = User.objects.create_user(username='booster', email='booster@example.com', password='pw')
+        repost = Post.objects.create(author=self.user, content='repost', reposted_from=original, reposted_by=booster)
+        for url in (f'/api/posts/{repost.id}/', '/api/posts/?page_size=10'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                User.objects.filter(pk=original_author.pk).update(first_name=f'Renamed {url}')
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                User.objects.filter(pk=booster.pk).update(followers_count=F('followers_count') + 1)  # reposted_by's __str__
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_pages_are_validated_from_one_light_query(self):
+        url = f'/api/posts/{self.post.id}/comments/?page_size=10'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):  # The post lookup and the page of validator columns
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(post=self.post, author=self.user, content='second')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_edits_are_not_hidden_by_if_modified_since(self):
+        comment = self.post.comments.get()
+        url = f'/api/comments/{comment.id}/'
+        since = http_date(time.time() + 60)
+        self.client.get(url)
+        self.client.patch(url, {'content': 'edited'}, format='json')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['content'], 'edited')
+
+    def test_validators_are_per_viewer_and_keep_permissions(self):
+        url = f'/api/posts/{self.post.id}/'
+        etag = self.client.get(url)['ETag']
+        Post.objects.filter(pk=self.post.pk).update(is_public=False)
+        other = User.objects.create_user(username='other', email='other@example.com', password='pw')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+
+class RendererTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', email='writer@example.com', password='pw')
+        for i in range(5):
+            Post.objects.create(author=self.user, content=f'post {i} caf\u00e9 \u2028')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_fast_renderer_writes_what_drf_writes(self):
+        data = {
+            'at': timezone.now(), 'day': timezone.now().date(), 'price': Decimal('1.5'),
+            'text': 'caf\u00e9 \u2028', 'nested': [{1: None, 'ok': True}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'),
+        )
+
+    def test_long_lists_stream_the_same_body(self):
+        with override_settings(API_STREAM_LISTS=False):
+            buffered = self.client.get('/api/posts/')
+        with override_settings(API_STREAM_CHUNK_SIZE=2):
+            streamed = self.client.get('/api/posts/')
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content), buffered.content)
+        self.assertEqual(len(json.loads(buffered.content)), 5)
+        self.assertFalse(self.client.get('/api/posts/').streaming)  # Fits in one chunk
+        self.assertFalse(self.client.get('/api/posts/?page_size=2').streaming)
+
+    def test_compression_is_negotiated(self):
+        self.assertEqual(negotiate('gzip, br;q=0.5', ('br', 'gzip')), 'gzip')
+        self.assertEqual(negotiate('br, gzip', ('br', 'gzip')), 'br')
+        self.assertEqual(negotiate('gzip;q=0, *', ('gzip',)), None)
+        self.assertEqual(negotiate('identity', ('br', 'gzip')), None)
+
+        plain = self.client.get('/api/posts/')
+        response = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        with override_settings(API_STREAM_CHUNK_SIZE=2):
+            response = self.client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain.content)
+
+
+@override_settings(REACTION_BUFFER=True, REACTION_BUFFER_FLUSHER='sync')
+class ReactionBufferTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fan', email='fan@example.com', password='pw')
+        self.author = User.objects.create_user(username='star', email='star@example.com', password='pw')
+        self.post = Post.objects.create(author=self.author, content='viral')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        reaction_buffer.buffer.reset()
+        self.addCleanup(reaction_buffer.buffer.reset)
+
+    def test_toggles_wait_for_the_flush_but_the_user_sees_them(self):
+        detail = self.client.get(f'/api/posts/{self.post.id}/')
+        self.client.post(f'/api/posts/{self.post.id}/like/')
+        self.assertFalse(self.post.likes.exists())
+        response = self.client.get(f'/api/posts/{self.post.id}/', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_liked_by_user'])
+
+        for i in range(3):
+            other = User.objects.create_user(username=f'other{i}', email=f'other{i}@example.com', password='pw')
+            reactions.add('post', 'like', self.post.id, other.id)
+        with self.assertNumQueries(8):  # One transaction for the whole batch, whatever its size
+            self.assertEqual(reaction_buffer.buffer.flush(), 4)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 4)
+        self.assertTrue(self.post.likes.filter(pk=self.user.pk).exists())
+        self.assertIsNotNone(self.post.trending_score)
+
+    def test_toggling_back_leaves_nothing_to_write(self):
+        self.assertTrue(reactions.toggle('post', 'like', self.post.id, self.user.id))
+        self.assertFalse(reactions.toggle('post', 'like', self.post.id, self.user.id))
+        self.assertFalse(reactions.remove('post', 'like', self.post.id, self.user.id))
+        self.assertEqual(reaction_buffer.buffer.flush(), 0)
+        self.assertEqual(self.client.post('/api/posts/999/like/').status_code, 404)
+
+    def test_follows_are_buffered(self):
+        response = self.client.put('/api/follow-unfollow/star/')
+        self.assertEqual(response.data['followers_count'], 1)
+        self.assertFalse(self.author.followers.exists())
+        self.assertTrue(self.client.get(f'/api/profiles/{self.author.id}/').data['is_following'])
+        reaction_buffer.buffer.flush()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertTrue(self.author.followers.filter(pk=self.user.pk).exists())
+
+    def test_deleted_users_and_bad_states_do_not_block_the_rest(self):
+        gone = User.objects.create_user(username='gone', email='gone@example.com', password='pw')
+        reactions.add('post', 'like', self.post.id, gone.id)
+        reactions.add('post', 'like', self.post.id, self.user.id)
+        gone.delete()
+        self.assertEqual(reaction_buffer.buffer.flush(), 2)
+        self.assertEqual(list(self.post.likes.all()), [self.user])
+
+        write_states = reaction_buffer.write_states
+
+        def fail_on_dislikes(target, reaction, states):
+            if reaction == 'dislike':
+                raise RuntimeError('bad state')
+            write_states(target, reaction, states)
+
+        reactions.add('post', 'dislike', self.post.id, self.author.id)
+        reactions.add('post', 'like', self.post.id, self.author.id)
+        with override_settings(REACTION_BUFFER_MAX_ATTEMPTS=2), self.assertLogs('api.reaction_buffer', 'ERROR'), \
+                mock.patch('api.reaction_buffer.write_states', fail_on_dislikes):
+            self.assertEqual(reaction_buffer.buffer.flush(), 1)  # The like, written on its own
+            self.assertEqual(reaction_buffer.buffer.flush(), 0)  # The dislike's second failure drops it
+        self.assertTrue(self.post.likes.filter(pk=self.author.pk).exists())
+        self.assertFalse(self.post.dislikes.exists())
+        self.assertEqual(reaction_buffer.buffer.size, 0)
+
+    def test_log_is_replayed_after_a_crash(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(REACTION_BUFFER_LOG_DIR=directory):
+            crashed = reaction_buffer.ReactionBuffer()
+            crashed.set('post', 'like', self.post.id, self.user.id, True)
+            crashed.log.handle.close()  # Dies without flushing; its lock goes with it
+
+            reaction_buffer.ReactionBuffer().start()
+        self.assertTrue(self.post.likes.filter(pk=self.user.pk).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(len(os.listdir(directory)), 1)  # Only the new buffer's own, empty log
+
+
+@override_settings(JOBS_RUNNER='sync')
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.calls = []
+        self.failures = 0
+        jobs.task('test.record', queue='test', max_attempts=2)(self.record)
+        self.addCleanup(jobs.TASKS.pop, 'test.record')
+
+    def record(self, value):
+        self.calls.append(value)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('flaky')
+
+    def test_sync_runner_runs_inline_once_per_key(self):
+        job = jobs.enqueue('test.record', {'value': 1}, key='once')
+        self.assertEqual(jobs.enqueue('test.record', {'value': 2}, key='once').pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, self.calls), (Job.DONE, 1, [1]))
+
+        self.failures = 1
+        with self.assertLogs('api.jobs', 'WARNING'):
+            job = jobs.enqueue('test.record', {'value': 3})
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)  # No worker would ever retry it
+
+    @override_settings(JOBS_RUNNER='worker')
+    def test_failures_are_retried_then_failed(self):
+        self.failures = 2
+        job = jobs.enqueue('test.record', {'value': 1})
+        self.assertEqual(self.calls, [])
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(['test']), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('flaky', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('api.jobs', 'WARNING'):
+            jobs.run_pending(['test'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, len(self.calls)), (Job.FAILED, 2, 2))
+
+    @override_settings(JOBS_RUNNER='worker', JOBS_QUEUES={'test': 2})
+    def test_claims_respect_the_queue_limit_and_leases(self):
+        for value in range(3):
+            jobs.enqueue('test.record', {'value': value})
+        self.assertEqual(len(jobs.claim('test', 'one', 5)), 2)
+        self.assertEqual(jobs.claim('test', 'two', 5), [])
+        Job.objects.filter(locked_by='one').update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([job.payload['value'] for job in jobs.claim('test', 'two', 5)], [0, 1])
+
+    @override_settings(JOBS_RUNNER='worker', METRICS_TOKEN='scrape')
+    def test_fan_out_runs_in_the_worker(self):
+        reader = User.objects.create_user(username='reader', email='reader@example.com', password='pw')
+        writer = User.objects.create_user(username='writer', email='writer@example.com', password='pw')
+        writer.followers.add(reader)
+        client = APIClient()
+        client.force_authenticate(writer)
+        post = client.post('/api/posts/create/', {'content': 'later'}, format='json').json()['id']
+        self.assertTrue(TimelineEntry.objects.filter(user=writer, post_id=post).exists())
+        self.assertFalse(TimelineEntry.objects.filter(user=reader, post_id=post).exists())
+
+        body = client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('api_job_queue_depth{queue="timeline",status="queued"} 1', body)
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(user=reader, post_id=post).exists())
+        body = client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('api_jobs_total{queue="timeline",task="timeline.fan_out_post",status="done"} 1', body)
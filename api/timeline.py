@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.db.models import F
+
+from api.models import User, Post, TimelineEntry
+
+
+# Follow rows: from_user is the followed account, to_user the follower
+Follow = User.followers.through
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def fanout_threshold():
+    # Authors with at least this many followers are merged into feeds at read time
+    return getattr(settings, 'TIMELINE_FANOUT_THRESHOLD', 10000)
+
+
+def backfill_limit():
+    # Recent posts copied into a timeline when its owner follows someone new
+    return getattr(settings, 'TIMELINE_BACKFILL_LIMIT', 20)
+
+
+def is_fanout_on_read(author):
+    return author.followers_count >= fanout_threshold()
+
+
+def entry_for(user_id, post):
+    return TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, created_at=post.created_at)
+
+
+def add_own_post(post):
+    TimelineEntry.objects.bulk_create([entry_for(post.author_id, post)], ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    # The author always sees their own post, followers only see public ones
+    add_own_post(post)
+    if not post.is_public or is_fanout_on_read(post.author):
+        return
+
+    follower_ids = Follow.objects.filter(from_user_id=post.author_id).values_list('to_user_id', flat=True)
+    batch = []
+    for follower_id in follower_ids.iterator(chunk_size=FANOUT_BATCH_SIZE):
+        batch.append(entry_for(follower_id, post))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def retract_post(post):
+    # The post turned private: it stays only in its author's own timeline
+    TimelineEntry.objects.filter(post=post).exclude(user_id=post.author_id).delete()
+
+
+def backfill_author(user, author):
+    # Copy the author's recent public posts into a new follower's timeline
+    if is_fanout_on_read(author):
+        return
+    posts = Post.objects.filter(author=author, is_public=True).order_by('-created_at', '-id')[:backfill_limit()]
+    TimelineEntry.objects.bulk_create([entry_for(user.id, post) for post in posts], ignore_conflicts=True)
+
+
+def remove_author(user, author):
+    # Unfollow: drop everything the author contributed to the user's timeline
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def timeline_sources(user):
+    """
+    The two keyset-ordered sources a home feed is merged from: the user's
+    materialized entries and the public posts of followed high-fan-out
+    authors. Both yield ``created_at``/``post_id`` rows.
+    """
+    entries = TimelineEntry.objects.filter(user=user).values('created_at', 'post_id')
+    wide_authors = user.following.filter(followers_count__gte=fanout_threshold()).values('id')
+    wide_posts = (
+        Post.objects.filter(author__in=wide_authors, is_public=True)
+        .annotate(post_id=F('id'))
+        .values('created_at', 'post_id')
+    )
+    return [entries, wide_posts]
+
+
+def rebuild_timeline(user):
+    # Backfill a timeline from scratch: own posts plus recent posts of everyone followed
+    TimelineEntry.objects.filter(user=user).delete()
+    own_posts = Post.objects.filter(author=user).order_by('-created_at', '-id')[:backfill_limit()]
+    TimelineEntry.objects.bulk_create([entry_for(user.id, post) for post in own_posts], ignore_conflicts=True)
+    for author in user.following.all():
+        backfill_author(user, author)
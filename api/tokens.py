@@ -0,0 +1,213 @@
+import hashlib
+import math
+import statistics
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+
+# Refresh rotation blacklists the old token on every refresh, so both tables
+# only ever grow; prune_expired() trims them and BlacklistFilter turns the
+# per-refresh blacklist lookup into a short scan of the newest rows.
+
+
+class BloomFilter:
+    # Set membership with no false negatives; false positives at roughly error_rate
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class BlacklistFilter:
+    """
+    In-memory front for ``BlacklistedToken``. A "maybe" from the bloom
+    filter (a blacklisted token or a false positive) is settled by the
+    usual lookup. A "no" is only trusted once the filter has caught up
+    with the table: when the last catch-up is older than
+    TOKEN_BLACKLIST_SYNC_INTERVAL seconds (0, the default: always), the
+    rows blacklisted since, by this process or any other, are read first.
+    That read is a primary key range scan that finds a row or two, not the
+    jti join a lookup costs.
+
+    Ids need not commit in order (they do on SQLite, not on databases with
+    concurrent writers), so ids below the newest one seen that were still
+    missing are read again at every catch-up for TOKEN_BLACKLIST_GAP_TIMEOUT
+    seconds, long enough for any blacklisting transaction to commit.
+    """
+
+    # Newest ids checked for gaps after a rebuild, more than could be in flight at once
+    rebuild_gap_window = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        self.gaps = {}  # id below last_id not seen yet -> time.monotonic() it was first missed
+        self.synced_at = 0.0
+        self.added = 0
+        self.stats = {'skipped': 0, 'lookups': 0, 'blacklisted': 0, 'rebuilds': 0, 'catch_ups': 0}
+
+    def rebuild(self):
+        # Expired tokens fail the exp check before the blacklist is consulted, so only live ones are loaded
+        self.last_id = BlacklistedToken.objects.aggregate(top=Max('id'))['top'] or 0
+        jtis = list(
+            BlacklistedToken.objects.filter(id__lte=self.last_id, token__expires_at__gt=timezone.now())
+            .values_list('token__jti', flat=True)
+        )
+        self.bloom = BloomFilter(max(getattr(settings, 'TOKEN_BLACKLIST_FILTER_CAPACITY', 100_000), 2 * len(jtis)))
+        for jti in jtis:
+            self.bloom.add(jti)
+        self.added = len(jtis)
+        recent = set(
+            BlacklistedToken.objects.filter(id__gt=self.last_id - self.rebuild_gap_window, id__lte=self.last_id)
+            .values_list('id', flat=True)
+        )
+        now = time.monotonic()
+        self.gaps = {
+            row_id: now for row_id in range(max(1, self.last_id - self.rebuild_gap_window + 1), self.last_id)
+            if row_id not in recent
+        }
+        self.stats['rebuilds'] += 1
+
+    def catch_up(self):
+        # Add the rows blacklisted since the last catch-up, and any that filled a gap
+        now = time.monotonic()
+        timeout = getattr(settings, 'TOKEN_BLACKLIST_GAP_TIMEOUT', 60)
+        self.gaps = {row_id: missed for row_id, missed in self.gaps.items() if now - missed < timeout}
+        rows = BlacklistedToken.objects.filter(Q(id__gt=self.last_id) | Q(id__in=list(self.gaps)))
+        found = set()
+        for row_id, jti in rows.values_list('id', 'token__jti'):
+            self.bloom.add(jti)
+            self.added += 1
+            self.gaps.pop(row_id, None)
+            found.add(row_id)
+        newest = max(found, default=self.last_id)
+        for row_id in range(self.last_id + 1, newest):
+            if row_id not in found:
+                self.gaps[row_id] = now  # Allocated but not committed yet, or rolled back
+        self.last_id = max(self.last_id, newest)
+        self.stats['catch_ups'] += 1
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if self.bloom is None or self.added > self.bloom.capacity:
+            self.rebuild()  # Past capacity the false positive rate climbs, so start over
+        elif force or now - self.synced_at >= getattr(settings, 'TOKEN_BLACKLIST_SYNC_INTERVAL', 0):
+            self.catch_up()
+        else:
+            return
+        self.synced_at = now
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+                self.added += 1
+
+    def is_blacklisted(self, jti):
+        if getattr(settings, 'TOKEN_BLACKLIST_FILTER', True):
+            with self.lock:
+                if self.bloom is None or jti not in self.bloom:
+                    self.sync()  # Rows blacklisted elsewhere since the last catch-up would be missing
+                if jti not in self.bloom:
+                    self.stats['skipped'] += 1
+                    return False
+        self.stats['lookups'] += 1
+        blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        self.stats['blacklisted'] += blacklisted
+        return blacklisted
+
+    def reset(self):
+        with self.lock:
+            self.bloom = None
+            self.last_id = self.added = 0
+            self.gaps = {}
+            self.synced_at = 0.0
+            self.stats = dict.fromkeys(self.stats, 0)
+
+
+blacklist_filter = BlacklistFilter()
+
+# Seconds spent in recent refreshes, for stats()
+refresh_timings = deque(maxlen=1000)
+
+
+class RefreshToken(BaseRefreshToken):
+    # Blacklist checks go through blacklist_filter; tokens blacklisted here are visible to it at once
+
+    def check_blacklist(self):
+        if blacklist_filter.is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+def prune_expired(batch_size=1000, pause=0.0, now=None):
+    """
+    Delete expired outstanding tokens, with their blacklist rows, in
+    batches of ``batch_size``, each in its own short transaction so
+    refreshes are never held up behind one long delete. Returns the
+    number of (outstanding, blacklisted) rows removed.
+    """
+    now = now or timezone.now()
+    outstanding = blacklisted = 0
+    while True:
+        with transaction.atomic():
+            # Expired tokens are the oldest, so an unordered scan finds a batch near the start of the table
+            ids = list(
+                OutstandingToken.objects.filter(expires_at__lte=now).order_by().values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)  # Lets queued writers through between batches
+    return outstanding, blacklisted
+
+
+def stats():
+    # Table sizes plus this process's refresh latency and filter counters
+    now = timezone.now()
+    timings = sorted(refresh_timings)
+    if len(timings) > 1:
+        cuts = statistics.quantiles(timings, n=100)
+        latency = {'p50_ms': round(cuts[49] * 1000, 2), 'p99_ms': round(cuts[98] * 1000, 2)}
+    else:
+        latency = {'p50_ms': None, 'p99_ms': None}
+    return {
+        'outstanding': OutstandingToken.objects.count(),
+        'outstanding_expired': OutstandingToken.objects.filter(expires_at__lte=now).count(),
+        'blacklisted': BlacklistedToken.objects.count(),
+        'refreshes': {'count': len(timings), **latency},
+        'filter': dict(blacklist_filter.stats),
+    }
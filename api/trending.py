@@ -0,0 +1,178 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least, Log, Power
+from django.utils import timezone
+
+from api.models import Post, Comment, SubComment
+
+
+# Trending scores use forward decay, kept in the log domain. An event of weight
+# w at time t adds w * 2 ** (t / half_life) to a post's total, t counted from
+# ORIGIN, and Post.trending_score stores log2 of that total. Every post's
+# current score is 2 ** (trending_score - now / half_life): all of them shrink
+# by the same factor as time passes, so their order never changes and nothing
+# has to be rescored to keep the index right. Logs keep the stored numbers
+# small however far from ORIGIN we get. prune() is the periodic batch: it
+# clears scores that have decayed below TRENDING_MIN_SCORE, which takes those
+# posts out of the partial index and keeps it the size of what is trending.
+
+ORIGIN = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+# event -> weight
+WEIGHTS = {
+    'like': 1.0,
+    'dislike': 0.5,  # Still engagement, just less of it
+    'comment': 2.0,
+    'subcomment': 1.0,
+    'repost': 3.0,
+}
+
+
+def half_life():
+    return getattr(settings, 'TRENDING_HALF_LIFE', 6 * 3600)
+
+
+def level(weight, now=None):
+    # log2(weight * 2 ** (t / half_life)): the stored form of one event at ``now``
+    now = now or timezone.now()
+    return math.log2(weight) + (now - ORIGIN).total_seconds() / half_life()
+
+
+def current_score(trending_score, now=None):
+    if trending_score is None:
+        return 0.0
+    return 2 ** (trending_score - level(1.0, now))
+
+
+def added(event_level):
+    # log2(2**score + 2**event_level) without overflow: the larger term is factored out
+    score, event_level = F('trending_score'), Value(event_level)
+    high, low = Greatest(score, event_level), Least(score, event_level)
+    return Case(
+        When(trending_score__isnull=True, then=event_level),
+        default=high + Log(Value(2.0), Value(1.0) + Power(Value(2.0), low - high)),
+        output_field=FloatField(),
+    )
+
+
+def withdrawn(event_level):
+    """
+    log2(2**score - 2**event_level). A withdrawal takes the event off at
+    full strength as of now, at least as much as it still counted for, so
+    toggling a reaction cannot pump a score. A total that drops to zero or
+    below clears the score.
+    """
+    score = F('trending_score')
+    return Case(
+        When(trending_score__isnull=True, then=Value(None)),
+        When(trending_score__lte=event_level, then=Value(None)),
+        default=score + Log(Value(2.0), Value(1.0) - Power(Value(2.0), Value(event_level) - score)),
+        output_field=FloatField(),
+    )
+
+
+def record(event, post_ids, count=1, now=None):
+    """
+    Apply ``count`` events (negative to withdraw) to the posts in
+    ``post_ids``, a list or a queryset of ids, with one UPDATE. Reposts
+    pass their events on, so a repost of a repost credits the repost it
+    points at.
+    """
+    move(WEIGHTS[event] * count, post_ids, now)
+
+
+def withdraw_thread(post_ids, comments, replies=0, now=None):
+    """
+    Withdraw ``comments`` comments and ``replies`` replies from the posts in
+    ``post_ids`` with one UPDATE, so deleting a post or a comment does not
+    cost an UPDATE for every row its cascade takes with it.
+    """
+    move(-(WEIGHTS['comment'] * comments + WEIGHTS['subcomment'] * replies), post_ids, now)
+
+
+def move(weight, post_ids, now=None):
+    # Levels add up like the weights they stand for, so any mix of events is one UPDATE
+    if not weight:
+        return
+    event_level = level(abs(weight), now)
+    # Engagement with a repost counts for the post it reposts
+    credited = Post.objects.filter(pk__in=post_ids).values(target=Coalesce('reposted_from_id', 'id'))
+    Post.objects.filter(pk__in=credited).update(trending_score=added(event_level) if weight > 0 else withdrawn(event_level))
+
+
+def reaction_changed(target, reaction, target_ids, delta):
+    # Hook for api.reactions; reactions to comments do not move their post
+    if target == 'post':
+        record(reaction, list(target_ids), delta)
+
+
+def floor(now=None):
+    return level(getattr(settings, 'TRENDING_MIN_SCORE', 0.05), now)
+
+
+def top(limit, now=None):
+    # Reads the partial index from the top; the floor skips scores that decayed since the last prune()
+    return (
+        Post.objects.filter(trending_score__gte=floor(now), is_public=True)
+        .order_by('-trending_score')[:limit]
+    )
+
+
+def prune(batch_size=1000, now=None):
+    """
+    Clear scores that have decayed below TRENDING_MIN_SCORE, ``batch_size``
+    posts per UPDATE. Returns the number of posts cleared.
+    """
+    cutoff = floor(now)
+    cleared = 0
+    while True:
+        ids = list(
+            Post.objects.filter(trending_score__lt=cutoff).order_by().values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return cleared
+        cleared += Post.objects.filter(pk__in=ids).update(trending_score=None)
+
+
+def log_sum(levels):
+    # log2(sum(2 ** level)), stable for large levels
+    high = max(levels)
+    return high + math.log2(sum(2 ** (value - high) for value in levels))
+
+
+def rebuild(days=7, batch_size=1000, now=None):
+    """
+    Recompute scores from the tables for posts created in the last
+    ``days`` and clear all others. Comments, replies and reposts count at
+    their own times; reactions carry no timestamp and count at the post's.
+    Returns the number of posts scored.
+    """
+    now = now or timezone.now()
+    since = now - timedelta(days=days)
+    Post.objects.exclude(trending_score=None).filter(created_at__lt=since).update(trending_score=None)
+    recent = Post.objects.filter(created_at__gte=since).order_by('id')
+    last_id, scored = 0, 0
+    while batch := list(recent.filter(id__gt=last_id).values_list('id', 'created_at', 'like_count', 'dislike_count')[:batch_size]):
+        last_id = batch[-1][0]
+        ids = [row[0] for row in batch]
+        levels = defaultdict(list)
+        for post_id, created_at, likes, dislikes in batch:
+            for event, count in (('like', likes), ('dislike', dislikes)):
+                if count:
+                    levels[post_id].append(level(WEIGHTS[event] * count, created_at))
+        events = (
+            ('comment', Comment.objects.filter(post_id__in=ids).values_list('post_id', 'created_at')),
+            ('subcomment', SubComment.objects.filter(comment__post_id__in=ids).values_list('comment__post_id', 'created_at')),
+            ('repost', Post.objects.filter(reposted_from_id__in=ids).values_list('reposted_from_id', 'created_at')),
+        )
+        for event, rows in events:
+            for post_id, created_at in rows:
+                levels[post_id].append(level(WEIGHTS[event], created_at))
+        posts = [Post(id=post_id, trending_score=log_sum(levels[post_id]) if levels[post_id] else None) for post_id in ids]
+        Post.objects.bulk_update(posts, ['trending_score'])
+        scored += sum(1 for post in posts if post.trending_score is not None)
+    return scored
@@ -1,11 +1,11 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
-from api import views
+from api import views, async_views
 
 urlpatterns = [
     # JWT Token endpoints
     path("token/", views.MyTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path("token/refresh/", TokenRefreshView.as_view(), name='token_refresh'),
+    path("token/refresh/", views.MyTokenRefreshView.as_view(), name='token_refresh'),
+    path("token/stats/", views.TokenStatsView.as_view(), name='token_stats'),  # Admin only
 
     # Registration endpoint
     path("register/", views.RegisterView.as_view(), name='register'),
@@ -21,14 +21,21 @@ urlpatterns = [
     path('<str:username>/following/', views.ListFollowingView.as_view(), name='list-following'),
     
     path('follow-unfollow/<str:username>/', views.FollowUnfollowUserView.as_view(), name='follow-user'),
+    path('users/suggestions/', views.FollowSuggestionsView.as_view(), name='follow-suggestions'),  # Friends of friends, ?limit=
     
     # Post endpoints
     path('posts/', views.PostsListView.as_view(), name='posts-list'),  # List public posts and user-specific posts
+    path('posts/trending/', views.TrendingPostsView.as_view(), name='posts-trending'),  # Top posts by decayed engagement, ?limit=
     path('posts/<int:pk>/', views.PostDetailView.as_view(), name='post-detail'),  # Retrieve, update, or delete a specific post
+    path('posts/<int:pk>/thread/', views.PostThreadView.as_view(), name='post-thread'),  # Post, a page of comments and their first replies
     path('posts/create/', views.PostCreateView.as_view(), name='post-create'), # Endpoint for creating a new post
     
     path('posts/repost/', views.RepostCreateView.as_view(), name='repost-create'),  # Create a repost
     
+    path('feed/', views.FeedView.as_view(), name='feed'),  # Home timeline built from followed accounts
+
+    path('search/', views.SearchView.as_view(), name='search'),  # ?q=...&type=posts|users, ranked full-text search
+    
     # path('posts/repost/<int:pk>/', views.RepostDetailView.as_view(), name='repost-detail'),  # Get, update, delete repost
 
     
@@ -53,4 +60,17 @@ urlpatterns = [
     path('subcomments/<int:pk>/', views.SubCommentDetailView.as_view(), name='subcomment-detail'),  # Retrieve, update, or delete a sub-comment
     path('subcomments/<int:subcomment_id>/like/', views.LikeUnlikeSubCommentView.as_view(), name='like-unlike-subcomment'),  # Like/unlike a sub-comment
 
+    # Batch of reactions (e.g. queued while offline) applied in one transaction
+    path('reactions/bulk/', views.ReactionBatchView.as_view(), name='reaction-batch'),
+
+    # Native async versions of the hot endpoints for ASGI deployments (same request/response shapes)
+    path('async/posts/<int:target_id>/like/', async_views.AsyncReactionView.as_view(target='post', reaction='like'), name='async-like-unlike-post'),
+    path('async/posts/<int:target_id>/dislike/', async_views.AsyncReactionView.as_view(target='post', reaction='dislike'), name='async-dislike-undislike-post'),
+    path('async/comments/<int:target_id>/like/', async_views.AsyncReactionView.as_view(target='comment', reaction='like'), name='async-like-unlike-comment'),
+    path('async/subcomments/<int:target_id>/like/', async_views.AsyncReactionView.as_view(target='subcomment', reaction='like'), name='async-like-unlike-subcomment'),
+    path('async/follow-unfollow/<str:username>/', async_views.AsyncFollowUnfollowUserView.as_view(), name='async-follow-user'),
+    path('async/posts/<int:post_id>/comments/', async_views.AsyncCommentListView.as_view(), name='async-comment-list'),
+    path('async/comments/create/', async_views.AsyncCommentCreateView.as_view(), name='async-comment-create'),
+    path('async/stream/', async_views.PostEventStreamView.as_view(), name='post-event-stream'),  # SSE: ?posts=1,2&token=...
+
 ]
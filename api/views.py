@@ -1,20 +1,39 @@
 from rest_framework import generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from api.models import User, Post, Comment, SubComment
-from api.serializers import UserSerializer, MyTokenObtainPairSerializer, RegisterSerializer, ProfileSerializer, PostSerializer, CommentSerializer, SubCommentSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+from api.serializers import UserSerializer, UserSummarySerializer, MyTokenObtainPairSerializer, MyTokenRefreshSerializer, RegisterSerializer, ProfileSerializer, PostSerializer, CommentSerializer, SubCommentSerializer, ThreadCommentSerializer, ReactionBatchSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.views import APIView
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.shortcuts import get_object_or_404
+from django.db.models import Q
+from django.utils import timezone
 
 from api import models
+from api.pagination import CreatedAtCursorPagination, UserCursorPagination, TimelinePagination, SearchPagination, ThreadPagination
+from api.querysets import users_for_serialization, user_summaries_for_serialization, posts_for_serialization, comments_for_serialization, subcomments_for_serialization, comments_with_replies
+from api import jobs, reaction_buffer, reactions, search, suggestions, timeline, tokens, trending
+from api.conditional import ConditionalGetMixin, POST_VALIDATORS, COMMENT_VALIDATORS, SUBCOMMENT_VALIDATORS, USER_VALIDATORS
+from api.renderers import StreamingListMixin
 
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
 
+class MyTokenRefreshView(TokenRefreshView):
+    serializer_class = MyTokenRefreshSerializer
+
+
+class TokenStatsView(APIView):
+    # Blacklist table sizes and this process's refresh latency, for operators
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(tokens.stats())
+
+
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [AllowAny]
@@ -40,16 +59,23 @@ class RegisterView(generics.CreateAPIView):
             headers=headers
         )
 
-class ProfileListView(generics.ListAPIView):
-    queryset = User.objects.all()
+class ProfileListView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = USER_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
 
-class ProfileDetailView(generics.RetrieveAPIView):
-    queryset = User.objects.all()
+    def get_queryset(self):
+        return users_for_serialization(User.objects.order_by('id'), self.request)
+
+class ProfileDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
+    validator_fields = USER_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        return users_for_serialization(User.objects.all(), self.request)
+
     def get_object(self):
         # Get the user object by its ID
         user = super().get_object()
@@ -61,8 +87,9 @@ class ProfileEditView(generics.UpdateAPIView):
     serializer_class = ProfileSerializer
 
     def get_object(self):
-        # Override get_object to retrieve the user instance based on the request
-        user = self.request.user  # Assuming user is authenticated and passed in request
+        # request.user may come from the authentication cache; the edit starts from the current row
+        user = self.request.user
+        user.refresh_from_db()
         return user
 
     
@@ -71,35 +98,44 @@ class ProfileEditView(generics.UpdateAPIView):
 class FollowUnfollowUserView(APIView):
     permission_classes = [IsAuthenticated]  # Only authenticated users can follow/unfollow
 
-    def post(self, request, username):
+    def get_target(self, request, username):
         # Retrieve the user object to follow/unfollow or return a 404 error if not found
         user_to_follow = get_object_or_404(User, username=username)
 
         # Check if the current user is trying to follow themselves
         if request.user == user_to_follow:
-            return Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Check if the current user is already following the specified user
-        if request.user.following.filter(id=user_to_follow.id).exists():
-            # If the user is already following, remove the following (unfollow)
-            request.user.following.remove(user_to_follow)  # Remove the user from following
-            is_following = False  # Set the follow status as unfollowed
-            message = "You have unfollowed the user."
-        else:
-            # If the user is not following, add the following
-            request.user.following.add(user_to_follow)  # Add the user to following
-            is_following = True  # Set the follow status as followed
-            message = "You are now following the user."
+            raise ValidationError({"error": "You cannot follow yourself."})
+        return user_to_follow
 
+    def follow_response(self, user_to_follow, is_following, message):
         return Response({
             "message": message,
             "is_following": is_following,
-            "followers_count": user_to_follow.followers.count()  # Return the updated followers count
+            # Return the updated followers count, follows still in the reaction buffer included
+            "followers_count": User.objects.values_list('followers_count', flat=True).get(pk=user_to_follow.pk)
+            + (reaction_buffer.buffer.pending_delta('user', 'follow', user_to_follow.pk) if reaction_buffer.enabled() else 0),
         }, status=status.HTTP_200_OK)
 
+    def post(self, request, username):
+        user_to_follow = self.get_target(request, username)
 
+        # Toggle with delete-or-insert, so two concurrent taps cannot both see "not following"
+        if reactions.unfollow(request.user, user_to_follow):
+            return self.follow_response(user_to_follow, False, "You have unfollowed the user.")
+        reactions.follow(request.user, user_to_follow)
+        return self.follow_response(user_to_follow, True, "You are now following the user.")
 
+    def put(self, request, username):
+        # Idempotent follow
+        user_to_follow = self.get_target(request, username)
+        reactions.follow(request.user, user_to_follow)
+        return self.follow_response(user_to_follow, True, "You are now following the user.")
 
+    def delete(self, request, username):
+        # Idempotent unfollow
+        user_to_follow = self.get_target(request, username)
+        reactions.unfollow(request.user, user_to_follow)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class FollowUserView(APIView):
@@ -113,12 +149,9 @@ class FollowUserView(APIView):
         if user_to_follow == current_user:
             return Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the user is already following the target user
-        if current_user.following.filter(id=user_to_follow.id).exists():
+        # Add the following relationship; the insert itself reports an existing follow
+        if not reactions.follow(current_user, user_to_follow):
             return Response({"error": "You are already following this user."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Add the following relationship
-        current_user.following.add(user_to_follow)
         
         # Optional: Return updated following list or user data
         return Response({"message": f"You are now following {user_to_follow.username}."}, status=status.HTTP_200_OK)
@@ -134,24 +167,75 @@ class UnfollowUserView(APIView):
         if user_to_unfollow == current_user:
             return Response({"error": "You cannot unfollow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
+        if not reactions.unfollow(current_user, user_to_unfollow):
+            return Response({"error": "You are not following this user."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"message": f"You have unfollowed {user_to_unfollow.username}."}, status=status.HTTP_200_OK)
 
 
-class ListFollowersView(generics.ListAPIView):
+class ListFollowersView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = USER_VALIDATORS  # Conditional GET, see api/conditional.py
     permission_classes = [IsAuthenticated]
-    serializer_class = UserSerializer
+    serializer_class = UserSummarySerializer
+    pagination_class = UserCursorPagination
 
     def get_queryset(self):
         user = get_object_or_404(User, username=self.kwargs['username'])
-        return user.followers.all()  # List all users who follow this user
+        return user_summaries_for_serialization(user.followers.all(), self.request)  # List all users who follow this user
 
 
-class ListFollowingView(generics.ListAPIView):
+class ListFollowingView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = USER_VALIDATORS  # Conditional GET, see api/conditional.py
     permission_classes = [IsAuthenticated]
-    serializer_class = UserSerializer
+    serializer_class = UserSummarySerializer
+    pagination_class = UserCursorPagination
 
     def get_queryset(self):
         user = get_object_or_404(User, username=self.kwargs['username'])
-        return user.following.all()  # List all users that this user is following
+        return user_summaries_for_serialization(user.following.all(), self.request)  # List all users that this user is following
+
+
+class FollowSuggestionsView(generics.GenericAPIView):
+    """
+    Accounts to follow, ranked by how many of the people the user follows
+    already follow them (``mutual_count``). Falls back to the most
+    followed accounts while the follow graph loads or when it has nothing
+    to offer, e.g. for new users.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = UserSummarySerializer
+    default_limit = 20
+    max_limit = 50
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Expected a number.'})
+        return max(1, min(limit, self.max_limit))
+
+    def get(self, request):
+        limit = self.get_limit()
+        ranked = suggestions.suggest(request.user.id, limit) or []
+        mutuals = dict(ranked)
+        users = User.objects.filter(is_active=True).exclude(pk=request.user.pk)
+        found = user_summaries_for_serialization(users, request).in_bulk([user_id for user_id, _ in ranked])
+        page = [found[user_id] for user_id, _ in ranked if user_id in found]
+        if len(page) < limit:
+            popular = (
+                users.exclude(pk__in=[user.pk for user in page]).exclude(followers=request.user)
+                .order_by('-followers_count', 'id')[:limit - len(page)]
+            )
+            page += list(user_summaries_for_serialization(popular, request))
+
+        data = self.get_serializer(page, many=True).data
+        for row in data:
+            row['mutual_count'] = mutuals.get(row['id'], 0)
+        return Response({'results': data})
+
+
+def fan_out_later(post):
+    # Push the post into followers' home timelines from a job, so the response does not wait on it
+    jobs.enqueue('timeline.fan_out_post', {'post_id': post.id}, key=f'fan-out:{post.id}')
 
 
 class PostCreateView(generics.CreateAPIView):
@@ -161,7 +245,9 @@ class PostCreateView(generics.CreateAPIView):
 
     def perform_create(self, serializer):
         # Set the author of the post to the current logged-in user
-        serializer.save(author=self.request.user)
+        post = serializer.save(author=self.request.user)
+        timeline.add_own_post(post)
+        fan_out_later(post)
 
         
 
@@ -195,6 +281,8 @@ class RepostCreateView(generics.CreateAPIView):
             content=repost_content,  # Set the content to the new format
             image=original_post.image  # Copy the original image
         )
+        timeline.add_own_post(repost)
+        fan_out_later(repost)
 
         # Serialize the repost instance to return the full post data
         serializer = self.get_serializer(repost)
@@ -204,27 +292,151 @@ class RepostCreateView(generics.CreateAPIView):
 
 
 
-class PostsListView(generics.ListAPIView):
+class PostsListView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = POST_VALIDATORS  # Conditional GET, see api/conditional.py
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [AllowAny]  # Allow any user to view public posts
+    pagination_class = CreatedAtCursorPagination
     
     def get_queryset(self):
         # Show only public posts or posts by the logged-in user
         if self.request.user.is_authenticated:
-            return Post.objects.filter(is_public=True) | Post.objects.filter(author=self.request.user)
+            queryset = Post.objects.filter(Q(is_public=True) | Q(author=self.request.user))
         else:
-            return Post.objects.filter(is_public=True)
+            queryset = Post.objects.filter(is_public=True)
+        return posts_for_serialization(queryset, self.request)
         
         
 
 
 
-class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Post.objects.all()
+class TrendingPostsView(generics.GenericAPIView):
+    """
+    The top ``?limit=`` (default 20) public posts by time-decayed
+    engagement, each with its current ``trending_score``. Served from the
+    post_trending_idx partial index, so it costs the same however many
+    posts exist.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [AllowAny]
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Expected a number.'})
+        return max(1, min(limit, self.max_limit))
+
+    def get(self, request):
+        now = timezone.now()
+        page = list(posts_for_serialization(trending.top(self.get_limit(), now), request))
+        data = self.get_serializer(page, many=True).data
+        for row, post in zip(data, page):
+            row['trending_score'] = round(trending.current_score(post.trending_score, now), 3)
+        return Response({'results': data})
+
+
+class FeedView(generics.ListAPIView):
+    serializer_class = PostSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = TimelinePagination
+
+    def list(self, request, *args, **kwargs):
+        # The paginator merges the timeline sources, then one query loads the page's posts
+        rows = self.paginate_queryset(timeline.timeline_sources(request.user))
+        # Visibility is checked again here, entries may outlive a post's switch to private
+        visible = Post.objects.filter(Q(is_public=True) | Q(author=request.user))
+        posts = posts_for_serialization(visible, request).in_bulk([row['post_id'] for row in rows])
+        page = [posts[row['post_id']] for row in rows if row['post_id'] in posts]
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class SearchView(generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = SearchPagination
+
+    # ?type= -> (search class, serializer, serialization plan)
+    search_types = {
+        'posts': (search.PostSearch, PostSerializer, posts_for_serialization),
+        'users': (search.UserSearch, UserSummarySerializer, user_summaries_for_serialization),
+    }
+
+    def get_search_type(self):
+        search_type = self.request.query_params.get('type', 'posts')
+        if search_type not in self.search_types:
+            raise ValidationError({'type': f"Expected one of: {', '.join(self.search_types)}."})
+        return self.search_types[search_type]
+
+    def get_serializer_class(self):
+        return self.get_search_type()[1]
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ValidationError({'q': 'This query parameter is required.'})
+        search_class, _, plan = self.get_search_type()
+        # The paginator returns ranked IDs, then one query loads the page's objects
+        rows = self.paginate_queryset(search_class(query, request.user))
+        objects = plan(search_class.model.objects.all(), request).in_bulk([row['id'] for row in rows])
+        page = [objects[row['id']] for row in rows if row['id'] in objects]
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class PostThreadView(generics.GenericAPIView):
+    """
+    A post with one page of its comments, each with its newest replies
+    (``?replies=``, default 3). Costs the same dozen queries however many
+    comments and replies the page holds.
+    """
+    permission_classes = [IsAuthenticated]
+    pagination_class = ThreadPagination
+    default_replies = 3
+    max_replies = 20
+
+    def get_replies(self):
+        try:
+            replies = int(self.request.query_params.get('replies', self.default_replies))
+        except ValueError:
+            raise ValidationError({'replies': 'Expected a number.'})
+        return max(0, min(replies, self.max_replies))
+
+    def get(self, request, pk):
+        post = get_object_or_404(posts_for_serialization(Post.objects.all(), request), pk=pk)
+        # Same rule as PostDetailView
+        if not (post.is_public or post.author_id == request.user.id):
+            raise PermissionDenied("You do not have permission to view this post.")
+
+        comments = comments_with_replies(post.comments.all(), request, self.get_replies())
+        page = self.paginate_queryset(comments)
+
+        # Register every row up front so the resolver answers each relation with one query
+        context = self.get_serializer_context()
+        post_serializer = PostSerializer(post, context=context)
+        comment_serializer = ThreadCommentSerializer(page, many=True, context=context)
+        post_serializer.register_relations([post])
+        comment_serializer.child.register_relations(page)
+        SubCommentSerializer(context=context).register_relations(
+            [reply for comment in page for reply in comment.first_replies]
+        )
+        return Response({
+            'post': post_serializer.data,
+            'comments': self.paginator.get_paginated_response(comment_serializer.data).data,
+        })
+
+
+class PostDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    validator_fields = POST_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = PostSerializer
     permission_classes = [IsAuthenticated]  # Only authenticated users can access
 
+    def get_queryset(self):
+        return posts_for_serialization(Post.objects.all(), self.request)
+
     def get_object(self):
         post = super().get_object()
         # Allow viewing the post if it's public or if the current user is the author
@@ -236,7 +448,13 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
     def perform_update(self, serializer):
         post = self.get_object()
         if post.author == self.request.user:
-            serializer.save()  # Save the updated post
+            was_public = post.is_public
+            post = serializer.save()  # Save the updated post
+            # Keep followers' timelines in step with the post's visibility
+            if was_public and not post.is_public:
+                timeline.retract_post(post)
+            elif not was_public and post.is_public:
+                jobs.enqueue('timeline.fan_out_post', {'post_id': post.id})
         else:
             raise PermissionDenied("You do not have permission to edit this post.")
 
@@ -249,40 +467,39 @@ class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
 class LikeUnlikePostView(APIView):
     permission_classes = [IsAuthenticated]  # Only authenticated users can like/unlike posts
 
+    # POST toggles, PUT/DELETE set the state idempotently; each is a single
+    # insert or delete on the through table plus an F() counter update
+
     def post(self, request, post_id):
-        # Retrieve the post object or return a 404 error if not found
-        post = get_object_or_404(Post, id=post_id)
-        
-        # Check if the current user has already liked the post
-        if post.likes.filter(id=request.user.id).exists():
-            # If the user has liked the post, remove the like (unlike)
-            post.likes.remove(request.user)  # Remove the current user from the likes
-            return Response({"message": "You have unliked the post."}, status=status.HTTP_200_OK)
-        else:
-            # If the user has not liked the post, add the like
-            post.likes.add(request.user)  # Add the current user to the likes
+        if reactions.toggle('post', 'like', post_id, request.user.id):
             return Response({"message": "You have liked the post."}, status=status.HTTP_200_OK)
-        
-        
+        return Response({"message": "You have unliked the post."}, status=status.HTTP_200_OK)
+
+    def put(self, request, post_id):
+        reactions.add('post', 'like', post_id, request.user.id)
+        return Response({"liked": True}, status=status.HTTP_200_OK)
+
+    def delete(self, request, post_id):
+        reactions.remove('post', 'like', post_id, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class DislikeUndislikePostView(APIView):
     permission_classes = [IsAuthenticated]
-    
+
     def post(self, request, post_id):
-        # Retrieve the post object or return a 404 error if the post is not found
-        post = get_object_or_404(Post, id=post_id)
-        
-        # Check if the current user has already disliked the post
-        if post.dislikes.filter(id=request.user.id).exists():
-            # If the user has disliked the post, remove the dislike (undislike)
-            post.dislikes.remove(request.user)
-            return Response({"message": "You have undiliked the post."}, status=status.HTTP_200_OK)
-        else:
-            # if the user has not disliked the post, add the dislike
-            post.dislikes.add(request.user) # add the current user to the dislikes
+        if reactions.toggle('post', 'dislike', post_id, request.user.id):
             return Response({"message": "You have disliked the post."}, status=status.HTTP_200_OK)
-            
-            
-        
+        return Response({"message": "You have undiliked the post."}, status=status.HTTP_200_OK)
+
+    def put(self, request, post_id):
+        reactions.add('post', 'dislike', post_id, request.user.id)
+        return Response({"disliked": True}, status=status.HTTP_200_OK)
+
+    def delete(self, request, post_id):
+        reactions.remove('post', 'dislike', post_id, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class CommentCreateView(generics.CreateAPIView):
     serializer_class = CommentSerializer
@@ -292,22 +509,25 @@ class CommentCreateView(generics.CreateAPIView):
         post = get_object_or_404(Post, id=self.request.data['post'])  # Get the post
         serializer.save(author=self.request.user, post=post)  # Save the comment with the current user and post
 
-class CommentListView(generics.ListAPIView):
+class CommentListView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = COMMENT_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         post = get_object_or_404(Post, id=self.kwargs['post_id'])  # Get the post
-        return post.comments.all()  # Return all comments for the post
+        return comments_for_serialization(post.comments.all(), self.request)  # Return all comments for the post
     
     
-class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
+class CommentDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    validator_fields = COMMENT_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
         # Retrieve the comment object based on the provided ID
-        comment = get_object_or_404(Comment, id=self.kwargs['pk'])
+        comment = get_object_or_404(comments_for_serialization(Comment.objects.all(), self.request), id=self.kwargs['pk'])
         return comment
 
     def perform_update(self, serializer):
@@ -331,20 +551,19 @@ class LikeUnlikeCommentView(APIView):
     permission_classes = [IsAuthenticated]  # Only authenticated users can like/unlike comments
 
     def post(self, request, comment_id):
-        # Retrieve the comment object or return a 404 error if not found
-        comment = get_object_or_404(Comment, id=comment_id)
-        
-        # Check if the current user has already liked the comment
-        if comment.likes.filter(id=request.user.id).exists():
-            # If the user has liked the comment, remove the like (unlike)
-            comment.likes.remove(request.user)  # Remove the current user from the likes
-            return Response({"message": "You have unliked the comment."}, status=status.HTTP_200_OK)
-        else:
-            # If the user has not liked the comment, add the like
-            comment.likes.add(request.user)  # Add the current user to the likes
+        if reactions.toggle('comment', 'like', comment_id, request.user.id):
             return Response({"message": "You have liked the comment."}, status=status.HTTP_200_OK)
-        
-        
+        return Response({"message": "You have unliked the comment."}, status=status.HTTP_200_OK)
+
+    def put(self, request, comment_id):
+        reactions.add('comment', 'like', comment_id, request.user.id)
+        return Response({"liked": True}, status=status.HTTP_200_OK)
+
+    def delete(self, request, comment_id):
+        reactions.remove('comment', 'like', comment_id, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class SubCommentCreateView(generics.CreateAPIView):
     serializer_class = SubCommentSerializer
     permission_classes = [IsAuthenticated]
@@ -355,22 +574,25 @@ class SubCommentCreateView(generics.CreateAPIView):
         # Save the sub-comment with the current user as the author and link it to the comment
         serializer.save(author=self.request.user, comment=comment)  
 
-class SubCommentListView(generics.ListAPIView):
+class SubCommentListView(ConditionalGetMixin, StreamingListMixin, generics.ListAPIView):
+    validator_fields = SUBCOMMENT_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = SubCommentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
 
     def get_queryset(self):
         # Get the comment to retrieve sub-comments for
         comment = get_object_or_404(Comment, id=self.kwargs['comment_id'])  # Retrieve the comment
-        return comment.sub_comments.all()  # Return all sub-comments related to the comment
+        return subcomments_for_serialization(comment.sub_comments.all(), self.request)  # Return all sub-comments related to the comment
 
-class SubCommentDetailView(generics.RetrieveUpdateDestroyAPIView):
+class SubCommentDetailView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    validator_fields = SUBCOMMENT_VALIDATORS  # Conditional GET, see api/conditional.py
     serializer_class = SubCommentSerializer
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
         # Retrieve the sub-comment object based on the provided ID
-        subcomment = get_object_or_404(SubComment, id=self.kwargs['pk'])
+        subcomment = get_object_or_404(subcomments_for_serialization(SubComment.objects.all(), self.request), id=self.kwargs['pk'])
         return subcomment
 
     def perform_update(self, serializer):
@@ -394,15 +616,25 @@ class LikeUnlikeSubCommentView(APIView):
     permission_classes = [IsAuthenticated]  # Only authenticated users can like/unlike sub-comments
 
     def post(self, request, subcomment_id):
-        # Retrieve the sub-comment object or return a 404 error if not found
-        subcomment = get_object_or_404(SubComment, id=subcomment_id)
-
-        # Check if the current user has already liked the sub-comment
-        if subcomment.likes.filter(id=request.user.id).exists():
-            # If the user has liked the sub-comment, remove the like (unlike)
-            subcomment.likes.remove(request.user)  # Remove the current user from the likes
-            return Response({"message": "You have unliked the sub-comment."}, status=status.HTTP_200_OK)
-        else:
-            # If the user has not liked the sub-comment, add the like
-            subcomment.likes.add(request.user)  # Add the current user to the likes
-            return Response({"message": "You have liked the sub-comment."}, status=status.HTTP_200_OK)
\ No newline at end of file
+        if reactions.toggle('subcomment', 'like', subcomment_id, request.user.id):
+            return Response({"message": "You have liked the sub-comment."}, status=status.HTTP_200_OK)
+        return Response({"message": "You have unliked the sub-comment."}, status=status.HTTP_200_OK)
+
+    def put(self, request, subcomment_id):
+        reactions.add('subcomment', 'like', subcomment_id, request.user.id)
+        return Response({"liked": True}, status=status.HTTP_200_OK)
+
+    def delete(self, request, subcomment_id):
+        reactions.remove('subcomment', 'like', subcomment_id, request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ReactionBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Apply a queue of likes/dislikes across posts, comments and sub-comments in one transaction
+        serializer = ReactionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = reactions.apply_batch(request.user.id, serializer.validated_data['reactions'])
+        return Response({"results": results}, status=status.HTTP_200_OK)
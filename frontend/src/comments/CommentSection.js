@@ -6,6 +6,7 @@ import { motion, AnimatePresence } from 'framer-motion';
 import formatDate from '../formatting/FormatDate';
 import SubCommentSection from './SubCommentSection';
 import { useAuth } from '../context/AuthContext';
+import { subscribeToPost } from '../realtime/postEvents';
 import { Link } from 'react-router-dom';
 
 
@@ -17,6 +18,7 @@ const CommentSection = ({ postId }) => {
     const [pendingLikes, setPendingLikes] = useState(new Set());
     const [editingCommentId, setEditingCommentId] = useState(null);
     const [editingCommentContent, setEditingCommentContent] = useState('');
+    const [refreshKey, setRefreshKey] = useState(0);
     const { authState } = useAuth();
 
     useEffect(() => {
@@ -42,7 +44,26 @@ const CommentSection = ({ postId }) => {
         };
 
         fetchComments();
-    }, [postId]);
+    }, [postId, refreshKey]);
+
+    // Live updates instead of re-fetching: new comments and like counts pushed by the server
+    useEffect(() => subscribeToPost(postId, (event) => {
+        if (event.type === 'comment.created') {
+            setComments((prevComments) =>
+                prevComments.some(comment => comment.id === event.comment.id)
+                    ? prevComments
+                    : [event.comment, ...prevComments]
+            );
+        } else if (event.type === 'reaction.counts' && event.target === 'comment') {
+            setComments((prevComments) =>
+                prevComments.map(comment =>
+                    comment.id === event.id ? { ...comment, like_count: event.like_count } : comment
+                )
+            );
+        } else if (event.type === 'resync') {
+            setRefreshKey((key) => key + 1);
+        }
+    }), [postId]);
 
     const createOrEditComment = async (e, commentId = null) => {
         e.preventDefault();
@@ -367,7 +388,7 @@ const CommentSection = ({ postId }) => {
                                         exit={{ opacity: 0, height: 0 }}
                                         className="mt-4 border-l-2 border-gray-200"
                                     >
-                                        <SubCommentSection commentId={comment.id} />
+                                        <SubCommentSection commentId={comment.id} postId={postId} />
                                     </motion.div>
                                 )}
                             </AnimatePresence>
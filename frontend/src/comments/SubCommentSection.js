@@ -2,13 +2,15 @@ import React, { useState, useEffect, useCallback } from 'react';
 import { User, ThumbsUp, Send, AlertCircle, Reply } from 'lucide-react';
 import {motion, AnimatePresence} from 'framer-motion';
 import { Link } from 'react-router-dom';
+import { subscribeToPost } from '../realtime/postEvents';
 
-const SubCommentSection = ({ commentId, userId }) => {
+const SubCommentSection = ({ commentId, postId, userId }) => {
     const [subComments, setSubComments] = useState([]);
     const [subComment, setSubComment] = useState('');
     const [error, setError] = useState(null);
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [pendingLikes, setPendingLikes] = useState(new Set());
+    const [refreshKey, setRefreshKey] = useState(0);
 
     useEffect(() => {
         const fetchSubComments = async () => {
@@ -30,7 +32,25 @@ const SubCommentSection = ({ commentId, userId }) => {
         };
 
         fetchSubComments();
-    }, [commentId]);
+    }, [commentId, refreshKey]);
+
+    // Replies and like counts pushed over the post's event stream
+    useEffect(() => {
+        if (!postId) return undefined;
+        return subscribeToPost(postId, (event) => {
+            if (event.type === 'subcomment.created' && event.comment === commentId) {
+                setSubComments((prev) =>
+                    prev.some(sub => sub.id === event.subcomment.id) ? prev : [...prev, event.subcomment]
+                );
+            } else if (event.type === 'reaction.counts' && event.target === 'subcomment' && event.comment_id === commentId) {
+                setSubComments((prev) =>
+                    prev.map(sub => (sub.id === event.id ? { ...sub, like_count: event.like_count } : sub))
+                );
+            } else if (event.type === 'resync') {
+                setRefreshKey((key) => key + 1);
+            }
+        });
+    }, [postId, commentId]);
 
     const handleSubCommentSubmit = async (e) => {
         e.preventDefault();
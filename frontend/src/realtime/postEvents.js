@@ -0,0 +1,58 @@
+// One Server-Sent Events connection for every post on screen. Components
+// subscribe per post; the stream reconnects with the new post list when the
+// set changes. Events: comment.created, subcomment.created, reaction.counts
+// and resync (the server dropped events, re-fetch).
+const STREAM_URL = 'http://127.0.0.1:8000/api/async/stream/';
+const EVENT_TYPES = ['comment.created', 'subcomment.created', 'reaction.counts', 'resync'];
+
+const listeners = new Map(); // postId -> Set of handlers
+let source = null;
+let reconnectTimer = null;
+
+const dispatch = (event) => {
+    // resync carries no post, every subscriber re-fetches
+    const postIds = event.post ? [event.post] : [...listeners.keys()];
+    postIds.forEach((postId) => {
+        (listeners.get(postId) || []).forEach((handler) => handler(event));
+    });
+};
+
+const connect = () => {
+    reconnectTimer = null;
+    if (source) {
+        source.close();
+        source = null;
+    }
+    const token = localStorage.getItem('token');
+    if (!listeners.size || !token) return;
+
+    const posts = [...listeners.keys()].join(',');
+    source = new EventSource(`${STREAM_URL}?posts=${posts}&token=${encodeURIComponent(token)}`);
+    EVENT_TYPES.forEach((type) => {
+        source.addEventListener(type, (message) => dispatch(JSON.parse(message.data)));
+    });
+};
+
+// Subscriptions made during one render are batched into a single reconnect
+const scheduleConnect = () => {
+    if (!reconnectTimer) reconnectTimer = setTimeout(connect, 50);
+};
+
+export const subscribeToPost = (postId, handler) => {
+    const key = Number(postId);
+    if (!listeners.has(key)) {
+        listeners.set(key, new Set());
+        scheduleConnect();
+    }
+    listeners.get(key).add(handler);
+
+    return () => {
+        const handlers = listeners.get(key);
+        if (!handlers) return;
+        handlers.delete(handler);
+        if (!handlers.size) {
+            listeners.delete(key);
+            scheduleConnect();
+        }
+    };
+};
@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',  # First, so its latency covers everything below
+    'api.compression.CompressionMiddleware',  # gzip/brotli, before anything that reads the body
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -140,8 +142,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication', 
-    )
+        'api.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 
@@ -177,4 +183,104 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Home timeline (api/timeline.py): authors with at least this many followers
+# are merged into feeds at read time instead of being fanned out on write
+TIMELINE_FANOUT_THRESHOLD = 10000
+TIMELINE_BACKFILL_LIMIT = 20  # Recent posts copied into a timeline on follow
+
+# Image derivatives (api/images.py): 'thread', 'process', 'jobs' (the job queue) or 'sync' (inline, for tests)
+IMAGE_PIPELINE_EXECUTOR = 'thread'
+IMAGE_PIPELINE_WORKERS = 2
+
+# Media serving (api/media.py). Set MEDIA_SENDFILE to 'nginx' (X-Accel-Redirect to
+# MEDIA_SENDFILE_PREFIX, an internal location aliased to MEDIA_ROOT) or 'sendfile'
+# (X-Sendfile with the absolute path) to let the front proxy send the bytes
+MEDIA_SENDFILE = None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 3600  # Seconds; derivative files are cached as immutable
+
+# Full-text search (api/search.py): rank at most this many of the newest matches per query
+SEARCH_CANDIDATE_LIMIT = 10000
+
+# Async views (api/async_views.py): requests doing database work at once per event loop
+ASYNC_DB_CONCURRENCY = 32
+
+# Realtime push (api/realtime.py): swap the broker for an external one when running several processes
+REALTIME_BROKER = 'api.realtime.InProcessBroker'
+REALTIME_KEEPALIVE = 15  # Seconds between SSE keepalive comments
+REALTIME_MAX_QUEUED = 256  # Undelivered events per stream before it is told to resync
+
+# Authentication (api/authentication.py): read-only requests trust the signed token
+# claims for CLAIMS_MAX_AGE seconds after it was issued; everything else resolves users
+# through a per-process cache. A deactivated account is locked out once both have passed
+AUTH_TRUST_TOKEN_CLAIMS = True
+AUTH_CLAIMS_MAX_AGE = 60  # Seconds
+AUTH_USER_CACHE_TTL = 60  # Seconds; 0 disables the cache
+AUTH_USER_CACHE_SIZE = 1024
+
+# Refresh token blacklist (api/tokens.py): a bloom filter answers most blacklist checks;
+# before it answers "not blacklisted" it reads the rows added since its last catch-up,
+# unless that was less than SYNC_INTERVAL seconds ago
+TOKEN_BLACKLIST_FILTER = True
+TOKEN_BLACKLIST_SYNC_INTERVAL = 0.0  # Above 0, a token blacklisted elsewhere may be accepted for that long
+TOKEN_BLACKLIST_GAP_TIMEOUT = 60  # Seconds an out-of-order id is waited for
+TOKEN_BLACKLIST_FILTER_CAPACITY = 100_000
+
+# Metrics (api/metrics.py): per-view latency, SQL, serializer, render and size histograms
+# at /metrics. Each process aggregates its own; with several workers, point METRICS_DIR at
+# a directory they share (emptied on deploy) and any of them can answer the scrape
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5  # Seconds between writes of a worker's snapshot to METRICS_DIR
+METRICS_TOKEN = None  # /metrics requires "Authorization: Bearer <token>"; left unset, it is served only with DEBUG on
+
+# Follow suggestions (api/suggestions.py): the follow graph is held in arrays of at most
+# MEMORY_BUDGET bytes (twice that while a reload builds the next copy) and rebuilt in the
+# background after OVERLAY_LIMIT follow changes or RELOAD_INTERVAL seconds. 'sync' loads inline
+SUGGESTIONS_LOADER = 'thread'
+SUGGESTIONS_MEMORY_BUDGET = 64 * 2**20  # 10M follows among a million users: 52MB, 60MB while building
+SUGGESTIONS_OVERLAY_LIMIT = 100_000
+SUGGESTIONS_RELOAD_INTERVAL = 600
+SUGGESTIONS_FANOUT = 500  # Follows walked per account at each of the two hops
+
+# Trending (api/trending.py): engagement halves in weight every HALF_LIFE seconds; scores
+# below MIN_SCORE are cleared by the prune_trending command, which should run periodically
+TRENDING_HALF_LIFE = 6 * 3600
+TRENDING_MIN_SCORE = 0.05
+
+# JSON responses (api/renderers.py, api/compression.py): 'orjson' renders through orjson when
+# it is installed, 'stdlib' through DRF's encoder. Unpaginated lists are streamed from the
+# database STREAM_CHUNK_SIZE rows at a time; text responses are compressed with brotli (if
+# installed) or gzip, whichever the client prefers
+API_JSON_ENCODER = 'orjson'
+API_STREAM_LISTS = True
+API_STREAM_CHUNK_SIZE = 500
+API_LEGACY_LIST_LIMIT = 1000  # Rows in a list requested without cursor or page_size; None for all
+API_COMPRESSION = True
+API_COMPRESSION_MIN_SIZE = 200  # Bytes; smaller bodies are sent as they are
+API_BROTLI_QUALITY = 5
+
+# Reaction buffer (api/reaction_buffer.py): likes, dislikes and follows are accepted in memory
+# and written in one transaction every INTERVAL seconds or once MAX_PENDING are waiting, so a
+# burst takes SQLite's write lock once instead of once per tap. Pending state is flushed at
+# exit; with LOG_DIR set it is also logged (fsynced) first and replayed after a crash.
+# 'sync' runs no flusher thread: flushes happen at MAX_PENDING, at exit or by hand
+REACTION_BUFFER = False
+REACTION_BUFFER_FLUSHER = 'thread'
+REACTION_BUFFER_INTERVAL = 0.2
+REACTION_BUFFER_MAX_PENDING = 1000
+REACTION_BUFFER_LOG_DIR = None
+REACTION_BUFFER_MAX_ATTEMPTS = 5  # Failed writes of one state before it is dropped and logged
+
+# Job queue (api/jobs.py): deferred work kept in the Job table. 'worker' leaves jobs to
+# `manage.py run_jobs`, which must be running next to the web processes; 'sync' runs each
+# inline when it is enqueued (tests). QUEUES caps the jobs of each queue running at once
+# across all workers
+JOBS_RUNNER = 'worker'
+JOBS_QUEUES = {'default': 4, 'timeline': 4, 'media': 2}
+JOBS_DEFAULT_CONCURRENCY = 1  # For queues missing from JOBS_QUEUES
+JOBS_LEASE = 300  # Seconds a worker may hold a job before it is presumed dead and the job retried
+JOBS_RETRY_BACKOFF = 5  # Seconds before the first retry, doubling each attempt
+JOBS_RETRY_BACKOFF_MAX = 3600
@@ -1,13 +1,16 @@
-from django.views.static import serve
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include, re_path
 from django.contrib import admin
 from django.views.generic import TemplateView
 
+from api.media import serve
+from api.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("api.urls")),
+    path('metrics', metrics_view),
     re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
     re_path('', TemplateView.as_view(template_name='index.html')),
 ]